@@ -1,68 +1,116 @@
 import argparse
-import hashlib
-import re
-import pandas as pd
-
-# Function to compute MD5 hash for a given sequence
-def md5_hash(sequence):
-    return hashlib.md5(sequence.encode()).hexdigest()
-
-# Function to normalize the DNA sequence
-def normalize_sequence(sequence):
-    # Convert to lowercase
-    sequence = sequence.lower()
-    # Replace non-ACGT characters with 'n'
-    sequence = re.sub(r'[^acgt]', 'n', sequence)
-    return sequence
+import csv
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from query.codec import encode_profile
+from query.profile_db import read_reference_loci as read_loci
+from query.seqio import read_profile
+
+# MLSType "accepted" flags of loci without a usable allele: 32 duplicated, 64 fragmented
+UNCALLED_FLAGS = 32 | 64
+
+TSV_FIELDS = ["submissionId", "collectionDate", "location", "profileHash"]
+
+# Reference alleles of the cgMLST scheme, whose locus order the hashes follow unless another reference is given
+DEFAULT_REFERENCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test", "cgMLST_v2_ref.fasta")
+
+# Function to read the locus order of a reference FASTA, the order of the MLSType output of a complete genome.
+# The loci of a reference are read once per process
+@lru_cache(maxsize=None)
+def read_reference_loci(reference_fasta=DEFAULT_REFERENCE):
+    return tuple(read_loci(reference_fasta))
+
+# Function to compute the hashes of a profile from query.sequence_align.MLSProfile, a dict of locus to (MD5 of the
+# normalized allele, accepted flags), in the locus order of reference_loci (by default that of DEFAULT_REFERENCE),
+# with empty hashes for the loci that MLSType did not report or could not call, so they count as missing.
+# Raises ValueError if no locus is called or a called locus is not in reference_loci, as the output was then
+# called with another scheme and its hashes would be dropped
+def hash_profile(profile, reference_loci=None):
+    reference_loci = read_reference_loci() if reference_loci is None else reference_loci
+    hashes = {locus: digest for locus, (digest, flags) in profile.items() if digest and not flags & UNCALLED_FLAGS}
+    if not hashes:
+        raise ValueError("no locus is called in the profile")
+    unknown = hashes.keys() - set(reference_loci)
+    if unknown:
+        raise ValueError(f"{len(unknown)} of the {len(hashes)} called loci are not in the reference, "
+                         f"e.g. {', '.join(sorted(unknown)[:3])}")
+    return [hashes.get(locus, "") for locus in reference_loci]
+
+# Function to compute the hashes of MLSType FASTA output given as bytes or text, laid out as hash_profile
+def hash_text(data, reference_loci=None):
+    return hash_profile(read_profile(data), reference_loci)
+
+# Function to hash one MLSType output file
+def hash_file(path, reference_loci=None):
+    with open(path, "rb") as fasta_file:
+        data = fasta_file.read()
+    try:
+        return hash_text(data, reference_loci)
+    except ValueError as error:
+        raise ValueError(f"{path}: {error}") from error
+
+# Function to write the hashes of a profile as the profileHash field, comma-separated or compact (see query/codec.py)
+def profile_field(hashes, compact=False):
+    return encode_profile(hashes) if compact else ",".join(hashes)
 
 # Function to process FASTA file and generate the desired TSV output
-def generate_tsv(input_fasta, output_tsv, submission_id, collection_date, location):
-    # List to store all computed hashes
-    hashes = []
-    # Read the FASTA file and compute the hash for each gene/sequence
-    with open(input_fasta, "r") as fasta_file:
-        for line in fasta_file:
-            if not line.startswith(">"):
-                sequence = line.strip()
-                normalized_sequence = normalize_sequence(sequence)  # Normalize the sequence
-                hash_value = md5_hash(normalized_sequence)  # Compute MD5 hash
-                hashes.append(hash_value)  # Store the hash
-
-    # Combine all hashes into a single string separated by commas
-    profile_hash = ",".join(hashes)
-
-    # Create a DataFrame for the output
-    data = {
-        "submissionId": [submission_id],
-        "collectionDate": [collection_date],
-        "location": [location],
-        "profileHash": [profile_hash]
-    }
-
-    df = pd.DataFrame(data)
-
-    # Write the DataFrame to a TSV file
-    df.to_csv(output_tsv, sep="\t", index=False)
+def generate_tsv(input_fasta, output_tsv, submission_id, collection_date, location, reference_loci=None, compact=False):
+    # Read the FASTA file and compute the hash for each allele
+    hashes = hash_file(input_fasta, reference_loci)
+
+    with open(output_tsv, "w", newline="") as tsv_file:
+        writer = csv.writer(tsv_file, delimiter="\t", lineterminator="\n")
+        writer.writerow(TSV_FIELDS)
+        writer.writerow([submission_id, collection_date, location, profile_field(hashes, compact)])
     print(f"Output written to: {output_tsv}")
 
+# Function to hash every MLSType output in a directory into one TSV with a row per file, named after the file.
+# Files are read and hashed on a thread pool, while the rows are written in the order of the file names
+def generate_batch_tsv(input_dir, output_tsv, collection_date, location, reference_loci=None, threads=8, compact=False):
+    files = sorted(name for name in os.listdir(input_dir)
+                   if not name.startswith(".") and os.path.isfile(os.path.join(input_dir, name)))
+    with open(output_tsv, "w", newline="") as tsv_file, ThreadPoolExecutor(max_workers=threads) as executor:
+        writer = csv.writer(tsv_file, delimiter="\t", lineterminator="\n")
+        writer.writerow(TSV_FIELDS)
+        hashed = executor.map(lambda name: hash_file(os.path.join(input_dir, name), reference_loci), files)
+        for name, hashes in zip(files, hashed):
+            writer.writerow([name.split(".")[0], collection_date, location, profile_field(hashes, compact)])
+    print(f"{len(files)} profiles written to: {output_tsv}")
+
 # Main function to handle command-line arguments and call the generate_tsv function
 def main():
     # Create an ArgumentParser object
     parser = argparse.ArgumentParser(description="Generate TSV output with MD5 hashes from a FASTA file.")
 
     # Define command-line arguments
-    parser.add_argument("-i", "--input", required=True, help="Path to the input FASTA file.")
+    parser.add_argument("-i", "--input", required=True, help="Path to the input FASTA file, or a directory of them for one row per file.")
     parser.add_argument("-o", "--output", required=True, help="Path to the output TSV file.")
-    parser.add_argument("-n", "--submission_id", required=True, help="Submission ID for the sequences.")
+    parser.add_argument("-n", "--submission_id", help="Submission ID for the sequences (a directory uses the file names).")
     parser.add_argument("-d", "--date", required=True, help="Collection date in ISO format (YYYY-MM-DD).")
     parser.add_argument("-l", "--location", required=True, help="Location where the sequences were collected.")
+    parser.add_argument("-r", "--reference", default=DEFAULT_REFERENCE, help="Reference FASTA of the cgMLST scheme, to order the hashes by its loci (default: test/cgMLST_v2_ref.fasta).")
+    parser.add_argument("-t", "--threads", type=int, default=8, help="Number of files hashed at once in a directory.")
+    parser.add_argument("-c", "--compact", action="store_true", help="Write compact profiles, about 3 times smaller than the comma-separated hashes.")
 
     # Parse command-line arguments
     args = parser.parse_args()
+    reference_loci = read_reference_loci(args.reference)
 
     # Call the generate_tsv function with parsed arguments
-    generate_tsv(args.input, args.output, args.submission_id, args.date, args.location)
+    if not os.path.isdir(args.input) and args.submission_id is None:
+        parser.error("the following arguments are required for a single file: -n/--submission_id")
+    try:
+        if os.path.isdir(args.input):
+            generate_batch_tsv(args.input, args.output, args.date, args.location, reference_loci, args.threads, args.compact)
+        else:
+            generate_tsv(args.input, args.output, args.submission_id, args.date, args.location, reference_loci, args.compact)
+    except ValueError as error:
+        # No TSV is left behind for a profile that does not match the reference
+        if os.path.exists(args.output):
+            os.remove(args.output)
+        parser.exit(1, f"{parser.prog}: error: {error}\n")
 
 # If this script is run directly, execute the main function
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,59 +1,124 @@
 import os
-from query.sequence_align import MLSType
-from Hashing import generate_tsv
+import sys
+import click
+import shutil
+from query.sequence_align import MLSProfile
+from Hashing import hash_profile, profile_field, read_reference_loci
 from submit import ask_for_password, get_loculus_authentication_token, get_submission_ids_from_tsv, generate_placeholder_fasta
 import random
 from submit import submit as submit_main
 import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import datetime, timedelta
 
 
+TSV_HEADER = 'submissionId\tcollectionDate\tlocation\tprofileHash\n'
+
+
 def random_date_within_last_six_months():
     today = datetime.today()
     six_months_ago = today - timedelta(days=6*30)
     random_date = six_months_ago + (today - six_months_ago) * random.random()
     return random_date.strftime('%Y-%m-%d')
 
-def process_fasta_file(file_path):
-    # Add your processing logic here
-    print(f"Processing {file_path}")
-    args = ["--refAllele", 'test/cgMLST_v2_ref.fasta', '--genome', file_path, "--unique_key", os.path.basename(file_path).split('.')[0]]
-    mlst_type = MLSType(args) # -i/--genome, -r/--refAllele, -k/--unique_key
-    with open('temp_mlst_type.txt', 'w') as temp_file:
-        temp_file.write(mlst_type)
+def genome_id(file_path):
+    return os.path.basename(file_path).split('.')[0]
+
+def process_fasta_file(file_path, reference='test/cgMLST_v2_ref.fasta', n_thread=6, tmp_dir='.', exact_prepass=False, streaming=False, adaptive=False, compact=False, cache=False):
+    """
+    Calls the alleles of one assembly and returns its row of the submission TSV. All temporary files of the
+    call go to a directory of its own under tmp_dir, so that calls can run in parallel.
+    """
+    work_dir = tempfile.mkdtemp(prefix='call_{}_'.format(genome_id(file_path)), dir=tmp_dir)
+    try:
+        args = ["--refAllele", reference, '--genome', file_path, "--unique_key", genome_id(file_path),
+                '--n_thread', str(n_thread), '--tmp_dir', work_dir] + (['--exact_prepass'] if exact_prepass else []) \
+               + (['--streaming'] if streaming else []) + (['--adaptive'] if adaptive else []) + (['--cache'] if cache else [])
+        profile = MLSProfile(args) # -i/--genome, -r/--refAllele, -k/--unique_key
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
     countries = ['USA', 'UK', 'Germany', 'France', 'Italy', 'Spain', 'China', 'Japan', 'Australia']
     random_country = random.choice(countries)
-    print(f"Selected country: {random_country}")
-
     collection_date = random_date_within_last_six_months()
-    print(f"Selected collection date: {collection_date}")
-
-    generate_tsv('temp_mlst_type.txt', 'output.tsv', os.path.basename(file_path).split('.')[0], collection_date, random_country)
-    with open('output.tsv', 'r') as tsv_file:
-        lines = tsv_file.readlines()
-        if len(lines) > 1:
-            second_line = lines[1].strip()
-    return second_line
-
-    
-
-
-def main():
-    folder_path = '/Users/nfareed/code/pathinder-client/sal_review'
-    all_tsv_out = []
-    if not os.path.exists('all_tsv_out.tsv') or True:
-        for filename in os.listdir(folder_path):
-            if filename.endswith('.fasta'):
-                file_path = os.path.join(folder_path, filename)
-                all_tsv_out.append(process_fasta_file(file_path))
-                # write all_tsv_out to a file . headers are submissionId	collectionDate	location	profileHash 
-                with open('all_tsv_out.tsv', 'w') as tsv_file:
-                    tsv_file.write('submissionId\tcollectionDate\tlocation\tprofileHash\n')
-                    for line in all_tsv_out:
-                        tsv_file.write(line + '\n')
+    profile_hash = profile_field(hash_profile(profile, read_reference_loci(reference)), compact)
+    return '\t'.join([genome_id(file_path), collection_date, random_country, profile_hash])
+
+
+def read_finished(tsv_path):
+    """
+    Returns the genomes already in the output TSV of an interrupted run. A last row that was cut off while
+    writing is dropped from the file, so that genome is called again, and the header is written if the file
+    does not start with a complete one (e.g. a new or empty file, or one cut off in its first line).
+    """
+    with open(tsv_path, 'ab+') as tsv_file:
+        tsv_file.seek(0)
+        content = tsv_file.read()
+        complete = content[:content.rfind(b'\n') + 1]
+        rows = complete.splitlines(keepends=True)
+        if rows[:1] != [TSV_HEADER.encode()]:
+            rows.insert(0, TSV_HEADER.encode())
+        if b''.join(rows) != content:
+            tsv_file.truncate(0)
+            tsv_file.write(b''.join(rows))
+    return {line.split(b'\t', 1)[0].decode() for line in rows[1:] if line.strip()}
+
+
+def call_genomes(fasta_files, tsv_path, reference, workers, n_thread, tmp_dir, exact_prepass=False, streaming=False, adaptive=False, compact=False, cache=False):
+    """
+    Calls the genomes on a pool of worker processes and appends every row to tsv_path as soon as it is done.
+    Genomes that are in tsv_path already are skipped, so an interrupted run continues where it stopped.
+    """
+    finished = read_finished(tsv_path)
+    pending = [file_path for file_path in fasta_files if genome_id(file_path) not in finished]
+    print(f"{len(finished)} genomes called already, {len(pending)} to go on {workers} workers")
+    failed = 0
+    with open(tsv_path, 'a') as tsv_file, ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(process_fasta_file, file_path, reference, n_thread, tmp_dir, exact_prepass,
+                                   streaming, adaptive, compact, cache): file_path
+                   for file_path in pending}
+        for done, future in enumerate(as_completed(futures), 1):
+            try:
+                line = future.result()
+            except Exception as error:
+                # Not written, so the genome is called again when the run is resumed
+                failed += 1
+                print(f"Failed {futures[future]}: {error}", file=sys.stderr)
+                continue
+            tsv_file.write(line + '\n')
+            tsv_file.flush()
+            print(f"[{done}/{len(pending)}] Called {futures[future]}")
+    return failed
+
+
+@click.command()
+@click.option('--input-dir', required=True, help='Directory with the assemblies (.fasta) to call')
+@click.option('--output', default='all_tsv_out.tsv', help='Output TSV file, an existing one is resumed')
+@click.option('--reference', default='test/cgMLST_v2_ref.fasta', help='Reference alleles of the cgMLST scheme')
+@click.option('--workers', default=0, type=int, help='Number of genomes called in parallel [default: cores / threads]')
+@click.option('--threads', default=4, type=int, help='Number of blastn processes and usearch threads per genome')
+@click.option('--tmp-dir', default=None, help='Directory for the temporary files [default: system temp]')
+@click.option('--exact-prepass', is_flag=True, default=False, help='Report loci with an exact copy of a reference allele without aligning all of their alleles')
+@click.option('--streaming', is_flag=True, default=False, help='Pipe the sequences to the aligners and read their hits from pipes')
+@click.option('--adaptive', is_flag=True, default=False, help='Run the translated usearch search only for the loci that blastn has not resolved')
+@click.option('--compact', is_flag=True, default=False, help='Write compact profiles, about 3 times smaller than the comma-separated hashes')
+@click.option('--cache', is_flag=True, default=False, help='Cache the called alleles under ~/.cache/pathinder/results and reuse them for unchanged genomes')
+@click.option('--submit', is_flag=True, default=False, help='Submit the output TSV to Loculus when all genomes are called')
+@click.option('--group-id', default=1, type=int, help='The ID of the group for which you are submitting')
+@click.option('--username', default='happykhan', help='Your username')
+def main(input_dir, output, reference, workers, threads, tmp_dir, exact_prepass, streaming, adaptive, compact, cache, submit, group_id, username):
+    workers = workers if workers > 0 else max(1, (os.cpu_count() or 1) // threads)
+    fasta_files = sorted(os.path.join(input_dir, filename) for filename in os.listdir(input_dir)
+                         if filename.endswith('.fasta'))
+    failed = call_genomes(fasta_files, output, os.path.abspath(reference), workers, threads,
+                          tmp_dir or tempfile.gettempdir(), exact_prepass, streaming, adaptive, compact, cache)
+    if failed:
+        print(f"{failed} genomes failed, run the same command again to retry them")
+        return
+    if not submit:
+        return
     password = ask_for_password()
-    authentication_token = get_loculus_authentication_token('happykhan', password)
-    submission_ids = get_submission_ids_from_tsv('all_tsv_out.tsv')
+    authentication_token = get_loculus_authentication_token(username, password)
+    submission_ids = get_submission_ids_from_tsv(output)
     placeholder_fasta_str = generate_placeholder_fasta(submission_ids)
 
     # Write the placeholder FASTA to a temporary file
@@ -61,9 +126,9 @@ def main():
         fasta_file.write(placeholder_fasta_str.encode('utf-8'))
         placeholder_tmp_path = fasta_file.name
 
-    submit_main(authentication_token, 1, 'all_tsv_out.tsv', placeholder_tmp_path)
+    submit_main(authentication_token, group_id, output, placeholder_tmp_path)
 
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,493 @@
+import os
+import re
+import sys
+import csv
+import copy
+import time
+import gzip
+import socket
+import hashlib
+import tempfile
+import tracemalloc
+import subprocess
+from operator import itemgetter
+import click
+import requests
+import numpy as np
+
+try:
+    from profiles import MISSING, match, AlleleEncoder
+    from index import AlleleIndex
+    from sketch import sketch_values, screen
+    from store import ProfileStore
+    from query import sync_store
+    from sequence_align import blastParser, is_acgt, getParams
+    from seqio import read_sequences
+    from codec import encode_profile, decode_profile, allele_keys, ProfileDictionary
+except ImportError:
+    from query.profiles import MISSING, match, AlleleEncoder
+    from query.index import AlleleIndex
+    from query.sketch import sketch_values, screen
+    from query.store import ProfileStore
+    from query.query import sync_store
+    from query.sequence_align import blastParser, is_acgt, getParams
+    from query.seqio import read_sequences
+    from query.codec import encode_profile, decode_profile, allele_keys, ProfileDictionary
+
+
+def synthetic_profiles(n_profiles: int, n_loci: int, n_clusters: int, mutation_rate: float,
+                       missing_rate: float, seed: int = 0) -> np.ndarray:
+    """
+    Returns allele codes of genomes descending from `n_clusters` founders, each genome carrying new alleles
+    at about `mutation_rate` of its loci. Like those of AlleleEncoder, the codes are numbered from 1 over all
+    loci, so that an allele of one locus never equals one of another.
+    """
+    rng = np.random.default_rng(seed)
+    founders = rng.integers(1, 1 << 10, size=(n_clusters, n_loci), dtype=np.uint32)
+    profiles = founders[rng.integers(0, n_clusters, n_profiles)]
+    for start in range(0, n_profiles, 1000):
+        block = profiles[start:start + 1000]
+        mutated = rng.random(block.shape, dtype=np.float32) < mutation_rate
+        block[mutated] = rng.integers(1 << 10, 1 << 20, size=np.count_nonzero(mutated), dtype=np.uint32)
+        block |= np.arange(n_loci, dtype=np.uint32) << np.uint32(20)
+        block[rng.random(block.shape, dtype=np.float32) < missing_rate] = MISSING
+    codes, dense = np.unique(profiles, return_inverse=True)
+    return (dense.reshape(profiles.shape) + (codes[0] != MISSING)).astype(np.uint32)
+
+
+def write_synthetic_tsv(tsv_path: str, profiles: np.ndarray) -> None:
+    """
+    Writes profiles as a LAPIS TSV dump, with a made-up 32 character hex hash per (locus, code); the code comes
+    first, as the profiles are compared on the leading digits.
+    """
+    with open(tsv_path, 'w') as tsv_file:
+        tsv_file.write('accession\tversion\treleasedAtTimestamp\tisRevocation\tversionStatus\t'
+                       'submissionId\tgroupName\tgroupId\tcollectionDate\tlocation\tprofileHash\n')
+        for row, profile in enumerate(profiles):
+            profile_hash = ','.join('{:016x}{:016x}'.format(code, locus) if code != MISSING else ''
+                                    for locus, code in enumerate(profile.tolist()))
+            tsv_file.write('SYN_{0}\t1\t{0}\tfalse\tLATEST_VERSION\tsynthetic_{0}\tbenchmark\t0\t'
+                           '2024-01-01\tnowhere\t{1}\n'.format(row, profile_hash))
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+@click.group()
+def main():
+    pass
+
+
+@main.command()
+@click.option('--profiles', 'n_profiles', default=20000, type=int, help='Number of database profiles')
+@click.option('--loci', 'n_loci', default=3002, type=int, help='Number of loci per profile')
+@click.option('--clusters', default=500, type=int, help='Number of founder genomes')
+@click.option('--mutation-rate', default=0.03, type=float, help='Proportion of loci with a new allele per genome')
+@click.option('--queries', 'n_queries', default=20, type=int, help='Number of queries')
+@click.option('--min-proportion-matched', default=0.9, type=float, help='Matching threshold')
+@click.option('--query-missing', default=0., type=float,
+              help='Proportion of the loci left out of the queries, as in profiles of draft assemblies')
+def sketch(n_profiles: int, n_loci: int, clusters: int, mutation_rate: float, n_queries: int,
+           min_proportion_matched: float, query_missing: float):
+    """
+    Recall and speed of the sketch screening against the exact scan and the inverted index.
+    """
+    profiles = synthetic_profiles(n_profiles + n_queries, n_loci, clusters, mutation_rate, 0.002)
+    profiles, queries = profiles[:n_profiles], profiles[n_profiles:]
+    queries[np.random.default_rng(1).random(queries.shape) < query_missing] = MISSING
+
+    def sketch_profile(profile):
+        # The codes stand in for the MD5 values
+        return sketch_values(profile, profile != MISSING)
+
+    sketches, sketch_time = timed(lambda: np.stack([sketch_profile(profile) for profile in profiles]))
+    index, index_time = timed(AlleleIndex.build, profiles)
+    print('Built sketches in {:.2f}s and the index in {:.2f}s for {} profiles'.format(
+        sketch_time, index_time, n_profiles))
+
+    times = {'exact': 0., 'index': 0., 'sketch': 0.}
+    found, recalled, candidates = 0, 0, 0
+    for query in queries:
+        exact, elapsed = timed(lambda: np.flatnonzero(match(query, profiles) >= min_proportion_matched))
+        times['exact'] += elapsed
+        indexed, elapsed = timed(lambda: index.find(query, profiles, min_proportion_matched)[0])
+        times['index'] += elapsed
+        assert set(indexed.tolist()) == set(exact.tolist())
+
+        def screen_and_rescore():
+            screened = screen(sketch_profile(query), sketches, min_proportion_matched,
+                              np.count_nonzero(query != MISSING) / n_loci)
+            return screened, screened[match(query, profiles[screened]) >= min_proportion_matched]
+        (screened, approximate), elapsed = timed(screen_and_rescore)
+        times['sketch'] += elapsed
+        found += len(exact)
+        recalled += len(np.intersect1d(approximate, exact))
+        candidates += len(screened)
+
+    print('{} queries, {} matches at {:.0f}%'.format(n_queries, found, min_proportion_matched * 100))
+    for method, elapsed in times.items():
+        print('{:>6}: {:8.2f} ms/query'.format(method, elapsed / n_queries * 1000))
+    print('sketch recall {:.4f}, {:.1f} candidates rescored per query'.format(
+        recalled / found if found else 1., candidates / n_queries))
+
+
+
+def buffered_download(lapis_url: str) -> list:
+    # The download of the first query.py: the whole response as text, split into lines, one set per entry
+    response = requests.get(lapis_url + '/sample/details?dataFormat=tsv'
+                                        '&fields=submissionId,groupName,groupId,collectionDate,location,profileHash')
+    return [(row['submissionId'], set(row['profileHash'].split(',')))
+            for row in csv.DictReader(response.text.splitlines(), delimiter='\t')]
+
+
+def traced_peak(function, *args) -> tuple[float, float]:
+    tracemalloc.start()
+    start = time.perf_counter()
+    function(*args)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak / 1e6, elapsed
+
+
+@main.command()
+@click.option('--profiles', 'n_profiles', default=2000, type=int, help='Number of profiles in the dump')
+@click.option('--loci', 'n_loci', default=3002, type=int, help='Number of loci per profile')
+def download(n_profiles: int, n_loci: int):
+    """
+    Peak memory of downloading a locally served synthetic LAPIS dump, buffered as before and streamed
+    into the local store.
+    """
+    csv.field_size_limit(1 << 26)
+    with tempfile.TemporaryDirectory() as directory:
+        tsv_path = os.path.join(directory, 'dump.tsv')
+        write_synthetic_tsv(tsv_path, synthetic_profiles(n_profiles, n_loci, 200, 0.03, 0.002))
+        with socket.socket() as probe:
+            probe.bind(('127.0.0.1', 0))
+            port = probe.getsockname()[1]
+        stub = subprocess.Popen([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lapis_stub.py'),
+                                 '--tsv', tsv_path, '--port', str(port)], stdout=subprocess.DEVNULL)
+        try:
+            lapis_url = 'http://127.0.0.1:{}'.format(port)
+            for _ in range(50):
+                try:
+                    requests.get(lapis_url)
+                    break
+                except requests.ConnectionError:
+                    time.sleep(0.1)
+            print('Dump of {} profiles, {:.1f} MB'.format(n_profiles, os.path.getsize(tsv_path) / 1e6))
+            peak, elapsed = traced_peak(buffered_download, lapis_url)
+            print('buffered: peak {:8.1f} MB, {:6.2f}s'.format(peak, elapsed))
+            with ProfileStore(os.path.join(directory, 'store.sqlite')) as store:
+                peak, elapsed = traced_peak(sync_store, store, lapis_url)
+                print('streamed: peak {:8.1f} MB, {:6.2f}s ({} profiles in the store)'.format(peak, elapsed, len(store)))
+        finally:
+            stub.terminate()
+
+
+@main.command()
+@click.option('--profiles', 'n_profiles', default=1000, type=int, help='Number of profiles')
+@click.option('--loci', 'n_loci', default=3002, type=int, help='Number of loci per profile')
+def codec(n_profiles: int, n_loci: int):
+    """
+    Size, gzipped size, parse time and allele table memory of the profiles as comma-separated MD5 digests, in
+    the compact form and dictionary-coded.
+    """
+    profiles = synthetic_profiles(n_profiles, n_loci, 200, 0.03, 0.002)
+    digests = {}
+    hash_lists = [[digests.setdefault((locus, code), hashlib.md5('{}_{}'.format(locus, code).encode()).hexdigest())
+                   if code != MISSING else '' for locus, code in enumerate(profile.tolist())] for profile in profiles]
+    fields = {'hex': [','.join(hashes) for hashes in hash_lists]}
+    encode_time = {}
+    fields['compact'], encode_time['compact'] = timed(lambda: [encode_profile(hashes) for hashes in hash_lists])
+    fields['dictionary'], encode_time['dictionary'] = timed(lambda: list(map(ProfileDictionary().encode, hash_lists)))
+    # A parser per pass over the profiles, as dictionary-coded ones are decoded in order from an empty dictionary
+    parsers = {'hex': lambda: lambda field: field.split(','), 'compact': lambda: decode_profile,
+               'dictionary': lambda: ProfileDictionary().decode}
+    size = {}
+    for form, values in fields.items():
+        dump = '\n'.join(values).encode()
+        parse = parsers[form]()
+        parsed, parse_time = timed(lambda: [parse(value) for value in values])
+        if form == 'compact':
+            assert parsed == [allele_keys(hashes) for hashes in hash_lists]
+            assert [encode_profile(keys) for keys in parsed] == values
+        if form == 'dictionary':
+            assert parsed == [allele_keys(hashes) for hashes in hash_lists]
+            assert list(map(ProfileDictionary().encode, parsed)) == values
+        # The allele table of the store, held in memory while profiles are encoded
+        tracemalloc.start()
+        encoder = AlleleEncoder()
+        parse = parsers[form]()
+        for value in values:
+            encoder.encode(parse(value))
+        table = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del encoder
+        size[form] = len(dump)
+        print('{:>10}: {:8.1f} KB/profile, gzipped {:8.1f} KB/profile, parsed in {:6.2f} ms/profile, '
+              'allele table {:7.1f} MB'.format(form, len(dump) / n_profiles / 1e3,
+                                               len(gzip.compress(dump, 6)) / n_profiles / 1e3,
+                                               parse_time / n_profiles * 1e3, table / 1e6))
+    for form in ('compact', 'dictionary'):
+        print('{} profiles are {:.1f} times smaller, encoded in {:.2f} ms/profile'.format(
+            form, size['hex'] / size[form], encode_time[form] / n_profiles * 1e3))
+
+
+# The previous per-character get_seq and codon loops of lookForORF
+_complement = {'A': 'T', 'T': 'A', 'C': 'G', 'G': 'C'}
+
+
+def python_get_seq(seq, header, start, end, direction):
+    fasta = seq[header]
+    if direction == '+':
+        return fasta[(start - 1):end].upper()
+    return ''.join([_complement.get(x.upper(), 'N') for x in reversed(fasta[(start - 1):end])])
+
+
+def python_look_for_orf(seq, rec):
+    coordinates, edges = rec['coordinates'], rec['flanking'][:]
+    seq = python_get_seq(seq, *coordinates)
+    startCodon, stopCodon = 0, 0
+    for s in range(edges[0] % 3, len(seq), 3):
+        if seq[s:s + 3] in {'ATG', 'TTG', 'GTG'}:
+            startCodon, edges[0] = 1, 0
+            e0 = s + 3
+            new_s = coordinates[1] + s if coordinates[3] == '+' else coordinates[2] - s
+            break
+    if not startCodon:
+        return 6
+    for e in range(e0, len(seq), 3):
+        if seq[e:e + 3] in {'TAG', 'TAA', 'TGA'}:
+            stopCodon, edges[1] = 1, 0
+            new_e = coordinates[1] + e + 2 if coordinates[3] == '+' else coordinates[2] - e - 2
+            break
+    if startCodon and stopCodon and abs(e - s) + 1 >= 0.6 * (abs(coordinates[2] - coordinates[1]) + 1 - sum(rec['flanking'])):
+        c2 = (new_s, new_e) if coordinates[3] == '+' else (new_e, new_s)
+        if c2[0] != coordinates[1] or c2[1] != coordinates[2]:
+            rec['CIGAR'] = rec['CIGAR'].rsplit(':', 1)[0] + ':EXEMPT'
+        coordinates[1:3] = c2
+        rec['flanking'] = edges
+        return 0
+    return 6
+
+
+def synthetic_assembly(reference: str, n_contigs: int, seed: int = 0) -> tuple[dict, list]:
+    """
+    Contigs made of one allele of every locus of the reference, half of them reverse-complemented, between
+    random spacers, and the regions form_alleles would get for them with a few bases of flanking trimmed.
+    """
+    rng = np.random.default_rng(seed)
+    alleles = {}
+    for name, allele in read_sequences(reference)[0].items():
+        alleles.setdefault(name.rsplit('_', 1)[0], allele)
+    rc = {'A': 'T', 'C': 'G', 'G': 'C', 'T': 'A'}
+    contigs, regions = {}, []
+    for contig_id, loci in enumerate(np.array_split(np.array(sorted(alleles)), n_contigs)):
+        name, parts, length = 'contig_{}'.format(contig_id), [], 0
+        for locus in loci.tolist():
+            spacer = ''.join(rng.choice(list('ACGT'), size=int(rng.integers(50, 300))))
+            strand = '+' if rng.random() < 0.5 else '-'
+            allele = alleles[locus] if strand == '+' else ''.join(rc.get(x, 'N') for x in reversed(alleles[locus]))
+            flanking = [int(rng.integers(0, 4)), int(rng.integers(0, 4))]
+            start, end = length + len(spacer) + 1 + flanking[0], length + len(spacer) + len(allele) - flanking[1]
+            if strand == '-':
+                start, end = length + len(spacer) + 1 + flanking[1], length + len(spacer) + len(allele) - flanking[0]
+            regions.append({'locus': locus, 'coordinates': [name, start, end, strand], 'flanking': flanking,
+                            'CIGAR': '{}_1:{}M'.format(locus, end - start + 1), 'identity': 1.0})
+            parts.extend([spacer, allele])
+            length += len(spacer) + len(allele)
+        contigs[name] = ''.join(parts)
+    return contigs, regions
+
+
+@main.command()
+@click.option('--reference', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'test', 'cgMLST_v2_ref.fasta'),
+              help='Reference alleles the synthetic assembly is made of')
+@click.option('--contigs', 'n_contigs', default=100, type=int, help='Number of contigs')
+@click.option('--repeats', default=3, type=int, help='Number of timed runs')
+def alleles(reference: str, n_contigs: int, repeats: int):
+    """
+    Speed of the sequence extraction, ORF scan and base check of form_alleles on a synthetic assembly, with the
+    translate-table and NumPy code against the previous per-character loops.
+    """
+    contigs, regions = synthetic_assembly(reference, n_contigs)
+    print('{} regions on {} contigs, {:.1f} Mb'.format(len(regions), len(contigs), sum(map(len, contigs.values())) / 1e6))
+    parser = blastParser()
+
+    def previous(regions):
+        results = []
+        for region in regions:
+            flag = python_look_for_orf(contigs, region)
+            sequence = python_get_seq(contigs, *region['coordinates'])
+            results.append((flag, region['coordinates'], region['flanking'], sequence, len(re.findall(r'[^ACGT]', sequence)) == 0))
+        return results
+
+    def current(regions):
+        results = []
+        for region in regions:
+            flag = parser.lookForORF(contigs, region)
+            sequence = parser.get_seq(contigs, *region['coordinates'])
+            results.append((flag, region['coordinates'], region['flanking'], sequence, is_acgt(sequence)))
+        return results
+
+    times = {'previous': [], 'current': []}
+    for _ in range(repeats):
+        for name, function in (('previous', previous), ('current', current)):
+            result, elapsed = timed(function, copy.deepcopy(regions))
+            times[name].append(elapsed)
+            if name == 'previous':
+                expected = result
+            else:
+                assert result == expected
+    for name, elapsed in times.items():
+        print('{:>8}: {:8.1f} ms (best of {})'.format(name, min(elapsed) * 1000, repeats))
+
+
+# The previous scans of linear_merge and inter_loci_overlap, which compared every hit or region with the following
+# ones until a break condition
+class previousParser(blastParser):
+    def linear_merge(self, blasttab, *args, **params):
+        # the previous duplicate pass; the inherited one then finds no duplicates left
+        for part in blasttab:
+            if part[8] > part[9]:
+                part[8], part[9] = -part[8], -part[9]
+        blasttab.sort(key=itemgetter(0, 1, 6, 8, -11))
+        for id, p1 in enumerate(blasttab):
+            if p1[0] == '':
+                continue
+            for jd in range(id + 1, len(blasttab)):
+                p2 = blasttab[jd]
+                if p2[0] == '':
+                    continue
+                if (p1[0], p1[1]) != (p2[0], p2[1]) or p2[6] - p1[6] > 4:
+                    break
+                d = abs(p1[6] - p2[6]) + abs(p1[7] - p2[7]) + abs(p1[8] - p2[8]) + abs(p1[9] - p2[9])
+                if d <= 5:
+                    if p1[2] >= p2[2]:
+                        p2[0] = ''
+                    else:
+                        p1[0] = ''
+                        break
+        blasttab = [p for p in blasttab if p[0] != '']
+        for part in blasttab:
+            if part[8] < 0:
+                part[8], part[9] = -part[8], -part[9]
+        return super().linear_merge(blasttab, *args, **params)
+
+    def synteny_pairs(self, blasttab, min_iden, min_frag_prop, min_frag_len, max_dist, diag_diff, max_diff, block=1 << 20):
+        syntenies = []
+        for id, p1 in enumerate(blasttab):
+            for jd in range(id + 1, len(blasttab)):
+                p2 = blasttab[jd]
+                if p1[0] != p2[0] or p1[1] != p2[1] or p2[6] - p1[7] > max_dist:
+                    break
+                elif p1[8] < 0 < p2[8] or p2[8] < p1[8] + 15 or p2[9] < p1[9] + 15 or p2[7] < p1[7] + 15 or p2[6] < p1[6] + 15 or p2[8] - p1[9] > max_dist:
+                    continue
+                m, n = p2[7] - p1[6] + 1, p2[9] - p1[8] + 1
+                if m < min_frag_len or m < min_frag_prop * p1[12] or max(m, n) - min(m, n) > max_diff or max(m, n) > diag_diff * min(m, n):
+                    continue
+                o_len = 0 if p2[6] > p1[7] else p1[7] - p2[6] + 1
+                p1_len = p1[7] - p1[6] + 1 - o_len
+                p2_len = p2[7] - p2[6] + 1 - o_len
+                iden = (p1[2] * p1_len + p2[2] * p2_len + max(p1[2], p2[2]) * o_len) / (p1_len + p2_len + o_len)
+                if iden < min_iden:
+                    continue
+                p1s, p2s = p1[11] / (p1[7] - p1[6] + 1), p2[11] / (p2[7] - p2[6] + 1)
+                dist = max(p2[6] - p1[7] - 1, p2[8] - p1[9] - 1, 0)
+                score = p1s * p1_len + p2s * p2_len + max(p1s, p2s) * o_len - dist
+                if score > 0:
+                    syntenies.append([id, jd, iden, score])
+        return syntenies
+
+    def inter_loci_overlap(self, alleles, parameters):
+        regions = [reg for region in alleles.values() for reg in region]
+        regions.sort(key=itemgetter(2, 3))
+        for id, regi in enumerate(regions):
+            if regi[0] == '':
+                continue
+            todel, deleted = [], 0
+            for jd in range(id + 1, len(regions)):
+                regj = regions[jd]
+                if regj[0] == '' or regi[0] == regj[0]:
+                    continue
+                if regi[2] != regj[2] or regj[3] > regi[4]:
+                    break
+                overlap = min(regi[4], regj[4]) - regj[3] + 1
+                if (regi[-1] != '' and float(overlap) >= parameters['overlap_prop'] * (regi[4] - regi[3] + 1)) or \
+                   (regj[-1] != '' and float(overlap) >= parameters['overlap_prop'] * (regj[4] - regj[3] + 1)):
+                    delta = regi[1] - regj[1]
+                    if delta > 0.05:
+                        todel.append(jd)
+                    elif delta <= -0.05:
+                        deleted = 1
+                        break
+            if deleted == 0:
+                for jd in todel:
+                    regions[jd][0] = ''
+            else:
+                regi[0] = ''
+        return [{'locus': reg[0], 'identity': reg[1], 'CIGAR': reg[9], 'coordinates': [reg[2], int(reg[3]), int(reg[4]), reg[5]],
+                 'flanking': reg[6:8], 'status': reg[8], 'accepted': (0 if reg[8] == '' else 128)}
+                for reg in regions if reg[0] != '' and reg[-1] != '']
+
+
+def synthetic_hits(n_loci: int, n_contigs: int, contig_length: int, seed: int = 0) -> list:
+    """
+    Blast hits of alleles on the contigs of an assembly, as the 15 columns linear_merge reads: loci with paralogous
+    copies on either strand, each hit by several fragments of its alleles and by near duplicates of them.
+    """
+    rng = np.random.default_rng(seed)
+    hits = []
+    for locus in range(n_loci):
+        length = int(rng.integers(150, 3000))
+        for _ in range(int(rng.choice([1, 1, 1, 2, 3]))):
+            contig, position = 'contig_{}'.format(rng.integers(n_contigs)), int(rng.integers(1, contig_length - length))
+            reverse = rng.random() < 0.5
+            for _ in range(int(rng.integers(1, 7))):
+                a = int(rng.integers(1, length - 40))
+                b = int(rng.integers(a + 30, min(length, a + int(rng.integers(30, length))) + 1))
+                for duplicate in range(int(rng.choice([1, 1, 2, 3]))):
+                    sa = max(1, a + int(rng.integers(-2, 3)) if duplicate else a)
+                    sb = min(length, max(sa + 20, b + int(rng.integers(-2, 3)) if duplicate else b))
+                    s, e = position + sa - 1, position + sb - 1
+                    if reverse:
+                        s, e = e, s
+                    hits.append(['{}_{}'.format(locus, rng.choice([1, 1, 2])), contig, round(float(rng.uniform(0.6, 1.0)), 4),
+                                 sb - sa + 1, 0, 0, sa, sb, s, e, 1e-5, float(rng.integers(50, 3001)), length, contig_length,
+                                 '{}M'.format(sb - sa + 1)])
+    return [hits[i] for i in rng.permutation(len(hits))]
+
+
+@main.command()
+@click.option('--tables', default=30, type=int, help='Number of synthetic hit tables')
+@click.option('--loci', 'n_loci', default=300, type=int, help='Number of loci of the first table, growing by 20 per table')
+@click.option('--contigs', 'n_contigs', default=5, type=int, help='Number of contigs')
+def merge(tables: int, n_loci: int, n_contigs: int):
+    """
+    Checks that the sweep windows of linear_merge, parse_blast and inter_loci_overlap give the same hits and regions
+    as the previous scans on synthetic hit tables, and compares their speed.
+    """
+    parameters = getParams(['-i', 'genome', '-r', 'reference', '-k', 'prefix'])
+    times = {'previous': 0., 'current': 0.}
+    for seed in range(tables):
+        hits = synthetic_hits(n_loci + 20 * seed, n_contigs, 200000, seed)
+        results = {}
+        for name, parser in (('previous', previousParser()), ('current', blastParser())):
+            start = time.perf_counter()
+            merged = parser.linear_merge(copy.deepcopy(hits), **parameters)
+            loci = parser.parse_blast(copy.deepcopy(merged), parameters)
+            regions = parser.inter_loci_overlap(copy.deepcopy(loci), parameters)
+            times[name] += time.perf_counter() - start
+            results[name] = repr((merged, loci, regions))
+        assert results['previous'] == results['current'], 'table {} differs'.format(seed)
+    print('{} hit tables give identical hits and regions'.format(tables))
+    for name, elapsed in times.items():
+        print('{:>8}: {:8.1f} ms'.format(name, elapsed * 1000))
+
+
+if __name__ == '__main__':
+    main()
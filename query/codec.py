@@ -0,0 +1,202 @@
+import re
+import base64
+import binascii
+import numpy as np
+from typing import Iterable
+
+
+# Profiles are compared on allele keys: the first KEY_BITS bits of the allele MD5 as KEY_HEX hex digits. 64 bits
+# keep the alleles of a whole scheme apart, and a key takes TOKEN_LENGTH base64 characters of a compact profile,
+# whose last character holds the lowest 4 bits followed by two zero bits.
+KEY_BITS = 64
+KEY_HEX = KEY_BITS // 4
+TOKEN_LENGTH = -(-KEY_BITS // 6)
+
+# A compact profile is PREFIX followed by one token per locus, in locus order; a locus without an allele is
+# MISSING_TOKEN, which is not in the base64 alphabet
+PREFIX = 'h{}:'.format(KEY_BITS)
+MISSING_TOKEN = '.' * TOKEN_LENGTH
+# A dictionary-coded profile (see ProfileDictionary) is DICTIONARY_PREFIX followed by urlsafe base64
+DICTIONARY_PREFIX = 'd{}:'.format(KEY_BITS)
+# Lower-case hex digits, which allele keys are made of
+_hex_digits = re.compile(r'[0-9a-f]*')
+# Compact profiles of other key lengths, which cannot be compared with these keys
+_other_prefix = re.compile(r'h\d+:')
+# The urlsafe base64 alphabet and the 6-bit value of every byte in a token, -1 outside the alphabet and -2 for
+# the '.' of MISSING_TOKEN
+_alphabet = np.frombuffer(b'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-_', dtype=np.uint8)
+_values = np.full(256, -1, dtype=np.int64)
+_values[_alphabet] = np.arange(64)
+_values[ord('.')] = -2
+# Position of the 6 bits of each character in the key, the last one is shifted left
+_shifts = [KEY_BITS - 6 * (position + 1) for position in range(TOKEN_LENGTH)]
+
+
+def is_compact(profile_hash: str) -> bool:
+    return profile_hash.startswith(PREFIX)
+
+
+def allele_keys(hashes: Iterable[str]) -> list[str]:
+    """
+    Allele keys of a list of MD5 hex digests or keys; empty hashes (missing loci) stay empty. Raises ValueError
+    for a hash that is not hexadecimal or shorter than a key.
+    """
+    keys = [allele_hash[:KEY_HEX].lower() for allele_hash in hashes]
+    if any(len(key) not in (0, KEY_HEX) for key in keys) or not _hex_digits.fullmatch(''.join(keys)):
+        invalid = next(key for key in keys if key and not (len(key) == KEY_HEX and _hex_digits.fullmatch(key)))
+        raise ValueError('invalid allele hash {!r}, allele hashes are at least {} hex digits'.format(invalid, KEY_HEX))
+    return keys
+
+
+def encode_profile(hashes: list[str]) -> str:
+    """
+    Compact form of a profile given as its list of MD5 hex digests or allele keys, about 3 times shorter than the
+    comma-separated digests. Decoding it gives the allele keys back exactly.
+    """
+    keys = [allele_hash[:KEY_HEX] for allele_hash in hashes]
+    if any(len(key) not in (0, KEY_HEX) for key in keys):
+        raise ValueError('allele hashes need at least {} hex digits'.format(KEY_HEX))
+    values = np.frombuffer(bytes.fromhex(''.join(key or '0' * KEY_HEX for key in keys)), dtype='>u8').astype(np.uint64)
+    digits = np.stack([(values >> np.uint64(shift) if shift >= 0 else values << np.uint64(-shift)) & np.uint64(63)
+                       for shift in _shifts], axis=1)
+    tokens = _alphabet[digits]
+    tokens[np.array([key == '' for key in keys], dtype=bool)] = ord('.')
+    return PREFIX + tokens.tobytes().decode('ascii')
+
+
+def decode_profile(profile_hash: str) -> list[str]:
+    """
+    Allele keys of a compact profile, '' for missing loci. Raises ValueError if it is not a valid compact profile.
+    """
+    if not is_compact(profile_hash):
+        raise ValueError('not a compact profile: {}'.format(profile_hash[:20]))
+    encoded = profile_hash[len(PREFIX):].encode('ascii')
+    if len(encoded) % TOKEN_LENGTH:
+        raise ValueError('compact profile of {} characters, not a multiple of {}'.format(len(encoded), TOKEN_LENGTH))
+    digits = _values[np.frombuffer(encoded, dtype=np.uint8)].reshape(-1, TOKEN_LENGTH)
+    missing = (digits == -2).all(axis=1)
+    digits[missing] = 0
+    # the bits below the last key bit must be zero, so that every key has a single token
+    if (digits < 0).any() or (digits[:, -1] & ((1 << max(0, -_shifts[-1])) - 1)).any():
+        raise ValueError('invalid compact profile: {}'.format(profile_hash[:20]))
+    values = np.zeros(len(digits), dtype=np.uint64)
+    for position, shift in enumerate(_shifts):
+        column = digits[:, position].astype(np.uint64)
+        values |= column << np.uint64(shift) if shift >= 0 else column >> np.uint64(-shift)
+    # the hex digits cut into keys by viewing them as numpy strings of KEY_HEX UTF-32 characters
+    keys = np.frombuffer(values.astype('>u8').tobytes().hex().encode('utf-32-le'), dtype='<U{}'.format(KEY_HEX)).tolist()
+    for locus in np.flatnonzero(missing).tolist():
+        keys[locus] = ''
+    return keys
+
+
+def is_dictionary_coded(profile_hash: str) -> bool:
+    return profile_hash.startswith(DICTIONARY_PREFIX)
+
+
+class ProfileDictionary:
+    """
+    The alleles of every locus in the profiles of a file so far, for dictionary-coded profiles. A locus of such a
+    profile is a varint: 0 for a missing locus, 1 for an allele that is new at this locus followed by the
+    KEY_BITS // 8 bytes of its key, or 2 plus the index of an allele seen before at this locus. Profiles of
+    related genomes share most of their alleles, so most loci take a single byte, but a profile can only be
+    decoded after the ones before it: the rows of a file are encoded and decoded in order, each file starting
+    from an empty ProfileDictionary.
+    """
+
+    def __init__(self):
+        self.keys: list[list[str]] = []
+        self.indices: list[dict[str, int]] = []
+
+    def _grow(self, n_loci: int) -> None:
+        for _ in range(len(self.keys), n_loci):
+            self.keys.append([])
+            self.indices.append({})
+
+    def encode(self, hashes: list[str]) -> str:
+        """
+        Dictionary-coded form of a profile given as its list of MD5 hex digests or allele keys, adding its new
+        alleles to the dictionary.
+        """
+        keys = allele_keys(hashes)
+        self._grow(len(keys))
+        encoded = bytearray()
+        for locus, key in enumerate(keys):
+            if key == '':
+                encoded.append(0)
+                continue
+            index = self.indices[locus].get(key)
+            if index is None:
+                self.indices[locus][key] = len(self.keys[locus])
+                self.keys[locus].append(key)
+                encoded.append(1)
+                encoded += bytes.fromhex(key)
+                continue
+            value = index + 2
+            while value >= 0x80:
+                encoded.append(value & 0x7f | 0x80)
+                value >>= 7
+            encoded.append(value)
+        return DICTIONARY_PREFIX + base64.urlsafe_b64encode(bytes(encoded)).decode('ascii')
+
+    def decode(self, profile_hash: str) -> list[str]:
+        """
+        Allele keys of a dictionary-coded profile, '' for missing loci, adding its new alleles to the dictionary.
+        Raises ValueError if it is not a valid dictionary-coded profile or refers to an allele not seen before.
+        """
+        if not is_dictionary_coded(profile_hash):
+            raise ValueError('not a dictionary-coded profile: {}'.format(profile_hash[:20]))
+        try:
+            encoded = base64.b64decode(profile_hash[len(DICTIONARY_PREFIX):], altchars=b'-_', validate=True)
+        except (binascii.Error, ValueError):
+            raise ValueError('invalid dictionary-coded profile: {}'.format(profile_hash[:20]))
+        keys = []
+        position = 0
+        while position < len(encoded):
+            value, shift = 0, 0
+            while True:
+                if position == len(encoded):
+                    raise ValueError('truncated dictionary-coded profile: {}'.format(profile_hash[:20]))
+                byte = encoded[position]
+                position += 1
+                value |= (byte & 0x7f) << shift
+                shift += 7
+                if byte < 0x80:
+                    break
+            locus = len(keys)
+            self._grow(locus + 1)
+            if value == 0:
+                keys.append('')
+            elif value == 1:
+                key = encoded[position:position + KEY_BITS // 8].hex()
+                position += KEY_BITS // 8
+                if len(key) != KEY_HEX:
+                    raise ValueError('truncated dictionary-coded profile: {}'.format(profile_hash[:20]))
+                self.indices[locus].setdefault(key, len(self.keys[locus]))
+                self.keys[locus].append(key)
+                keys.append(key)
+            elif value - 2 < len(self.keys[locus]):
+                keys.append(self.keys[locus][value - 2])
+            else:
+                raise ValueError('dictionary-coded profile refers to allele {} of locus {}, which has {} so far; '
+                                 'the rows of the file need to be read in order'.format(
+                                     value - 2, locus, len(self.keys[locus])))
+        return keys
+
+
+def profile_keys(profile_hash: str, dictionary: ProfileDictionary = None) -> list[str]:
+    """
+    Allele keys of a profileHash field in any form: compact, comma-separated MD5 digests or, with the
+    ProfileDictionary of the rows read so far from its file, dictionary-coded.
+    """
+    if is_compact(profile_hash):
+        return decode_profile(profile_hash)
+    if is_dictionary_coded(profile_hash):
+        if dictionary is None:
+            raise ValueError('dictionary-coded profile, which can only be read in order with the rows before it in '
+                             'its file; expand the file with "query.py convert --expand" first')
+        return dictionary.decode(profile_hash)
+    if _other_prefix.match(profile_hash):
+        raise ValueError('{} compact profile, only {} ones can be read; write it again from the MD5 hashes'.format(
+            profile_hash.split(':', 1)[0], PREFIX[:-1]))
+    return allele_keys(profile_hash.split(','))
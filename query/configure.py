@@ -1,4 +1,4 @@
-import os, sys, subprocess, numpy as np, pandas as pd, argparse, shutil, gzip, io, re
+import os, sys, subprocess, numpy as np, argparse, shutil, gzip, io, re, csv
 from datetime import datetime
 
 if sys.version_info[0] < 3:
@@ -12,6 +12,13 @@ else :
     xrange = range
     asc2int = np.uint32
 
+try :
+    from seqio import read_sequences
+    from translate import codon_table, encode, reverse_complement, translate_frames
+except ImportError :
+    from query.seqio import read_sequences
+    from query.translate import codon_table, encode, reverse_complement, translate_frames
+
 import hashlib, uuid
 def get_md5(value, dtype=str) :
     m = hashlib.md5(str(value).encode()).hexdigest()
@@ -93,39 +100,13 @@ class uopen(object) :
 
 
 def readFasta(fasta, headOnly=False) :
-    sequence = OrderedDict()
-    with uopen(fasta) as fin :
-        for line in fin :
-            if line.startswith('>') :
-                name = line[1:].strip().split()[0]
-                sequence[name] = []
-            elif len(line) > 0 and not line.startswith('#') and not headOnly :
-                sequence[name].extend(line.strip().split())
-    for s in sequence :
-        sequence[s] = (''.join(sequence[s])).upper()
-    return sequence
+    return OrderedDict(read_sequences(fasta, skip_comments=True, head_only=headOnly)[0])
 
 def readFastq(fastq) :
-    sequence, qual = OrderedDict(), OrderedDict()
-    with uopen(fastq) as fin :
-        line = fin.readline()
-        if not line.startswith('@') :
-            sequence = readFasta(fastq)
-            return sequence, OrderedDict( [n, re.sub(r'[^!]', 'I', re.sub(r'[^ACGTacgt]', '!', s))] for n, s in sequence.items() )
-    with uopen(fastq) as fin :
-        for lineId, line in enumerate(fin) :
-            if lineId % 4 == 0 :
-                name = line[1:].strip().split()[0]
-                sequence[name] = []
-                qual[name] = []
-            elif lineId % 4 == 1 :
-                sequence[name].extend(line.strip().split())
-            elif lineId % 4 == 3 :
-                qual[name].extend(line.strip().split())
-    for s in sequence :
-        sequence[s] = (''.join(sequence[s])).upper()
-        qual[s] = ''.join(qual[s])
-    return sequence, qual
+    sequence, qual = read_sequences(fastq, skip_comments=True)
+    if qual is None :
+        return OrderedDict(sequence), OrderedDict( [n, re.sub(r'[^!]', 'I', re.sub(r'[^ACGTacgt]', '!', s))] for n, s in sequence.items() )
+    return OrderedDict(sequence), OrderedDict(qual)
 
 complement = {'A':'T', 'T':'A', 'G':'C', 'C':'G', 'N':'N'}
 def rc(seq, missingValue='N') :
@@ -143,8 +124,6 @@ def rev_transeq(s, transl_table=11) :
         rev_seq[aa] = ''.join([na[int(codon/16)], na[int((codon%16)/4)], na[codon%4]])
     return ''.join([ rev_seq.get(x, '---') for x in s ])
 
-baseConv = np.repeat(-100, 255)
-baseConv[(np.array(['-', 'A', 'C', 'G', 'T']).view(asc2int),)] = (-100000, 0, 1, 2, 3)
 def transeq(seq, frame=7, transl_table=None, markStarts=False) :
     frames = {'F': [1,2,3],
               'R': [4,5,6],
@@ -152,33 +131,18 @@ def transeq(seq, frame=7, transl_table=None, markStarts=False) :
     if frames is None :
         frames = [int(f) for f in str(frame).split(',')]
     
+    gtable = list('KNKNTTTTRSRSIIMIQHQHPPPPRRRRLLLLEDEDAAAAGGGGVVVVXYXYSSSSXCWCLFLF')
     if transl_table == 4 :
-        gtable = np.array(list('KNKNTTTTRSRSIIMIQHQHPPPPRRRRLLLLEDEDAAAAGGGGVVVVXYXYSSSSWCWCLFLF-'))
-    else :
-        gtable = np.array(list('KNKNTTTTRSRSIIMIQHQHPPPPRRRRLLLLEDEDAAAAGGGGVVVVXYXYSSSSXCWCLFLF-'))
+        gtable[56] = 'W'
     if markStarts :
-        gtable[(np.array([46, 62]),)] = 'M'
+        gtable[46] = gtable[62] = 'M'
+    table = codon_table(''.join(gtable), 'X', '-')
 
     seqs = seq.items() if isinstance(seq, dict) else seq
-    nFrame = (max(frames) > 3)
     trans_seq = []
     for n,s in seqs :
-        s = baseConv[np.array(list(s.upper())).view(asc2int)]
-        if nFrame :
-            rs = (3 - s)[::-1]
-            rs[rs >= 100] *= -1            
-        sf = s.size % 3
-        tseq = []
-        for f in frames :
-            codons = s[f-1:] if f <= 3 else rs[f-4:]
-            if codons.size % 3 :
-                codons = np.concatenate([codons, [-100]*(3 - codons.size % 3)])
-            codons = codons.reshape(-1, 3)
-            codon2 = np.sum(codons << [4, 2, 0], 1)
-            codon2[codon2 < -50000] = 64
-            codon2[codon2 < 0] = 50
-            tseq.append(''.join(gtable[codon2].tolist()))
-        trans_seq.append([n, tseq])
+        codes = encode(s, gaps=True)
+        trans_seq.append([n, translate_frames(codes, reverse_complement(codes), frames, table)])
     return dict(trans_seq) if isinstance(seq, dict) else trans_seq
 
 
@@ -546,14 +510,16 @@ def add_args(a) :
 def load_configure() :
     EnConf_file = os.path.realpath(__file__).rsplit('.', 1)[0] + '.ini'
     try :
-        return pd.read_csv(EnConf_file, sep='=', header=None).values
+        with open(EnConf_file, 'rt', newline='') as fin :
+            return np.array([row for row in csv.reader(fin, delimiter='=') if len(row)], dtype=object)
     except :
         return np.array([0, 2], dtype=str)
     
 
 def write_configure(configs) :
     EnConf_file = os.path.realpath(__file__).rsplit('.', 1)[0] + '.ini'
-    pd.DataFrame(configs).to_csv(EnConf_file, sep='=', index=False, header=False)
+    with open(EnConf_file, 'wt', newline='') as fout :
+        csv.writer(fout, delimiter='=', lineterminator='\n').writerows(configs.tolist())
 
 externals = prepare_externals()
 if __name__ == '__main__' :
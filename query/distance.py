@@ -0,0 +1,64 @@
+import os
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from profiles import MISSING, hamming_distance
+except ImportError:
+    from query.profiles import MISSING, hamming_distance
+
+
+# Upper bound for the number of locus comparisons held in memory at once by one worker
+block_budget = 1 << 22
+
+
+def _n_jobs(n_jobs: int) -> int:
+    return n_jobs if n_jobs and n_jobs > 0 else os.cpu_count() or 1
+
+
+def one_vs_all(query: np.ndarray, profiles: np.ndarray, n_jobs: int = 0) -> np.ndarray:
+    """
+    Hamming distances between one query and every profile. Loci that are missing in either profile
+    of a pair are not counted.
+    """
+    chunk_size = max(1, block_budget // max(profiles.shape[1], 1))
+    chunks = [profiles[start:start + chunk_size] for start in range(0, profiles.shape[0], chunk_size)]
+    if len(chunks) <= 1:
+        return hamming_distance(query, profiles)
+    with ThreadPoolExecutor(_n_jobs(n_jobs)) as executor:
+        return np.concatenate(list(executor.map(lambda chunk: hamming_distance(query, chunk), chunks)))
+
+
+def _block_distances(rows: np.ndarray, columns: np.ndarray) -> np.ndarray:
+    # A missing locus against a called allele always compares unequal, so those pairs are counted by the
+    # comparison and subtracted again with two matrix products of the missing/called masks
+    mismatches = np.stack([np.count_nonzero(columns != row, axis=1) for row in rows]).astype(np.int64)
+    rows_missing, columns_missing = rows == MISSING, columns == MISSING
+    mismatches -= (rows_missing.astype(np.float32) @ (~columns_missing).T.astype(np.float32)).astype(np.int64)
+    mismatches -= ((~rows_missing).astype(np.float32) @ columns_missing.T.astype(np.float32)).astype(np.int64)
+    return mismatches
+
+
+def all_vs_all(profiles: np.ndarray, n_jobs: int = 0, out: np.ndarray = None) -> np.ndarray:
+    """
+    Symmetric (n_profiles, n_profiles) matrix of pairwise hamming distances, ignoring loci missing in
+    either profile of a pair. `out` can be a preallocated (e.g. memory-mapped) array for large collections.
+    """
+    n_profiles, n_loci = profiles.shape
+    if out is None:
+        out = np.zeros((n_profiles, n_profiles), dtype=np.uint16 if n_loci < 1 << 16 else np.uint32)
+    row_block = max(1, min(64, n_profiles))
+    column_block = max(1, block_budget // max(n_loci, 1))
+
+    def fill_rows(row_start: int):
+        rows = profiles[row_start:row_start + row_block]
+        # Only the upper triangle is computed, the lower one is mirrored
+        for column_start in range(row_start, n_profiles, column_block):
+            columns = profiles[column_start:column_start + column_block]
+            distances = _block_distances(rows, columns)
+            out[row_start:row_start + len(rows), column_start:column_start + len(columns)] = distances
+            out[column_start:column_start + len(columns), row_start:row_start + len(rows)] = distances.T
+
+    with ThreadPoolExecutor(_n_jobs(n_jobs)) as executor:
+        list(executor.map(fill_rows, range(0, n_profiles, row_block)))
+    return out
@@ -0,0 +1,134 @@
+import os
+import tempfile
+import numpy as np
+
+try:
+    from profiles import MISSING, count_matches, match
+except ImportError:
+    from query.profiles import MISSING, count_matches, match
+
+
+class AlleleIndex:
+    """
+    Inverted index from allele code to the rows of the profile matrix that carry the allele. The codes are
+    shared by all loci (see AlleleEncoder), so a row is found by its alleles wherever they are in the profile.
+    The rows of codes[i] are postings[indptr[i]:indptr[i + 1]].
+    """
+    # Version of the saved layout, an index saved in another one is rebuilt
+    version = 2
+
+    def __init__(self, codes: np.ndarray, indptr: np.ndarray, postings: np.ndarray, n_profiles: int):
+        self.codes = codes
+        self.indptr = indptr
+        self.postings = postings
+        self.n_profiles = n_profiles
+
+    @classmethod
+    def build(cls, profiles: np.ndarray) -> 'AlleleIndex':
+        n_profiles, n_loci = profiles.shape
+        cells = np.flatnonzero(profiles.reshape(-1) != MISSING)
+        values = profiles.reshape(-1)[cells]
+        order = np.argsort(values, kind='stable')
+        codes, counts = np.unique(values[order], return_counts=True)
+        # A row carrying an allele at two loci is listed twice, which the counts of top_k take as two matches
+        postings = (cells[order] // max(n_loci, 1)).astype(np.int32)
+        indptr = np.concatenate([[0], np.cumsum(counts)])
+        return cls(codes.astype(np.uint32), indptr, postings, n_profiles)
+
+    def save(self, path: str, **meta) -> None:
+        """
+        Saves the index at `path`. It is written to a temporary file next to it and renamed into place, so a
+        concurrent reader never loads a partial index.
+        """
+        fd, temporary_path = tempfile.mkstemp(prefix='.index_', dir=os.path.dirname(os.path.abspath(path)))
+        try:
+            with os.fdopen(fd, 'wb') as index_file:
+                np.savez(index_file, codes=self.codes, indptr=self.indptr, postings=self.postings,
+                         n_profiles=self.n_profiles, version=self.version, **meta)
+            os.replace(temporary_path, path)
+        except BaseException:
+            os.unlink(temporary_path)
+            raise
+
+    @classmethod
+    def load(cls, path: str) -> tuple['AlleleIndex', dict]:
+        """
+        Returns the index saved at `path` and the metadata saved with it, or (None, {}) for an index of an
+        older layout.
+        """
+        fields = ['codes', 'indptr', 'postings', 'n_profiles', 'version']
+        with np.load(path) as data:
+            if 'version' not in data.files or int(data['version']) != cls.version:
+                return None, {}
+            index = cls(data['codes'], data['indptr'], data['postings'], int(data['n_profiles']))
+            meta = {key: data[key] for key in data.files if key not in fields}
+        return index, meta
+
+    def posting_lists(self, query: np.ndarray) -> list[np.ndarray]:
+        """
+        Returns the rows sharing the query allele for every called locus of the query, shortest lists first.
+        A query allele that is not in the index (e.g. UNKNOWN) gives an empty list.
+        """
+        called = query[query != MISSING]
+        if len(self.codes):
+            keys = np.minimum(np.searchsorted(self.codes, called), len(self.codes) - 1)
+            found = self.codes[keys] == called
+        else:
+            keys, found = np.zeros(len(called), dtype=np.int64), np.zeros(len(called), dtype=bool)
+        lists = [self.postings[self.indptr[key]:self.indptr[key + 1]] if known else self.postings[:0]
+                 for key, known in zip(keys.tolist(), found.tolist())]
+        lists.sort(key=len)
+        return lists
+
+    def candidates(self, query: np.ndarray, min_proportion_matched: float) -> np.ndarray:
+        """
+        Returns the sorted rows that can reach min_proportion_matched with match or jacquard_similarity (see find).
+        """
+        lists = self.posting_lists(query)
+        needed = int(np.ceil(min_proportion_matched * len(lists) - 1e-9))
+        if needed <= 0:
+            return np.arange(self.n_profiles)
+        scanned = lists[:len(lists) - needed + 1]
+        return np.unique(np.concatenate(scanned)) if scanned else np.arange(0)
+
+    def find(self, query: np.ndarray, profiles: np.ndarray, min_proportion_matched: float,
+             comparison_method=match) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the rows whose score reaches min_proportion_matched and their scores. Both match and
+        jacquard_similarity need at least ceil(min_proportion_matched * n) of the n called query loci to match,
+        so a row that reaches the threshold shares an allele with one of the n - needed + 1 rarest query alleles,
+        and only those posting lists are scanned before rescoring the candidates exactly.
+        """
+        rows = self.candidates(query, min_proportion_matched)
+        scores = comparison_method(query, profiles[rows]) if len(rows) else np.zeros(0)
+        keep = scores >= min_proportion_matched
+        return rows[keep], scores[keep]
+
+    def top_k(self, query: np.ndarray, profiles: np.ndarray, k: int,
+              comparison_method=match, batch_size: int = 256) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the k rows with the most matching alleles and their scores, best first. Posting lists are
+        accumulated in batches and the scan stops once the k-th best count cannot be overtaken by the
+        remaining lists. The rows are chosen and ranked on their match counts, so they are the k best for match
+        but not for jacquard_similarity, which find ranks on all candidates instead.
+        """
+        k = min(k, self.n_profiles)
+        if k <= 0:
+            return np.arange(0), np.zeros(0)
+        lists = self.posting_lists(query)
+        counts = np.zeros(self.n_profiles, dtype=np.int32)
+        for start in range(0, len(lists), batch_size):
+            for rows in lists[start:start + batch_size]:
+                counts[rows] += 1
+            remaining = len(lists) - start - batch_size
+            if remaining <= 0:
+                break
+            if k < self.n_profiles:
+                partitioned = np.partition(counts, [self.n_profiles - k - 1, self.n_profiles - k])
+                if partitioned[self.n_profiles - k] >= partitioned[self.n_profiles - k - 1] + remaining:
+                    break
+        rows = np.argpartition(counts, self.n_profiles - k)[self.n_profiles - k:]
+        # Rank the selected rows on their full profiles, the partial counts only decided the selection
+        order = np.argsort(-count_matches(query, profiles[rows]), kind='stable')
+        rows = rows[order]
+        return rows, comparison_method(query, profiles[rows])
@@ -0,0 +1,81 @@
+import click
+import csv
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Iterator
+from urllib.parse import urlparse, parse_qs
+
+
+# Metadata that Loculus adds on release, filled in for TSV files that do not carry it (e.g. the Hashing.py output)
+default_values = {
+    'version': '1',
+    'releasedAtTimestamp': '0',
+    'isRevocation': 'false',
+    'versionStatus': 'LATEST_VERSION',
+    'groupName': 'local',
+    'groupId': '0',
+}
+
+
+def read_rows(tsv_path: str) -> Iterator[dict]:
+    csv.field_size_limit(1 << 26)
+    with open(tsv_path, 'r') as tsv_file:
+        for row in csv.DictReader(tsv_file, delimiter='\t'):
+            for field, value in default_values.items():
+                row.setdefault(field, value)
+            row.setdefault('accession', row['submissionId'])
+            yield row
+
+
+class LapisStubHandler(BaseHTTPRequestHandler):
+    """
+    Answers `/sample/details?dataFormat=tsv` like LAPIS, supporting the `fields`, `versionStatus`
+    and `releasedAtTimestampFrom` parameters used by query.py. The file is read and streamed for every
+    request, so large synthetic dumps can be served.
+    """
+    tsv_path: str = None
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if not url.path.endswith('/sample/details'):
+            self.send_error(404)
+            return
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/tab-separated-values')
+        self.end_headers()
+
+        fields = params['fields'].split(',') if 'fields' in params else None
+        if fields is not None:
+            self.wfile.write(('\t'.join(fields) + '\n').encode())
+        for row in read_rows(self.tsv_path):
+            if fields is None:
+                fields = list(row.keys())
+                self.wfile.write(('\t'.join(fields) + '\n').encode())
+            if 'versionStatus' in params and row['versionStatus'] != params['versionStatus']:
+                continue
+            if 'releasedAtTimestampFrom' in params and \
+                    int(row['releasedAtTimestamp']) < int(params['releasedAtTimestampFrom']):
+                continue
+            self.wfile.write(('\t'.join(row.get(field, '') for field in fields) + '\n').encode())
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(tsv_path: str, host: str = '127.0.0.1', port: int = 0) -> ThreadingHTTPServer:
+    handler = type('Handler', (LapisStubHandler,), {'tsv_path': tsv_path})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+@click.command()
+@click.option('--tsv', required=True, help='TSV file with the entries to serve')
+@click.option('--host', default='127.0.0.1', help='Interface to listen on')
+@click.option('--port', default=8090, type=int, help='Port to listen on')
+def main(tsv: str, host: str, port: int):
+    server = serve(tsv, host, port)
+    print('Serving {} at http://{}:{}'.format(tsv, host, server.server_address[1]))
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
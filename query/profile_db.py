@@ -0,0 +1,227 @@
+import os
+import csv
+import json
+import shutil
+import tempfile
+import click
+import numpy as np
+from typing import Iterable, Iterator
+
+try:
+    from profiles import AlleleEncoder, MISSING, UNKNOWN
+    from codec import profile_keys, allele_keys, is_dictionary_coded, ProfileDictionary
+except ImportError:
+    from query.profiles import AlleleEncoder, MISSING, UNKNOWN
+    from query.codec import profile_keys, allele_keys, is_dictionary_coded, ProfileDictionary
+
+
+# File layout:
+#   8 bytes magic, 8 bytes little-endian header length, UTF-8 JSON header,
+#   then the sections listed in the header, each at its own aligned offset.
+# The header holds the locus names (position i of a profile is loci[i]) and for every section its offset, dtype
+# and shape, so that each section can be opened with numpy.memmap without reading the others:
+#   profiles       (n_profiles, n_loci) uint32 allele codes, MISSING for loci without an allele
+#   allele_keys    sorted allele keys (see codec.py) of every allele as integers (uint64)
+#   allele_codes   code of each allele key (uint32), shared by all loci as those of AlleleEncoder
+#   <metadata>     one fixed-width UTF-8 byte string column per metadata field
+MAGIC = b'PTHNDRDB'
+FORMAT_VERSION = 4
+metadata_fields = ['accession', 'submission_id', 'group_name', 'group_id', 'collection_date', 'location']
+
+# Page alignment of the profile matrix, the smaller sections are aligned to cache lines
+_page = 4096
+_line = 64
+
+
+def read_reference_loci(reference_fasta: str) -> list[str]:
+    """
+    Returns the loci of an MLSType reference FASTA in the order of the MLSType output: the allele names
+    (e.g. STMMW_23011_1) without their allele number, unique and sorted.
+    """
+    loci = set()
+    with open(reference_fasta, 'r') as fasta_file:
+        for line in fasta_file:
+            if line.startswith('>'):
+                loci.add(line[1:].split()[0].rsplit('_', 1)[0])
+    return sorted(loci)
+
+
+def read_tsv_rows(tsv_path: str) -> Iterator[dict]:
+    """
+    Yields the entries of a Hashing.py TSV file or a LAPIS TSV dump with the metadata fields of this format.
+    Revocations and versions other than the latest one in LAPIS dumps are left out. Dictionary-coded profiles
+    are decoded in the order of the file and yielded as comma-separated allele keys.
+    """
+    csv.field_size_limit(1 << 26)
+    dictionary = ProfileDictionary()
+    with open(tsv_path, 'r') as tsv_file:
+        for row in csv.DictReader(tsv_file, delimiter='\t'):
+            # every row is decoded, as the later ones may refer to the alleles of a left out one
+            if is_dictionary_coded(row['profileHash']):
+                row['profileHash'] = ','.join(dictionary.decode(row['profileHash']))
+            if row.get('isRevocation', 'false') == 'true' or \
+                    row.get('versionStatus', 'LATEST_VERSION') != 'LATEST_VERSION':
+                continue
+            yield {
+                'accession': row.get('accession') or row['submissionId'],
+                'submission_id': row['submissionId'],
+                'group_name': row.get('groupName', ''),
+                'group_id': row.get('groupId', ''),
+                'collection_date': row.get('collectionDate', ''),
+                'location': row.get('location', ''),
+                'profile_hash': row['profileHash']
+            }
+
+
+def _aligned(offset: int, alignment: int) -> int:
+    return (offset + alignment - 1) // alignment * alignment
+
+
+def write_database(path: str, loci: list[str], rows: Iterable[dict]) -> int:
+    """
+    Writes the entries into a profile database at `path` and returns their number. Profiles are positional, so
+    every profile needs one hash per locus in the order of `loci`, empty for missing loci, as Hashing.py writes
+    them; a profile of another length (e.g. one that leaves out its missing loci) raises a ValueError. The
+    profile matrix is spooled to a temporary file while the rows are read, so only the metadata and the allele
+    table are held in memory.
+    """
+    encoder = AlleleEncoder()
+    metadata = {field: [] for field in metadata_fields}
+    n_profiles = 0
+    directory = os.path.dirname(os.path.abspath(path))
+    with tempfile.TemporaryFile(dir=directory) as spool:
+        for row in rows:
+            hashes = profile_keys(row['profile_hash'])
+            if len(hashes) != len(loci):
+                raise ValueError('{} has {} loci, the reference {}; hash it in the locus order of the reference, '
+                                 'with an empty hash for each missing locus'.format(
+                                     row['submission_id'], len(hashes), len(loci)))
+            spool.write(encoder.encode(hashes)[0].astype('<u4').tobytes())
+            for field in metadata_fields:
+                metadata[field].append(row[field].encode())
+            n_profiles += 1
+
+        keys = np.array([int(allele_hash, 16) for allele_hash in encoder.alleles], dtype='<u8')
+        order = np.argsort(keys, kind='stable')
+        sections = {
+            'allele_keys': keys[order],
+            'allele_codes': np.array(list(encoder.alleles.values()), dtype='<u4')[order],
+        }
+        for field in metadata_fields:
+            width = max([1] + [len(value) for value in metadata[field]])
+            sections[field] = np.array(metadata[field], dtype='S{}'.format(width))
+
+        header = {
+            'format_version': FORMAT_VERSION,
+            'n_profiles': n_profiles,
+            'loci': loci,
+            'sections': {}
+        }
+        # The offsets depend on the header length, so it is laid out with its final size before writing
+        header_bytes = b''
+        while True:
+            offset = _aligned(len(MAGIC) + 8 + len(header_bytes), _line)
+            for name, array in sections.items():
+                header['sections'][name] = {'offset': offset, 'dtype': array.dtype.str, 'shape': list(array.shape)}
+                offset = _aligned(offset + array.nbytes, _line)
+            offset = _aligned(offset, _page)
+            header['sections']['profiles'] = {'offset': offset, 'dtype': '<u4', 'shape': [n_profiles, len(loci)]}
+            encoded = json.dumps(header).encode()
+            if len(encoded) <= len(header_bytes):
+                break
+            header_bytes = encoded + b' ' * 64
+        header_bytes = encoded.ljust(len(header_bytes))
+
+        with open(path + '.tmp', 'wb') as out:
+            out.write(MAGIC + len(header_bytes).to_bytes(8, 'little') + header_bytes)
+            for name, array in sections.items():
+                out.seek(header['sections'][name]['offset'])
+                out.write(array.tobytes())
+            out.seek(header['sections']['profiles']['offset'])
+            spool.seek(0)
+            shutil.copyfileobj(spool, out, 1 << 20)
+            out.truncate()
+        os.replace(path + '.tmp', path)
+    return n_profiles
+
+
+class ProfileDatabase:
+    """
+    Read-only profile database written by write_database. All sections are memory-mapped, so opening it costs
+    next to nothing and processes querying the same file share its pages.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as database_file:
+            if database_file.read(len(MAGIC)) != MAGIC:
+                raise ValueError('{} is not a pathinder profile database'.format(path))
+            header_length = int.from_bytes(database_file.read(8), 'little')
+            self.header = json.loads(database_file.read(header_length))
+        if self.header['format_version'] != FORMAT_VERSION:
+            raise ValueError('{} has format version {}, expected {}'.format(
+                path, self.header['format_version'], FORMAT_VERSION))
+        self.loci = self.header['loci']
+        self.sections = {name: self._map(name) for name in self.header['sections']}
+        self.profiles = self.sections['profiles']
+
+    def _map(self, name: str) -> np.ndarray:
+        section = self.header['sections'][name]
+        shape = tuple(section['shape'])
+        if 0 in shape:
+            # numpy.memmap cannot map an empty range
+            return np.zeros(shape, dtype=section['dtype'])
+        return np.memmap(self.path, dtype=section['dtype'], mode='r', offset=section['offset'], shape=shape)
+
+    def generation(self) -> int:
+        """
+        Changes whenever the file is rewritten, to invalidate data derived from it (e.g. the allele index).
+        """
+        return os.stat(self.path).st_mtime_ns
+
+    def metadata(self, field: str) -> np.ndarray:
+        return self.sections[field]
+
+    def encode_query(self, hashes: list[str]) -> np.ndarray:
+        """
+        Encodes a query profile with the codes of the database, alleles it does not know become UNKNOWN.
+        """
+        keys, codes = self.sections['allele_keys'], self.sections['allele_codes']
+        hashes = allele_keys(hashes)
+        query = np.full(len(hashes), UNKNOWN, dtype=np.uint32)
+        called = [locus for locus, allele_hash in enumerate(hashes) if allele_hash != '']
+        query[[locus for locus, allele_hash in enumerate(hashes) if allele_hash == '']] = MISSING
+        if called and len(keys):
+            wanted = np.array([int(hashes[locus], 16) for locus in called], dtype='<u8')
+            found = np.minimum(np.searchsorted(keys, wanted), len(keys) - 1)
+            known = keys[found] == wanted
+            query[np.array(called)[known]] = codes[found[known]]
+        return query
+
+    def __len__(self) -> int:
+        return self.header['n_profiles']
+
+
+@click.group()
+def main():
+    pass
+
+
+@main.command()
+@click.option('--reference', required=True, help='Reference FASTA of the cgMLST scheme, gives the locus order')
+@click.option('--out', required=True, help='Path of the profile database to write')
+@click.argument('tsv_files', nargs=-1, required=True)
+def convert(reference: str, out: str, tsv_files: tuple[str]):
+    """
+    Converts Hashing.py TSV files and LAPIS TSV dumps into a profile database.
+    """
+    loci = read_reference_loci(reference)
+    try:
+        n_profiles = write_database(out, loci, (row for tsv_file in tsv_files for row in read_tsv_rows(tsv_file)))
+    except ValueError as error:
+        raise click.ClickException(str(error))
+    print('Wrote {} profiles over {} loci to {}'.format(n_profiles, len(loci), out))
+
+
+if __name__ == '__main__':
+    main()
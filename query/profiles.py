@@ -0,0 +1,147 @@
+import numpy as np
+
+
+# Code of a locus without a called allele; never counted as a match or a mismatch
+MISSING = 0
+# Code of a query allele that does not occur in the database, so it can never match
+UNKNOWN = np.iinfo(np.uint32).max
+
+
+class AlleleEncoder:
+    """
+    Maps allele hashes to small integer codes, assigned in order of appearance starting from 1. The hash of an
+    allele sequence identifies its locus too, so the codes are shared by all loci: a profile keeps its alleles
+    at their positions, but an allele has the same code wherever it is. Profiles whose loci are not in the
+    same order (e.g. profiles that leave out missing loci instead of keeping an empty hash in their place) still
+    share the codes of their common alleles.
+    """
+
+    def __init__(self, alleles: dict[str, int] = None):
+        self.alleles = alleles if alleles is not None else {}
+
+    def encode(self, hashes: list[str], extend: bool = True) -> tuple[np.ndarray, list[tuple[str, int]]]:
+        """
+        Returns the codes of a profile and the (hash, code) pairs that were newly assigned.
+        With extend=False, alleles that are not known yet are encoded as UNKNOWN instead.
+        """
+        codes = np.empty(len(hashes), dtype=np.uint32)
+        added = []
+        for locus, allele_hash in enumerate(hashes):
+            if allele_hash == '':
+                codes[locus] = MISSING
+                continue
+            code = self.alleles.get(allele_hash)
+            if code is None:
+                if not extend:
+                    code = UNKNOWN
+                else:
+                    code = len(self.alleles) + 1
+                    self.alleles[allele_hash] = code
+                    added.append((allele_hash, code))
+            codes[locus] = code
+        return codes, added
+
+
+def stack_profiles(profiles: list[np.ndarray], n_loci: int = 0) -> np.ndarray:
+    """
+    Stacks profiles of different lengths into one (n_genomes, n_loci) matrix, padding with MISSING.
+    """
+    n_loci = max([n_loci] + [len(profile) for profile in profiles])
+    matrix = np.zeros((len(profiles), n_loci), dtype=np.uint32)
+    for row, profile in zip(matrix, profiles):
+        row[:len(profile)] = profile
+    return matrix
+
+
+def _allele_mask(query: np.ndarray) -> np.ndarray:
+    # True at the codes of the called, known alleles of the query; the last entry stays False and stands for all
+    # larger codes (see count_matches)
+    codes = query[(query != MISSING) & (query != UNKNOWN)]
+    mask = np.zeros(int(codes.max()) + 2 if len(codes) else 1, dtype=bool)
+    mask[codes] = True
+    return mask
+
+
+def count_matches(query: np.ndarray, profiles: np.ndarray) -> np.ndarray:
+    """
+    Number of query alleles in each profile, wherever they are in the profile. Matching on the alleles rather
+    than on the positions keeps profiles comparable whose loci are shifted by left out missing loci, as the
+    comma-separated hashes of MLSType output without a reference locus order are.
+    """
+    if profiles.shape[1] == 0:
+        return np.zeros(len(profiles), dtype=np.int64)
+    return np.count_nonzero(np.take(_allele_mask(query), profiles, mode='clip'), axis=1)
+
+
+def match(query: np.ndarray, profiles: np.ndarray) -> np.ndarray:
+    return count_matches(query, profiles) / max(np.count_nonzero(query != MISSING), 1)
+
+
+def jacquard_similarity(query: np.ndarray, profiles: np.ndarray) -> np.ndarray:
+    matched = count_matches(query, profiles)
+    union = np.count_nonzero(query != MISSING) + np.count_nonzero(profiles != MISSING, axis=1) - matched
+    return matched / np.maximum(union, 1)
+
+
+def hamming_distance(query: np.ndarray, profiles: np.ndarray) -> np.ndarray:
+    """
+    Number of loci at which the alleles differ, ignoring loci that are missing in either profile. Unlike the
+    match counts, distances compare the loci by position, so they need profiles in the locus order of the
+    reference (see Hashing.py).
+    """
+    n_loci = min(len(query), profiles.shape[1])
+    query, profiles = query[:n_loci], profiles[:, :n_loci]
+    return np.count_nonzero((profiles != query) & (profiles != MISSING) & (query != MISSING), axis=1)
+
+
+# Upper bound for the number of (query, profile, locus) matches expanded at once by count_matches_many
+match_budget = 1 << 23
+
+
+def count_matches_many(queries: np.ndarray, profiles: np.ndarray) -> np.ndarray:
+    """
+    (n_queries, n_profiles) matrix of the number of alleles every query shares with every profile, counted as
+    count_matches does for each query. All queries are scored in one pass over the profiles: the codes of the
+    profiles are looked up in one table of the queries that carry each allele, and the matches of a block of
+    profiles are counted with a single bincount over (query, profile) pairs.
+    """
+    counts = np.zeros((len(queries), len(profiles)), dtype=np.int32)
+    if len(queries) == 0 or profiles.size == 0:
+        return counts
+    # The (allele, query) pairs of the called, known alleles, each once however many loci carry the allele
+    query_rows, query_loci = np.nonzero((queries != MISSING) & (queries != UNKNOWN))
+    pairs = np.unique(queries[query_rows, query_loci].astype(np.int64) * len(queries) + query_rows)
+    if len(pairs) == 0:
+        return counts
+    alleles, first, carriers = np.unique(pairs // len(queries), return_index=True, return_counts=True)
+    carrier_queries = pairs % len(queries)
+    # Entry of every code in alleles, counted from 1; 0 for the codes no query carries, including all codes
+    # above the largest one, which np.take clips to the last entry
+    lookup = np.zeros(int(alleles[-1]) + 2, dtype=np.int64)
+    lookup[alleles] = np.arange(1, len(alleles) + 1)
+    first, carriers = np.concatenate([[0], first]), np.concatenate([[0], carriers])
+    block_rows = max(1, match_budget // (profiles.shape[1] * max(int(carriers.max()), 1)))
+    for start in range(0, len(profiles), block_rows):
+        block = np.take(lookup, profiles[start:start + block_rows], mode='clip')
+        cell_rows, cell_loci = np.nonzero(block)
+        entries = block[cell_rows, cell_loci]
+        # every matching cell stands for one match with each query carrying its allele
+        repeats = carriers[entries]
+        ends = np.cumsum(repeats)
+        positions = np.arange(ends[-1] if len(ends) else 0) - np.repeat(ends - repeats - first[entries], repeats)
+        pair_index = carrier_queries[positions] * len(block) + np.repeat(cell_rows, repeats)
+        counts[:, start:start + len(block)] = np.bincount(pair_index, minlength=len(queries) * len(block)).reshape(
+            len(queries), len(block))
+    return counts
+
+
+def match_many(queries: np.ndarray, profiles: np.ndarray) -> np.ndarray:
+    called = np.count_nonzero(queries != MISSING, axis=1)
+    return count_matches_many(queries, profiles) / np.maximum(called, 1)[:, None]
+
+
+def jacquard_similarity_many(queries: np.ndarray, profiles: np.ndarray) -> np.ndarray:
+    matched = count_matches_many(queries, profiles)
+    union = (np.count_nonzero(queries != MISSING, axis=1)[:, None] +
+             np.count_nonzero(profiles != MISSING, axis=1)[None, :] - matched)
+    return matched / np.maximum(union, 1)
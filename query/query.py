@@ -1,75 +1,386 @@
+import os
+import sys
 import click
+import zipfile
 import requests
 import csv
+import numpy as np
 from dataclasses import dataclass
+from typing import Iterator, Optional
+
+try:
+    from store import ProfileStore, ResultCache, default_store_path
+    from profiles import jacquard_similarity, match, stack_profiles, jacquard_similarity_many, match_many
+    from distance import all_vs_all
+    from index import AlleleIndex
+    from sketch import sketch_hashes, screen
+    from profile_db import ProfileDatabase, read_reference_loci
+    from codec import profile_keys, encode_profile, ProfileDictionary
+except ImportError:
+    from query.store import ProfileStore, ResultCache, default_store_path
+    from query.profiles import jacquard_similarity, match, stack_profiles, jacquard_similarity_many, match_many
+    from query.distance import all_vs_all
+    from query.index import AlleleIndex
+    from query.sketch import sketch_hashes, screen
+    from query.profile_db import ProfileDatabase, read_reference_loci
+    from query.codec import profile_keys, encode_profile, ProfileDictionary
 
 
 loculus_website = 'https://microbioinfo-hackathon.loculus.org'
 loculus_lapis = 'https://lapis-microbioinfo-hackathon.loculus.org/salmonella'
 
+# Reference alleles of the cgMLST scheme, whose locus order the profiles are hashed in (see Hashing.py)
+default_reference = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'test', 'cgMLST_v2_ref.fasta')
+
+# A profileHash field is ~100 KB, close to the default limit of the csv module
+csv.field_size_limit(1 << 26)
+
+# A query server (server.py) listening here is asked first, the queries are answered in process if none is running
+default_server_port = 8095
+default_server_url = os.environ.get('PATHINDER_SERVER', 'http://127.0.0.1:{}'.format(default_server_port))
+# Seconds to wait for the answer of the query server, e.g. one that hangs, before querying in process
+server_timeout = 60
+
 
-@dataclass
+@dataclass(slots=True)
 class SequenceEntry:
     submission_id: str
     group_name: str
     group_id: str
     collection_date: str
     location: str
-    profile_hash: set[str]
+    profile: np.ndarray
+    accession: str = ''
+
+
+class SequenceDatabase:
+    """
+    Columnar collection of sequence entries. The metadata fields are kept as arrays of UTF-8 byte strings and
+    the profiles as one (n_entries, n_loci) uint32 matrix, entries are only created as SequenceEntry views
+    (sharing the profile row) when accessed. The arrays can be memory-mapped from a profile database. Entries
+    without an accession (e.g. from a plain download) have an empty one.
+    """
+    __slots__ = ('submission_ids', 'group_names', 'group_ids', 'collection_dates', 'locations', 'profiles',
+                 'accessions')
+
+    def __init__(self, submission_ids: np.ndarray, group_names: np.ndarray, group_ids: np.ndarray,
+                 collection_dates: np.ndarray, locations: np.ndarray, profiles: np.ndarray,
+                 accessions: np.ndarray = None):
+        self.submission_ids = submission_ids
+        self.group_names = group_names
+        self.group_ids = group_ids
+        self.collection_dates = collection_dates
+        self.locations = locations
+        self.profiles = profiles
+        self.accessions = accessions if accessions is not None else np.zeros(len(submission_ids), dtype='S1')
+
+    @classmethod
+    def from_metadata(cls, metadata: list[tuple], profiles: np.ndarray, accessions: list[str] = None) -> 'SequenceDatabase':
+        columns = list(zip(*metadata)) if metadata else [()] * 5
+        return cls(*(np.array([value.encode() for value in column], dtype=bytes) for column in columns), profiles,
+                   np.array([accession.encode() for accession in accessions], dtype=bytes) if accessions else None)
 
+    @classmethod
+    def from_profile_database(cls, database: ProfileDatabase) -> 'SequenceDatabase':
+        return cls(*(database.metadata(field) for field in
+                     ['submission_id', 'group_name', 'group_id', 'collection_date', 'location']), database.profiles,
+                   database.metadata('accession'))
 
-def read_hashes_from_file(file_path: str) -> set[str]:
+    def __len__(self) -> int:
+        return len(self.submission_ids)
+
+    def __getitem__(self, row: int) -> SequenceEntry:
+        return SequenceEntry(
+            submission_id=self.submission_ids[row].decode(),
+            group_name=self.group_names[row].decode(),
+            group_id=self.group_ids[row].decode(),
+            collection_date=self.collection_dates[row].decode(),
+            location=self.locations[row].decode(),
+            profile=self.profiles[row],
+            accession=self.accessions[row].decode()
+        )
+
+    def __iter__(self) -> Iterator[SequenceEntry]:
+        for row in range(len(self)):
+            yield self[row]
+
+    def take(self, rows: np.ndarray) -> 'SequenceDatabase':
+        """
+        Returns the entries at `rows` as a new SequenceDatabase.
+        """
+        return SequenceDatabase(*(getattr(self, column)[rows] for column in self.__slots__))
+
+    def submission_id_list(self) -> list[str]:
+        return [submission_id.decode() for submission_id in self.submission_ids.tolist()]
+
+    def nbytes(self) -> int:
+        return sum(column.nbytes for column in (self.submission_ids, self.group_names, self.group_ids,
+                                               self.collection_dates, self.locations, self.profiles,
+                                               self.accessions))
+
+
+def read_hashes_from_file(file_path: str) -> list[str]:
     with open(file_path, 'r') as file:
-        hashes = file.read().strip().split(',')
-    return set(hashes)
-
-
-def download_from_loculus() -> list[SequenceEntry]:
-    query_url = loculus_lapis + ('/sample/details?dataFormat=tsv'
-                                '&fields=submissionId,groupName,groupId,collectionDate,location,profileHash')
-    response = requests.get(query_url)
-
-    if response.status_code == 200:
-        tsv_data = response.text
-        sequence_entries = []
-
-        reader = csv.DictReader(tsv_data.splitlines(), delimiter='\t')
-        for row in reader:
-            entry = SequenceEntry(
-                submission_id=row['submissionId'],
-                group_name=row['groupName'],
-                group_id=row['groupId'],
-                collection_date=row['collectionDate'],
-                location=row['location'],
-                profile_hash=set(row['profileHash'].split(','))
-            )
-            sequence_entries.append(entry)
-
-        return sequence_entries
-    else:
-        print(f"Error: Unable to download data from loculus. Status code {response.status_code}")
+        try:
+            return profile_keys(file.read().strip(), ProfileDictionary())
+        except ValueError as error:
+            raise click.ClickException('{}: {}'.format(file_path, error))
+
+
+def read_query_profiles(path: str) -> list[tuple[str, list[str]]]:
+    """
+    Returns (name, allele keys) of the query profiles in a Hashing.py TSV file with any number of rows, or in
+    every file of a directory; a file holding only a profile (comma-separated hashes, compact or
+    dictionary-coded) is named after the file.
+    """
+    if os.path.isdir(path):
+        queries = []
+        for file_name in sorted(os.listdir(path)):
+            if os.path.isfile(os.path.join(path, file_name)):
+                queries.extend(read_query_profiles(os.path.join(path, file_name)))
+        return queries
+    with open(path, 'r') as file:
+        header = file.readline()
+        try:
+            if 'profileHash' not in header.rstrip('\r\n').split('\t'):
+                return [(os.path.splitext(os.path.basename(path))[0],
+                         profile_keys((header + file.read()).strip(), ProfileDictionary()))]
+            file.seek(0)
+            dictionary = ProfileDictionary()
+            return [(row['submissionId'], profile_keys(row['profileHash'], dictionary))
+                    for row in csv.DictReader(file, delimiter='\t')]
+        except ValueError as error:
+            raise click.ClickException('{}: {}'.format(path, error))
+
+
+def fetch_loculus_rows(lapis_url: str = loculus_lapis, released_after: int = None) -> Iterator[dict]:
+    query_url = lapis_url + ('/sample/details?dataFormat=tsv&versionStatus=LATEST_VERSION'
+                             '&fields=accession,version,releasedAtTimestamp,isRevocation,'
+                             'submissionId,groupName,groupId,collectionDate,location,profileHash')
+    if released_after is not None:
+        # Inclusive bound, so that entries released in the same second as the last sync are not missed; those
+        # that were stored already are skipped by sync_store
+        query_url += '&releasedAtTimestampFrom={}'.format(released_after)
+    # Rows are parsed as they arrive, so the response is never held in memory as a whole
+    with requests.get(query_url, stream=True) as response:
+        if response.status_code == 200:
+            response.encoding = response.encoding or 'utf-8'
+            yield from csv.DictReader(response.iter_lines(chunk_size=1 << 16, decode_unicode=True), delimiter='\t')
+        else:
+            print(f"Error: Unable to download data from loculus. Status code {response.status_code}")
+
+
+def sync_store(store: ProfileStore, lapis_url: str = loculus_lapis) -> tuple[int, int]:
+    """
+    Fetches the entries released since the last sync into the store. Returns the number of entries written and
+    removed, entries that the store holds already are not counted.
+    """
+    revoked = []
+    last_released = store.last_released()
+
+    def updated_rows():
+        for row in fetch_loculus_rows(lapis_url, last_released):
+            released_at = int(row['releasedAtTimestamp'])
+            if row['isRevocation'] == 'true':
+                revoked.append((row['accession'], released_at))
+                continue
+            # Only entries of the last synced second come again, and are skipped if stored in the same version
+            if released_at == last_released and store.has_version(row['accession'], int(row['version'])):
+                continue
+            yield {
+                'accession': row['accession'],
+                'version': int(row['version']),
+                'released_at': released_at,
+                'submission_id': row['submissionId'],
+                'group_name': row['groupName'],
+                'group_id': row['groupId'],
+                'collection_date': row['collectionDate'],
+                'location': row['location'],
+                'profile_hash': row['profileHash']
+            }
+
+    written = store.upsert(updated_rows())
+    removed = store.remove(accession for accession, _ in revoked)
+    if revoked:
+        store.mark_released(max(released_at for _, released_at in revoked))
+    return written, removed
+
+
+def read_store(store: ProfileStore) -> SequenceDatabase:
+    metadata, profiles = store.load()
+    return SequenceDatabase.from_metadata(metadata, profiles, store.accessions())
+
+
+def load_index(index_path: str, generation: int, profiles: np.ndarray) -> AlleleIndex:
+    """
+    Returns the index saved at index_path if it belongs to this generation of the profiles, or builds and saves
+    a new one. An index that cannot be saved, e.g. next to a read-only database, is only kept in memory.
+    """
+    if os.path.exists(index_path):
+        try:
+            index, meta = AlleleIndex.load(index_path)
+        except (OSError, ValueError, EOFError, zipfile.BadZipFile):
+            index, meta = None, {}
+        if index is not None and int(meta.get('generation', -1)) == generation and \
+                index.n_profiles == len(profiles):
+            return index
+    index = AlleleIndex.build(profiles)
+    try:
+        index.save(index_path, generation=generation)
+    except OSError as error:
+        print('Could not save the index, it is rebuilt next time: {}'.format(error), file=sys.stderr)
+    return index
+
+
+def find(query: np.ndarray, database: SequenceDatabase, min_proportion_matched: float, comparison_method,
+         index: AlleleIndex = None, top_k: int = 0) -> list[(SequenceEntry, float)]:
+    if len(database) == 0:
         return []
+    profiles = database.profiles
+    if index is None:
+        proportions_matched = comparison_method(query, profiles)
+        rows = np.flatnonzero(proportions_matched >= min_proportion_matched)
+        proportions_matched = proportions_matched[rows]
+    elif top_k > 0 and comparison_method is match:
+        # index.top_k ranks on the match counts, which order match but not jacquard_similarity: that also
+        # depends on the called loci of the row, so the other methods score all candidates of the threshold
+        rows, proportions_matched = index.top_k(query, profiles, top_k, comparison_method)
+        keep = proportions_matched >= min_proportion_matched
+        rows, proportions_matched = rows[keep], proportions_matched[keep]
+    else:
+        rows, proportions_matched = index.find(query, profiles, min_proportion_matched, comparison_method)
+    if top_k > 0:
+        order = np.argsort(-proportions_matched, kind='stable')[:top_k]
+        rows, proportions_matched = rows[order], proportions_matched[order]
+    return [(database[row], float(proportion)) for row, proportion in zip(rows, proportions_matched)]
 
 
-def find(query: set[str], database: list[SequenceEntry], min_proportion_matched: float, comparison_method) -> list[(SequenceEntry, float)]:
-    matched: list[(SequenceEntry, float)] = []
-    for database_entry in database:
-        proportion_matched = comparison_method(query, database_entry.profile_hash)
-        if proportion_matched >= min_proportion_matched:
-            matched.append((database_entry, proportion_matched))
+def find_many(queries: np.ndarray, database: SequenceDatabase, min_proportion_matched: float, comparison_method,
+              index: AlleleIndex = None, top_k: int = 0) -> list[list[(SequenceEntry, float)]]:
+    """
+    Scores all queries in one pass over the database. With an index only the union of the candidate rows of
+    the queries is scored.
+    """
+    if len(database) == 0:
+        return [[] for _ in queries]
+    rows = np.arange(len(database)) if index is None else \
+        np.unique(np.concatenate([index.candidates(query, min_proportion_matched) for query in queries]))
+    scores = comparison_method(queries, database.profiles[rows]) if len(rows) else np.zeros((len(queries), 0))
+    matched = []
+    for query_scores in scores:
+        order = np.argsort(-query_scores, kind='stable')
+        order = order[query_scores[order] >= min_proportion_matched]
+        if top_k > 0:
+            order = order[:top_k]
+        matched.append([(database[rows[column]], float(query_scores[column])) for column in order])
     return matched
 
 
-def jacquard_similarity(query: set[str], database_entry_hashes: set[str]) -> float:
-    union = query.union(database_entry_hashes)
-    intersection = query.intersection(database_entry_hashes)
-    return len(intersection) / len(union)
+def find_with_sketches(store: ProfileStore, hashes: list[str], min_proportion_matched: float) -> tuple[int, list[(SequenceEntry, float)]]:
+    accessions, metadata, sketches = store.load_sketches()
+    # A query that leaves out missing loci is shorter than the profiles that keep their place
+    called = sum(allele_hash != '' for allele_hash in hashes) / max(len(hashes), store.max_loci(), 1)
+    candidates = screen(sketch_hashes(hashes), sketches, min_proportion_matched, called)
+    profiles = store.load_profiles([accessions[i] for i in candidates])
+    proportions_matched = match(store.encode_query(hashes), profiles) if len(candidates) else np.zeros(0)
+    matched = []
+    for row, profile, proportion_matched in zip(candidates, profiles, proportions_matched):
+        if proportion_matched >= min_proportion_matched:
+            submission_id, group_name, group_id, collection_date, location = metadata[row]
+            entry = SequenceEntry(submission_id, group_name, group_id, collection_date, location, profile,
+                                  accessions[row])
+            matched.append((entry, float(proportion_matched)))
+    return len(accessions), matched
+
+
+def load_database(hash_lists: list[list[str]], store_path: str, lapis_url: str, no_sync: bool,
+                  database_path: str = None) -> tuple[SequenceDatabase, AlleleIndex, list[np.ndarray]]:
+    """
+    Opens the profile database file or syncs and reads the local store, and encodes the query profiles with
+    its allele codes.
+    """
+    if database_path is not None:
+        profile_database = ProfileDatabase(database_path)
+        queries = [profile_database.encode_query(hashes) for hashes in hash_lists]
+        database = SequenceDatabase.from_profile_database(profile_database)
+        index = load_index(database_path + '.index.npz', profile_database.generation(), database.profiles)
+        return database, index, queries
+    with ProfileStore(store_path) as store:
+        if not no_sync:
+            sync_store(store, lapis_url)
+        queries = [store.encode_query(hashes) for hashes in hash_lists]
+        database = read_store(store)
+        index = load_index(store.path + '.index.npz', store.generation(), database.profiles)
+    return database, index, queries
+
+
+def find_cached(hash_lists: list[list[str]], store_path: str, lapis_url: str, no_sync: bool, comparison_method: str,
+                min_proportion_matched: float, top_k: int = 0) -> tuple[int, list[list[(SequenceEntry, float)]]]:
+    """
+    Like find_many on the local store, but the match lists are kept in the store (see ResultCache): a repeated
+    query is answered from its list, updated with only the entries synced since. The store is loaded only if a
+    query has no list yet.
+    """
+    single = jacquard_similarity if comparison_method == 'jaccard' else match
+    many = jacquard_similarity_many if comparison_method == 'jaccard' else match_many
+    with ProfileStore(store_path) as store:
+        if not no_sync:
+            sync_store(store, lapis_url)
+        cache = ResultCache(store)
+        keys = [ResultCache.key(hashes, comparison_method, min_proportion_matched) for hashes in hash_lists]
+        cached = [cache.get(key, hashes, single, min_proportion_matched) for key, hashes in zip(keys, hash_lists)]
+        missing = [i for i, matches in enumerate(cached) if matches is None]
+        if missing:
+            queries = stack_profiles([store.encode_query(hash_lists[i]) for i in missing])
+            database = read_store(store)
+            index = load_index(store.path + '.index.npz', store.generation(), database.profiles)
+            # Whole lists are cached, top_k only applies to what is reported
+            computed = find_many(queries, database, min_proportion_matched, many, index)
+            for i, matched in zip(missing, computed):
+                cached[i] = [(entry.accession, score) for entry, score in matched]
+                cache.put(keys[i], store.generation(), cached[i])
+        results = []
+        for matches in cached:
+            matches = matches[:top_k] if top_k > 0 else matches
+            entries = store.load_entries([accession for accession, _ in matches])
+            results.append([(SequenceEntry(*entry, accession=accession), score)
+                            for entry, (accession, score) in zip(entries, matches)])
+        return len(store), results
+
+
+def data_source(store_path: str, lapis_url: str, database_path: str = None) -> dict:
+    """
+    Identifies the profiles a query server answers from; a client only uses a server with the same source.
+    """
+    if database_path is not None:
+        return {'database': os.path.abspath(database_path)}
+    return {'store': os.path.abspath(store_path), 'lapis_url': lapis_url}
 
-def match(query: set[str], database_entry_hashes: set[str]) -> float:
-    matched_hashes = query.intersection(database_entry_hashes)
-    number_matched = len(matched_hashes)
-    return number_matched / len(query)
 
+def ask_server(server_url: str, path: str, request: dict, source: dict) -> Optional[dict]:
+    """
+    Sends a request to the query server at server_url. Returns None if no server is running there, it answers
+    from other profiles than `source` or it does not answer within server_timeout seconds, so that the caller
+    queries in process instead.
+    """
+    try:
+        response = requests.post(server_url + path, json=dict(request, source=source), timeout=(0.5, server_timeout))
+    except requests.ReadTimeout:
+        print('Query server did not answer within {} seconds, querying in process'.format(server_timeout))
+        return None
+    except requests.RequestException:
+        return None
+    if response.status_code != 200:
+        if response.status_code != 409:
+            print('Query server error {}, querying in process: {}'.format(response.status_code, response.text))
+        return None
+    return response.json()
+
+
+def served_entries(matches: list[dict]) -> list[(SequenceEntry, float)]:
+    return [(SequenceEntry(match['submission_id'], match['group_name'], match['group_id'], match['collection_date'],
+                           match['location'], np.zeros(0, dtype=np.uint32)), match['proportion_matched'])
+            for match in matches]
 
 
 def print_matched_entries(matched: list[(SequenceEntry, float)]):
@@ -86,7 +397,22 @@ def print_matched_entries(matched: list[(SequenceEntry, float)]):
         ))
 
 
-@click.command()
+@click.group()
+def main():
+    pass
+
+
+@main.command()
+@click.option('--store', 'store_path', default=default_store_path, help='Path to the local profile store')
+@click.option('--lapis-url', default=loculus_lapis, help='LAPIS endpoint of the Loculus instance')
+def sync(store_path: str, lapis_url: str):
+    with ProfileStore(store_path) as store:
+        written, removed = sync_store(store, lapis_url)
+        print('Fetched {} new or updated and removed {} revoked sequences, {} sequences in the local store'.format(
+            written, removed, len(store)))
+
+
+@main.command('find')
 @click.option('--hash-file', required=True, help='Path to a file with a comma-separated list of hashes')
 @click.option(
     '--min-proportion-matched',
@@ -97,19 +423,215 @@ def print_matched_entries(matched: list[(SequenceEntry, float)]):
     '--comparison-method',
     default='default',
     type=str,
-    help='Comparison method [default, jacquard]')
-def main(hash_file: str, min_proportion_matched: float, comparison_method: str):
+    help='Comparison method [default, jacquard, sketch]')
+@click.option('--top-k', default=0, type=int, help='Only report the k best matching sequences')
+@click.option('--store', 'store_path', default=default_store_path, help='Path to the local profile store')
+@click.option('--lapis-url', default=loculus_lapis, help='LAPIS endpoint of the Loculus instance')
+@click.option('--no-sync', is_flag=True, default=False, help='Query the local store without fetching updates first')
+@click.option('--database', 'database_path', default=None,
+              help='Query a profile database written by profile_db.py instead of the local store')
+@click.option('--server', 'server_url', default=default_server_url, help='Query server to ask first, see server.py')
+@click.option('--no-server', is_flag=True, default=False, help='Query in process even if a query server is running')
+@click.option('--no-cache', is_flag=True, default=False, help='Score the whole store instead of using the cached matches')
+def find_command(hash_file: str, min_proportion_matched: float, comparison_method: str, top_k: int, store_path: str,
+                 lapis_url: str, no_sync: bool, database_path: str, server_url: str, no_server: bool, no_cache: bool):
     print('Querying Patinder data with a minimal matching proportion of {:.2f}%'.format(min_proportion_matched * 100))
-    query = read_hashes_from_file(hash_file)
-    database = download_from_loculus()
+    if comparison_method == 'sketch':
+        if database_path is not None:
+            raise click.UsageError('--comparison-method sketch needs the local store')
+        with ProfileStore(store_path) as store:
+            if not no_sync:
+                sync_store(store, lapis_url)
+            # Approximate screening on the sketches, only the candidates are loaded and scored exactly
+            total, matched = find_with_sketches(store, read_hashes_from_file(hash_file), min_proportion_matched)
+        print('Total number of sequences in Patinder: {}'.format(total))
+        if top_k > 0:
+            matched = sorted(matched, key=lambda x: x[1], reverse=True)[:top_k]
+        print('{} sequences match the request'.format(len(matched)))
+        print_matched_entries(matched)
+        return
+    hashes = read_hashes_from_file(hash_file)
+    answer = None if no_server else ask_server(
+        server_url, '/find', {'profile': encode_profile(hashes), 'min_proportion_matched': min_proportion_matched,
+                              'comparison_method': comparison_method, 'top_k': top_k},
+        data_source(store_path, lapis_url, database_path))
+    if answer is not None:
+        # The server keeps its profiles synced on its own
+        print('Total number of sequences in Patinder: {}'.format(answer['total']))
+        matched = served_entries(answer['matches'])
+        print('{} sequences match the request'.format(len(matched)))
+        print_matched_entries(matched)
+        return
+    if database_path is None and not no_cache:
+        total, (matched,) = find_cached([hashes], store_path, lapis_url, no_sync, comparison_method,
+                                        min_proportion_matched, top_k)
+        print('Total number of sequences in Patinder: {}'.format(total))
+        print('{} sequences match the request'.format(len(matched)))
+        print_matched_entries(matched)
+        return
+    database, index, (query,) = load_database([hashes], store_path, lapis_url, no_sync, database_path)
     print('Total number of sequences in Patinder: {}'.format(len(database)))
     if comparison_method == 'jaccard':
-        matched = find(query, database, min_proportion_matched, jacquard_similarity)
+        matched = find(query, database, min_proportion_matched, jacquard_similarity, index, top_k)
     else:   
-        matched = find(query, database, min_proportion_matched, match)
+        matched = find(query, database, min_proportion_matched, match, index, top_k)
     print('{} sequences match the request'.format(len(matched)))
     print_matched_entries(matched)
 
 
+@main.command()
+@click.option('--queries', 'queries_path', required=True,
+              help='Hashing.py TSV file with one row per isolate, or a directory of hash files')
+@click.option('--out', required=True, help='Output TSV file with one row per match')
+@click.option(
+    '--min-proportion-matched',
+    default=0.95,
+    type=float,
+    help='The minimal proportion of the queried hashes that match the entry in the database')
+@click.option('--comparison-method', default='default', type=str, help='Comparison method [default, jacquard]')
+@click.option('--top-k', default=0, type=int, help='Only report the k best matching sequences per query')
+@click.option('--store', 'store_path', default=default_store_path, help='Path to the local profile store')
+@click.option('--lapis-url', default=loculus_lapis, help='LAPIS endpoint of the Loculus instance')
+@click.option('--no-sync', is_flag=True, default=False, help='Query the local store without fetching updates first')
+@click.option('--database', 'database_path', default=None,
+              help='Query a profile database written by profile_db.py instead of the local store')
+@click.option('--server', 'server_url', default=default_server_url, help='Query server to ask first, see server.py')
+@click.option('--no-server', is_flag=True, default=False, help='Query in process even if a query server is running')
+@click.option('--no-cache', is_flag=True, default=False, help='Score the whole store instead of using the cached matches')
+def batch(queries_path: str, out: str, min_proportion_matched: float, comparison_method: str, top_k: int,
+          store_path: str, lapis_url: str, no_sync: bool, database_path: str, server_url: str, no_server: bool,
+          no_cache: bool):
+    """
+    Queries all profiles of a sequencing run at once, the store is synced and the index loaded only once.
+    """
+    query_profiles = read_query_profiles(queries_path)
+    if not query_profiles:
+        raise click.UsageError('No query profiles found in {}'.format(queries_path))
+    names, hash_lists = zip(*query_profiles)
+    answer = None if no_server else ask_server(
+        server_url, '/batch', {'profiles': [encode_profile(hashes) for hashes in hash_lists],
+                               'min_proportion_matched': min_proportion_matched,
+                               'comparison_method': comparison_method, 'top_k': top_k},
+        data_source(store_path, lapis_url, database_path))
+    if answer is not None:
+        print('Querying {} profiles against {} sequences with a minimal matching proportion of {:.2f}%'.format(
+            len(names), answer['total'], min_proportion_matched * 100))
+        matched = [served_entries(query_matches) for query_matches in answer['matches']]
+    elif database_path is None and not no_cache:
+        total, matched = find_cached(list(hash_lists), store_path, lapis_url, no_sync, comparison_method,
+                                     min_proportion_matched, top_k)
+        print('Querying {} profiles against {} sequences with a minimal matching proportion of {:.2f}%'.format(
+            len(names), total, min_proportion_matched * 100))
+    else:
+        database, index, queries = load_database(list(hash_lists), store_path, lapis_url, no_sync, database_path)
+        print('Querying {} profiles against {} sequences with a minimal matching proportion of {:.2f}%'.format(
+            len(queries), len(database), min_proportion_matched * 100))
+        comparison = jacquard_similarity_many if comparison_method == 'jaccard' else match_many
+        matched = find_many(stack_profiles(queries), database, min_proportion_matched, comparison, index, top_k)
+    with open(out, 'w') as tsv_file:
+        tsv_file.write('query\tsubmissionId\tproportionMatched\tcollectionDate\tlocation\tgroupName\tgroupId\n')
+        for name, query_matched in zip(names, matched):
+            for entry, proportion_matched in query_matched:
+                tsv_file.write('\t'.join([name, entry.submission_id, '{:.4f}'.format(proportion_matched),
+                                          entry.collection_date, entry.location, entry.group_name,
+                                          entry.group_id]) + '\n')
+    print('{} matches of {} queries written to: {}'.format(sum(map(len, matched)), len(names), out))
+
+
+@main.command()
+@click.option('--in', 'in_path', required=True, help='Hashing.py TSV file, LAPIS TSV dump or hash file')
+@click.option('--out', required=True, help='Output file with the same rows and fields')
+@click.option('--compact/--expand', default=True, help='Write compact profiles, or comma-separated allele keys')
+@click.option('--dictionary', is_flag=True, default=False,
+              help='Write dictionary-coded profiles, which refer to the alleles of the rows before them')
+def convert(in_path: str, out: str, compact: bool, dictionary: bool):
+    """
+    Rewrites the profiles of a file in the compact form or back. Compact profiles keep the allele keys (the
+    leading 16 digits of the hashes, which profiles are compared on) but not the rest of the MD5 hashes, so
+    --expand writes the keys: a compact file converts back and forth exactly, the hashes of a comma-separated
+    file are cut to their keys. --dictionary writes the keys of the alleles seen before at a locus of the file
+    as their index, which is much smaller for related genomes, but the rows can then only be read in order:
+    expand such a file before submitting or serving it.
+    """
+    if dictionary and not compact:
+        raise click.UsageError('--dictionary writes a compact form, it cannot be combined with --expand')
+    read_dictionary, write_dictionary = ProfileDictionary(), ProfileDictionary()
+
+    def convert_profile(profile_hash: str) -> str:
+        try:
+            keys = profile_keys(profile_hash, read_dictionary)
+        except ValueError as error:
+            raise click.ClickException('{}: {}'.format(in_path, error))
+        if dictionary:
+            return write_dictionary.encode(keys)
+        return encode_profile(keys) if compact else ','.join(keys)
+
+    with open(in_path, 'r', newline='') as in_file, open(out, 'w', newline='') as out_file:
+        header = in_file.readline()
+        if 'profileHash' not in header.rstrip('\r\n').split('\t'):
+            out_file.write(convert_profile((header + in_file.read()).strip()) + '\n')
+            converted = 1
+        else:
+            in_file.seek(0)
+            reader = csv.DictReader(in_file, delimiter='\t')
+            writer = csv.DictWriter(out_file, reader.fieldnames, delimiter='\t', lineterminator='\n')
+            writer.writeheader()
+            converted = 0
+            for row in reader:
+                row['profileHash'] = convert_profile(row['profileHash'])
+                writer.writerow(row)
+                converted += 1
+    print('Converted {} profiles to {}'.format(converted, out))
+
+
+@main.command()
+@click.option('--out', required=True, help='Output file, a TSV matrix or a .npy array for large collections')
+@click.option('--threads', default=0, type=int, help='Number of threads, all cores by default')
+@click.option('--store', 'store_path', default=default_store_path, help='Path to the local profile store')
+@click.option('--lapis-url', default=loculus_lapis, help='LAPIS endpoint of the Loculus instance')
+@click.option('--no-sync', is_flag=True, default=False, help='Use the local store without fetching updates first')
+@click.option('--database', 'database_path', default=None,
+              help='Use a profile database written by profile_db.py instead of the local store')
+@click.option('--reference', default=default_reference,
+              help='Reference FASTA of the cgMLST scheme, profiles of the store need one hash per locus of it')
+def distances(out: str, threads: int, store_path: str, lapis_url: str, no_sync: bool, database_path: str,
+              reference: str):
+    """
+    Writes the pairwise hamming distances of all sequences. Distances compare the loci by position, so sequences
+    of the store whose profile does not have one hash per locus of the reference (e.g. hashed without a
+    reference, with their missing loci left out) are left out and reported, as profile_db.py refuses them.
+    """
+    if database_path is not None:
+        database = SequenceDatabase.from_profile_database(ProfileDatabase(database_path))
+    else:
+        n_loci = len(read_reference_loci(reference))
+        with ProfileStore(store_path) as store:
+            if not no_sync:
+                sync_store(store, lapis_url)
+            database = read_store(store)
+            aligned = store.profile_lengths() == n_loci
+        if not aligned.all():
+            left_out = database.take(np.flatnonzero(~aligned)).submission_id_list()
+            print('Leaving out {} sequences whose profiles do not have the {} loci of the reference: {}{}'.format(
+                len(left_out), n_loci, ', '.join(left_out[:10]), ', ...' if len(left_out) > 10 else ''))
+        database = database.take(np.flatnonzero(aligned))
+        database.profiles = database.profiles[:, :n_loci]
+    print('Computing pairwise hamming distances of {} sequences'.format(len(database)))
+    if out.endswith('.npy'):
+        matrix = np.lib.format.open_memmap(out, mode='w+', dtype=np.uint16, shape=(len(database), len(database)))
+        all_vs_all(database.profiles, threads, out=matrix)
+        matrix.flush()
+        with open(out[:-len('.npy')] + '.ids.txt', 'w') as ids_file:
+            ids_file.writelines(submission_id + '\n' for submission_id in database.submission_id_list())
+    else:
+        matrix = all_vs_all(database.profiles, threads)
+        submission_ids = database.submission_id_list()
+        with open(out, 'w') as tsv_file:
+            tsv_file.write('\t'.join([''] + submission_ids) + '\n')
+            for submission_id, row in zip(submission_ids, matrix):
+                tsv_file.write(submission_id + '\t' + '\t'.join(map(str, row.tolist())) + '\n')
+    print('Output written to: {}'.format(out))
+
+
 if __name__ == '__main__':
     main()
@@ -0,0 +1,201 @@
+import gzip
+import mmap
+import hashlib
+import numpy as np
+from typing import Iterable, Iterator, Optional, Union
+
+
+# Upper-cases a sequence and drops its line breaks and other whitespace in one bytes.translate pass
+_upper = bytes.maketrans(b'abcdefghijklmnopqrstuvwxyz', b'ABCDEFGHIJKLMNOPQRSTUVWXYZ')
+_whitespace = b' \t\r\n\x0b\x0c'
+
+# Lower-cases A, C, G and T and turns anything else into n, the normalization of the alleles in a profile hash
+NORMALIZE_TABLE = bytes(byte | 0x20 if byte in b'ACGTacgt' else ord('n') for byte in range(256))
+
+block_size = 1 << 24
+
+Sequence = Union[bytes, str, np.ndarray]
+
+
+def as_bytes(text: Union[bytes, str]) -> bytes:
+    return text.encode() if isinstance(text, str) else bytes(text)
+
+
+def read_bytes(path: str) -> bytes:
+    """
+    Returns the content of a file, decompressed if its name ends with gz.
+    """
+    with (gzip.open(path, 'rb') if path.lower().endswith('gz') else open(path, 'rb')) as fin:
+        return fin.read()
+
+
+def _file_blocks(path: str, size: int, use_mmap: bool) -> Iterator[bytes]:
+    if path.lower().endswith('gz'):
+        with gzip.open(path, 'rb') as fin:
+            while True:
+                block = fin.read(size)
+                if not block:
+                    return
+                yield block
+    with open(path, 'rb') as fin:
+        if use_mmap:
+            try:
+                mapped = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # an empty file cannot be mapped
+                return
+            with mapped:
+                for start in range(0, len(mapped), size):
+                    yield mapped[start:start + size]
+            return
+        while True:
+            block = fin.read(size)
+            if not block:
+                return
+            yield block
+
+
+def _name(header: bytes) -> str:
+    fields = header.split(None, 1)
+    return fields[0].decode() if fields else ''
+
+
+def _convert(sequence: bytes, kind: str) -> Sequence:
+    if kind == 'str':
+        return sequence.decode('latin-1')
+    if kind == 'array':
+        return np.frombuffer(sequence, dtype=np.uint8)
+    return sequence
+
+
+def _fasta_records(data: bytes, stop: int, skip_comments: bool, head_only: bool) -> Iterator[tuple[str, bytes]]:
+    # data[:stop] holds whole records; text before the first header is ignored
+    if data.startswith(b'>'):
+        pos = 0
+    elif data.find(b'\n>', 0, stop) >= 0:
+        pos = data.find(b'\n>', 0, stop) + 1
+    else:
+        return
+    while pos < stop:
+        end = data.find(b'\n>', pos, stop)
+        end = stop if end < 0 else end
+        header_end = data.find(b'\n', pos, end)
+        header_end = end if header_end < 0 else header_end
+        name = _name(data[pos + 1:header_end])
+        if head_only:
+            yield name, b''
+        else:
+            body = data[header_end:end]
+            if skip_comments and b'\n#' in body:
+                body = b'\n'.join(line for line in body.split(b'\n') if not line.startswith(b'#'))
+            yield name, body.translate(_upper, _whitespace)
+        pos = end + 1
+
+
+def _fastq_records(lines: list) -> Iterator[tuple[str, bytes, bytes]]:
+    # four lines per record, as the former line-by-line readers expected
+    for header, sequence, quality in zip(lines[0::4], lines[1::4], lines[3::4]):
+        yield _name(header[1:]), sequence.translate(_upper, _whitespace), quality.translate(None, _whitespace)
+
+
+def iter_blocks(blocks: Iterable[bytes], kind: str = 'bytes', skip_comments: bool = False,
+                head_only: bool = False) -> Iterator[tuple[str, Sequence, Optional[bytes]]]:
+    """
+    Yields (name, sequence, quality) of every FASTA or FASTQ record in a stream of byte blocks; the quality is
+    None for FASTA. Records are cut at block boundaries with a few bytes operations per block and record, the
+    lines of a sequence are never visited one by one.
+    """
+    carry, fastq = b'', None
+    for block in blocks:
+        data = carry + block
+        if fastq is None:
+            start = data.lstrip()
+            if not start:
+                carry = data
+                continue
+            fastq = start.startswith(b'@')
+        if fastq:
+            lines = data.split(b'\n')
+            complete = (len(lines) - 1) // 4 * 4
+            for name, sequence, quality in _fastq_records(lines[:complete]):
+                yield name, _convert(sequence, kind), quality
+            carry = b'\n'.join(lines[complete:])
+        else:
+            cut = data.rfind(b'\n>')
+            if cut < 0:
+                carry = data
+                continue
+            for name, sequence in _fasta_records(data, cut, skip_comments, head_only):
+                yield name, _convert(sequence, kind), None
+            carry = data[cut + 1:]
+    if fastq:
+        lines = carry.split(b'\n')
+        lines += [b''] * (-len(lines) % 4)
+        for name, sequence, quality in _fastq_records(lines):
+            if name:
+                yield name, _convert(sequence, kind), quality
+    elif fastq is not None:
+        for name, sequence in _fasta_records(carry, len(carry), skip_comments, head_only):
+            yield name, _convert(sequence, kind), None
+
+
+def iter_records(path: str, kind: str = 'bytes', skip_comments: bool = False, head_only: bool = False,
+                 use_mmap: bool = True, size: int = block_size) -> Iterator[tuple[str, Sequence, Optional[bytes]]]:
+    """
+    Streams the records of a FASTA or FASTQ file, optionally gzipped, in blocks of `size` bytes. Uncompressed
+    files are memory-mapped unless use_mmap is False. Sequences are upper-cased and returned as bytes, str
+    or uint8 arrays (kind 'bytes', 'str' or 'array').
+    """
+    return iter_blocks(_file_blocks(path, size, use_mmap), kind, skip_comments, head_only)
+
+
+def parse_sequences(text: Union[bytes, str], kind: str = 'str') -> tuple[dict, Optional[dict]]:
+    """
+    Sequences and qualities (None for FASTA) of FASTA or FASTQ text held in memory. A name that occurs twice
+    keeps its first position and its last sequence.
+    """
+    return _collect(iter_blocks([as_bytes(text)], kind))
+
+
+def read_sequences(path: str, kind: str = 'str', skip_comments: bool = False, head_only: bool = False,
+                   use_mmap: bool = True) -> tuple[dict, Optional[dict]]:
+    """
+    Sequences and qualities (None for FASTA) of a FASTA or FASTQ file, as parse_sequences.
+    """
+    return _collect(iter_records(path, kind, skip_comments, head_only, use_mmap))
+
+
+def _collect(records: Iterator[tuple[str, Sequence, Optional[bytes]]]) -> tuple[dict, Optional[dict]]:
+    sequences, qualities, fastq = {}, {}, False
+    for name, sequence, quality in records:
+        sequences[name] = sequence
+        if quality is not None:
+            qualities[name], fastq = quality.decode('latin-1'), True
+    return sequences, qualities if fastq else None
+
+
+def allele_hash(sequence: Union[bytes, str]) -> str:
+    """
+    MD5 of an allele as it goes into a profile hash: normalized with NORMALIZE_TABLE, without its line breaks and
+    surrounding whitespace.
+    """
+    return hashlib.md5(as_bytes(sequence).strip().translate(NORMALIZE_TABLE, b'\r\n')).hexdigest()
+
+
+def read_profile(text: Union[bytes, str]) -> dict:
+    """
+    Profile of MLSType FASTA output: locus -> (allele_hash of its allele, the accepted flags of its header), in
+    the order of the records. Text before the first header is ignored.
+    """
+    data = as_bytes(text)
+    if not data.startswith(b'>'):
+        start = data.find(b'\n>')
+        data = data[start + 1:] if start >= 0 else b''
+    profile = {}
+    for record in data[1:].split(b'\n>') if data else []:
+        header, _, sequence = record.partition(b'\n')
+        fields = header.split()
+        if fields:
+            accepted = [field[9:] for field in fields if field.startswith(b'accepted=')]
+            profile[fields[0].decode()] = (allele_hash(sequence), int(accepted[0]) if accepted and accepted[0].isdigit() else 0)
+    return profile
@@ -1,89 +1,63 @@
-import os, sys, numpy as np, tempfile, shutil, re, gzip
-from subprocess import Popen, PIPE
+import os, sys, numpy as np, tempfile, shutil, re, gzip, zlib, hashlib, time, csv, sqlite3
+from subprocess import Popen, PIPE, DEVNULL
 from operator import itemgetter
+from concurrent.futures import ThreadPoolExecutor
 try:
-    from configure import externals, rc, uopen, xrange, get_md5
+    from configure import externals, rc, uopen, xrange, get_md5, logger
+    from seqio import read_sequences, parse_sequences, read_bytes, as_bytes, allele_hash, read_profile
+    from translate import codon_table, encode, reverse_complement, translate_frames, map_sequences, INVALID
 except :
     try:
-        from query.configure import externals, rc, uopen, xrange, get_md5
+        from query.configure import externals, rc, uopen, xrange, get_md5, logger
+        from query.seqio import read_sequences, parse_sequences, read_bytes, as_bytes, allele_hash, read_profile
+        from query.translate import codon_table, encode, reverse_complement, translate_frames, map_sequences, INVALID
     except:
-        from configure import externals, rc, uopen, xrange, get_md5
+        from configure import externals, rc, uopen, xrange, get_md5, logger
+        from seqio import read_sequences, parse_sequences, read_bytes, as_bytes, allele_hash, read_profile
+        from translate import codon_table, encode, reverse_complement, translate_frames, map_sequences, INVALID
 
 usearch = externals['usearch']
 makeblastdb = externals['makeblastdb']
 blastn = externals['blastn']
 
 
-def transeq(seq, frames=[1,2,3,4,5,6]) :
-    gtable = np.array(list('KNKNTTTTRSRSIIMIQHQHPPPPRRRRLLLLEDEDAAAAGGGGVVVVXYXYSSSSXCWCLFLF '))
-    if isinstance(seq, dict) :
-        names, seqs = [], []
-        for n,s in seq.items() :
-            names.append(n)
-            seqs.append( 'Y' * ((3-len(s)%3)%3) + re.sub(r'[^ACGT]', 'X', s.upper()) + 'Z' * ((3-len(s)%3)%3) )
-    else :
-        names, seqs = [n for n,s in seq], [re.sub(r'[^ACGT]', 'X', s.upper()) + 'X' * ((3-len(s)%3)%3) for n, s in seq]
-    trans_seq = [[n, []] for n in names]
-    mseqs = np.unique(list('   '.join(seqs)) + [' ', 'A', 'C', 'G', 'T', 'X', 'Y', 'Z'], return_inverse=True)[1][:-8]
-    seqs = mseqs[mseqs != 6]
-    rseqs = np.flip(5-mseqs[mseqs != 7], 0)
-    seqs[seqs == 0], seqs[seqs >= 5] = -100000, -100
-    rseqs[rseqs <= 0], rseqs[rseqs == 5] = -100, -100000
-    seqs -= 1; rseqs -= 1
-    for frame in frames :
-        if frame <= 3 :
-            codons = np.concatenate([seqs[frame-1:], np.array([-100]*(frame-1), dtype=int)]).reshape(-1, 3)
-        else :
-            codons = np.concatenate([rseqs[frame-4:], np.array([-100]*(frame-4), dtype=int)]).reshape(-1, 3)
-        codons[:, 0] <<= 4
-        codons[:, 1] <<= 2
-        codons = np.sum(codons, 1)
-        codons[codons < -1000000] = 64
-        codons[codons < 0] = 50
-        tseq = ''.join(gtable[codons]).split(' ')
-        if frame <= 3 :
-            for ts, tt in zip(trans_seq, tseq) :
-                ts[1].append(tt)
-        else :
-            for ts, tt in zip(trans_seq, tseq[::-1]) :
-                ts[1].append(tt)
-    return dict(trans_seq) if isinstance(seq, dict) else trans_seq
+# complement of every byte after upper-casing, anything but a base becomes N
+_rcTable = bytes(b'TGCATGCA'[b'ACGTacgt'.index(i)] if i in b'ACGTacgt' else ord('N') for i in xrange(256))
+
+def rev_comp(seq) :
+    return seq.encode('latin-1').translate(_rcTable)[::-1].decode('latin-1')
+
+def is_acgt(seq) :
+    # True if seq only has A, C, G and T
+    return len(seq.encode('latin-1').translate(None, b'ACGT')) == 0
+
+# match from a position up to the end of the first start / stop codon in its frame
+startCodonRe = re.compile(r'(?:...)*?(?:ATG|TTG|GTG)', re.S)
+stopCodonRe = re.compile(r'(?:...)*?(?:TAG|TAA|TGA)', re.S)
+
+
+standardCodons = codon_table()
+def transeq(seq, frames=[1,2,3,4,5,6], n_thread=1) :
+    # Six-frame translation. Codons with anything but ACGT become X. Sequences in a dict have the incomplete last
+    # codon of both strands padded at the end, sequences in a list have it padded at the start of the reverse
+    # strand.
+    isDict = isinstance(seq, dict)
+    def translate(item) :
+        n, s = item
+        codes = encode(s)
+        pad = np.full((3-len(s)%3)%3, INVALID, dtype=np.uint8)
+        rev = reverse_complement(codes)
+        forward, reverse = np.concatenate([codes, pad]), (np.concatenate([rev, pad]) if isDict else np.concatenate([pad, rev]))
+        return [n, translate_frames(forward, reverse, frames, standardCodons)]
+    trans_seq = map_sequences(translate, list(seq.items()) if isDict else list(seq), n_thread)
+    return dict(trans_seq) if isDict else trans_seq
 
 class dualBlast(object) :
     def readFasta(self, fasta) :
-        sequence = {}
-        with open(fasta) as fin :
-            for line in fin :
-                if line.startswith('>') :
-                    name = line[1:].strip().split()[0]
-                    sequence[name] = []
-                elif len(line) > 0 :
-                    sequence[name].extend(line.strip().split())
-        for s in sequence :
-            sequence[s] = (''.join(sequence[s])).upper()
-        return sequence
-    
+        return read_sequences(fasta)[0]
+
     def readFastq(self, fastq) :
-        sequence, qual = {}, {}
-        with open(fastq) as fin :
-            line = fin.readline()
-            if line.startswith('>') :
-                sequence = self.readFasta(fastq)
-                return sequence, None
-        with open(fastq) as fin :
-            for lineId, line in enumerate(fin) :
-                if lineId % 4 == 0 :
-                    name = line[1:].strip().split()[0]
-                    sequence[name] = []
-                    qual[name] = []
-                elif lineId % 4 == 1 :
-                    sequence[name].extend(line.strip().split())
-                elif lineId % 4 == 3 :
-                    qual[name].extend(line.strip().split())
-        for s in sequence :
-            sequence[s] = (''.join(sequence[s])).upper()
-            qual[s] = ''.join(qual[s])
-        return sequence, qual
+        return read_sequences(fastq)
     
     def getCIGAR(self, ref, qry) :
         if ref.find('-') < 0 and qry.find('-') < 0 :
@@ -139,14 +113,36 @@ class dualBlast(object) :
             blastab.append(part[:15])
         return blastab
     
-    def run_comparison(self, dirPath, qry, ref, min_iden, min_len, n_thread=6) :
+    def write_reference(self, dirPath, refSeq, n_thread) :
+        # blastn query shards (one per process, balanced by length) and the translated reference for usearch
+        refSeq2 = sorted(list(refSeq.items()), key=lambda s:-len(s[1]))
+        for id in range(n_thread) :
+            with open(os.path.join(dirPath, 'ref.{0}'.format(id)), 'w') as fout :
+                for n, s in refSeq2[id::n_thread] :
+                    fout.write('>{0}\n{1}\n'.format(n, s))
+        self.write_translation(dirPath, refSeq)
+
+    def write_translation(self, dirPath, refSeq) :
+        refAA = os.path.join(dirPath, 'refAA')
+        refAASeq = transeq(refSeq, frames=[1,2,3])
+        with open(refAA, 'w') as fout :
+            for n, ss in refAASeq.items() :
+                for id, s in enumerate(ss) :
+                    if len(s[:-1].split('X')) < 2 :
+                        fout.write('>{0}:{1}\n{2}\n'.format(n, id+1, s))
+        return refAA
+
+    def run_comparison(self, dirPath, qry, ref, min_iden, min_len, n_thread=6, refPath=None) :
         qryNA = os.path.join(dirPath, 'qryNA')
         qryAA = os.path.join(dirPath, 'qryAA')
-        refAA = os.path.join(dirPath, 'refAA')
         naMatch = os.path.join(dirPath, 'naMatch')
         aaMatch = os.path.join(dirPath, 'aaMatch')
         
         refSeq = self.readFasta(ref)
+        if refPath is None :
+            refPath = dirPath
+            self.write_reference(dirPath, refSeq, n_thread)
+        refAA = os.path.join(refPath, 'refAA')
         qrySeq, qual = self.readFastq(qry)
         with open(qryNA, 'w') as fout :
             for n,s in qrySeq.items() :
@@ -154,24 +150,14 @@ class dualBlast(object) :
         
         Popen('{makeblastdb} -dbtype nucl -in {qry}'.format(makeblastdb=makeblastdb, qry=qryNA).split(), stderr=PIPE, stdout=PIPE).communicate()
 
-        refs = [ [os.path.join(dirPath, 'ref.{0}'.format(id)), os.path.join(dirPath, 'ref.{0}.out'.format(id)), []] for id in range(n_thread)]
+        refs = [ [os.path.join(refPath, 'ref.{0}'.format(id)), os.path.join(dirPath, 'ref.{0}.out'.format(id)), []] for id in range(n_thread)]
         
-        refSeq2 = sorted(list(refSeq.items()), key=lambda s:-len(s[1]))
         for id, (r, o, p) in enumerate(refs) :
-            with open(r, 'w') as fout :
-                for n, s in refSeq2[id::n_thread] :
-                    fout.write('>{0}\n{1}\n'.format(n, s))
             blast_cmd = '{blastn} -db {qry} -query {ref} -out {out} -outfmt "6 qseqid sseqid pident length mismatch gapopen qstart qend sstart send evalue score qlen slen qseq sseq" -task blastn -evalue 1e-3 -dbsize 5000000 -reward 2 -penalty -2 -gapopen 6 -gapextend 2'.format(
                 blastn=blastn, qry=qryNA, ref=r, out=o)
             p.append(Popen(blast_cmd, stdout=PIPE, shell=True))
         
-        refAASeq = transeq(refSeq, frames=[1,2,3])
-        with open(refAA, 'w') as fout :
-            for n, ss in refAASeq.items() :
-                for id, s in enumerate(ss) :
-                    if len(s[:-1].split('X')) < 2 :
-                        fout.write('>{0}:{1}\n{2}\n'.format(n, id+1, s))
-        qryAASeq = transeq(qrySeq)
+        qryAASeq = transeq(qrySeq, n_thread=n_thread)
         with open(qryAA, 'w') as fout :
             for n, ss in qryAASeq.items() :
                 for id, s in enumerate(ss) :
@@ -191,6 +177,86 @@ class dualBlast(object) :
         self.fixEnd(blastab, 6, 9)
         return blastab
     
+    def stream_comparison(self, dirPath, qrySeq, refSeq, min_iden, min_len, n_thread=6, refPath=None) :
+        # Same hits as run_comparison, for sequences held in memory: the blast database is built from stdin, the
+        # reference shards are fed to blastn on stdin (or read from the reference cache) and the hits of both
+        # aligners are parsed from their stdout while they run. Only the two query databases go to dirPath.
+        with ThreadPoolExecutor(2*n_thread + 1) as executor :
+            naHits = executor.submit(self.stream_blastn, executor, dirPath, qrySeq, refSeq, min_iden, min_len, n_thread, refPath)
+            refAA = os.path.join(refPath, 'refAA') if refPath else self.write_translation(dirPath, refSeq)
+            aaHits = self.stream_ublast(dirPath, qrySeq, refSeq, refAA, min_iden, min_len, n_thread)
+            blastab = naHits.result()
+        blastab.extend(aaHits)
+        self.fixEnd(blastab, 6, 9)
+        return blastab
+
+    def adaptive_comparison(self, dirPath, qrySeq, refSeq, min_iden, min_len, n_thread=6, refPath=None, resolve_iden=0.95, timer=None) :
+        # Two tiers: blastn first, then the translated search only for the alleles of loci that blastn has not
+        # resolved. The query still goes into the protein database as a whole, since the unresolved loci can be
+        # anywhere in it.
+        with ThreadPoolExecutor(2*n_thread) as executor :
+            blastab = self.stream_blastn(executor, dirPath, qrySeq, refSeq, min_iden, min_len, n_thread, refPath)
+        self.fixEnd(blastab, 6, 9)
+        resolved = self.resolved_loci(blastab, resolve_iden)
+        refSeq = {n: s for n, s in refSeq.items() if n.rsplit('_', 1)[0] not in resolved}
+        if timer is not None :
+            timer('blastn ({0} loci resolved)'.format(len(resolved)))
+        if len(refSeq) > 0 :
+            aaHits = self.stream_ublast(dirPath, qrySeq, refSeq, self.write_translation(dirPath, refSeq), min_iden, min_len, n_thread)
+            self.fixEnd(aaHits, 6, 9)
+            blastab.extend(aaHits)
+        if timer is not None :
+            timer('usearch ({0} loci)'.format(len(set(n.rsplit('_', 1)[0] for n in refSeq))))
+        return blastab
+
+    def resolved_loci(self, blastab, min_iden, flank=30) :
+        # Loci with a hit that covers a whole reference allele at min_iden or more and leaves <flank> bases of
+        # the contig on both sides, so that the allele is neither truncated nor extended by the ORF check. Takes
+        # hits after fixEnd.
+        return set(p[0].rsplit('_', 1)[0] for p in blastab
+                   if p[2] >= min_iden and p[6] == 1 and p[7] == p[12] and flank < min(p[8], p[9]) and max(p[8], p[9]) <= p[13] - flank)
+
+    def stream_blastn(self, executor, dirPath, qrySeq, refSeq, min_iden, min_len, n_thread=6, refPath=None) :
+        # blastn hits of the reference shards against the query, one process per shard. Needs 2*n_thread free
+        # workers in executor when the shards are fed from refSeq.
+        qryNA = os.path.join(dirPath, 'qryNA')
+        Popen(makeblastdb.split() + ['-dbtype', 'nucl', '-in', '-', '-out', qryNA, '-title', 'qryNA'], stdin=PIPE, stdout=PIPE, stderr=PIPE, universal_newlines=True) \
+            .communicate(''.join('>{0}\n{1}\n'.format(n, s) for n, s in qrySeq.items()))
+
+        refSeq2 = sorted(list(refSeq.items()), key=lambda s:-len(s[1]))
+        def blast_shard(id) :
+            cmd = blastn.split() + ['-db', qryNA, '-query', os.path.join(refPath, 'ref.{0}'.format(id)) if refPath else '-',
+                   '-outfmt', '6 qseqid sseqid pident length mismatch gapopen qstart qend sstart send evalue score qlen slen qseq sseq',
+                   '-task', 'blastn', '-evalue', '1e-3', '-dbsize', '5000000', '-reward', '2', '-penalty', '-2', '-gapopen', '6', '-gapextend', '2']
+            p = Popen(cmd, stdin=DEVNULL if refPath else PIPE, stdout=PIPE, universal_newlines=True)
+            if not refPath :
+                executor.submit(write_input, p.stdin, ''.join('>{0}\n{1}\n'.format(n, s) for n, s in refSeq2[id::n_thread]))
+            hits = self.parseBlast(p.stdout, min_iden, min_len)
+            p.wait()
+            return hits
+        def write_input(stdin, text) :
+            with stdin :
+                stdin.write(text)
+
+        shards = [executor.submit(blast_shard, id) for id in range(n_thread)]
+        return [hit for shard in shards for hit in shard.result()]
+
+    def stream_ublast(self, dirPath, qrySeq, refSeq, refAA, min_iden, min_len, n_thread=6) :
+        # usearch hits of the translated reference alleles in refAA against the six frames of the query
+        qryAA = os.path.join(dirPath, 'qryAA')
+        qryAASeq = transeq(qrySeq, n_thread=n_thread)
+        with open(qryAA, 'w') as fout :
+            for n, ss in qryAASeq.items() :
+                for id, s in enumerate(ss) :
+                    fout.write('>{0}:{1}\n{2}\n'.format(n, id+1, s))
+        ublast_cmd = '{usearch} -threads {n_thread} -db {qryAA} -usearch_local {refAA} -evalue 1e-3  -userout /dev/stdout -ka_dbsize 5000000 -userfields query+target+id+alnlen+mism+opens+qlo+qhi+tlo+thi+evalue+raw+ql+tl+qrow+trow+qstrand'.format(
+            usearch=usearch, qryAA=qryAA, refAA=refAA, n_thread=n_thread)
+        pp = Popen(ublast_cmd.split(), stdout=PIPE, stderr=DEVNULL, universal_newlines=True)
+        # anything usearch itself prints to stdout is not a hit line
+        aaHits = self.parseUBlast((line for line in pp.stdout if line.count('\t') >= 16), qrySeq, refSeq, min_iden, min_len)
+        pp.wait()
+        return aaHits
+
     def fixEnd(self, blastab, se, ee) :
         for p in blastab :
             e1, e2 = p[6] - 1, p[12] - p[7]
@@ -211,21 +277,67 @@ class dualBlast(object) :
                     p[7], p[9], cigar[-1][0] = p[7]+d, p[9]-d, cigar[-1][0]+d
             p[14] = ''.join( '{0}{1}'.format(n, t) for n, t in cigar )
 
+def sweep_windows(groups, starts, limits) :
+    # For items sorted by (group, start), returns for every item the end of the run of following items of the
+    # same group whose start is <= its limit, i.e. where a scan that breaks on the first other group or larger
+    # start would stop. Starts and limits are non-negative coordinates.
+    if len(starts) == 0 :
+        return np.zeros(0, dtype=np.int64)
+    group = np.cumsum([0] + [g1 != g2 for g1, g2 in zip(groups[:-1], groups[1:])]).astype(np.int64) << 32
+    return np.searchsorted(group + np.array(starts, dtype=np.int64), group + np.floor(limits).astype(np.int64), side='right').tolist()
+
+
 class blastParser(object) :
+    def synteny_pairs(self, blasttab, min_iden, min_frag_prop, min_frag_len, max_dist, diag_diff, max_diff, block=1<<20) :
+        # Pairs of hits of the same allele and contig that can be merged into one synteny block, as [id, jd, iden,
+        # score] in the order of the former pairwise scan. The partners of a hit are the following hits that start
+        # within max_dist of its end; all pairs of a block of hits are tested at once on the coordinate columns.
+        if len(blasttab) < 2 :
+            return []
+        window = np.array(sweep_windows([(p[0], p[1]) for p in blasttab], [p[6] for p in blasttab], [p[7] + max_dist for p in blasttab]))
+        rs, re_, qs, qe, rl = np.array([p[6:10] + [p[12]] for p in blasttab], dtype=np.int64).T
+        iden_, score_ = np.array([p[2] for p in blasttab], dtype=float), np.array([p[11] for p in blasttab], dtype=float)
+        counts = np.maximum(window - np.arange(len(blasttab)) - 1, 0)
+        offsets = np.concatenate([[0], np.cumsum(counts)])
+        syntenies = []
+        start = 0
+        while start < len(blasttab) :
+            end = max(start + 1, int(np.searchsorted(offsets, offsets[start] + block, side='right')) - 1)
+            i = np.repeat(np.arange(start, end), counts[start:end])
+            j = i + 1 + np.arange(len(i)) - np.repeat(offsets[start:end] - offsets[start], counts[start:end])
+            start = end
+            keep = ~((qs[i] < 0) & (0 < qs[j]) | (qs[j] < qs[i] + 15) | (qe[j] < qe[i] + 15) | (re_[j] < re_[i]+15) | (rs[j] < rs[i]+15) | (qs[j] - qe[i] > max_dist))
+            i, j = i[keep], j[keep]
+            m, n = re_[j] - rs[i] + 1, qe[j] - qs[i] + 1
+            keep = ~((m < min_frag_len) | (m < min_frag_prop*rl[i]) | (np.maximum(m, n) - np.minimum(m, n) > max_diff) | (np.maximum(m, n) > diag_diff * np.minimum(m, n)))
+            i, j = i[keep], j[keep]
+            o_len = np.where(rs[j] > re_[i], 0, re_[i] - rs[j] + 1)
+            p1_len = re_[i] - rs[i] + 1 - o_len
+            p2_len = re_[j] - rs[j] + 1 - o_len
+            iden = (iden_[i]*p1_len + iden_[j]*p2_len + np.maximum(iden_[i], iden_[j])*o_len)/(p1_len+p2_len+o_len)
+            keep = ~(iden < min_iden)
+            i, j, iden, o_len, p1_len, p2_len = i[keep], j[keep], iden[keep], o_len[keep], p1_len[keep], p2_len[keep]
+            p1s, p2s = score_[i]/(re_[i]-rs[i]+1), score_[j]/(re_[j]-rs[j]+1)
+            dist = np.maximum(np.maximum(rs[j]-re_[i]-1, qs[j]-qe[i]-1), 0)
+            score = p1s*p1_len + p2s*p2_len + np.maximum(p1s, p2s)*o_len - dist
+            keep = score > 0
+            syntenies.extend([list(syn) for syn in zip(i[keep].tolist(), j[keep].tolist(), iden[keep].tolist(), score[keep].tolist())])
+        return syntenies
+
     def linear_merge(self, blasttab, min_iden, min_frag_prop, min_frag_len, max_dist=300, diag_diff=1.5, max_diff=200, **params) :
         for part in blasttab :
             if part[8] > part[9] :
                 part[8], part[9] = -part[8], -part[9]
 
         blasttab.sort(key=itemgetter(0,1,6,8,-11))
-        nB = len(blasttab)
+        # the hits of one allele and contig are sorted by their start in the allele, so the hits that can be
+        # duplicates of p1 are the ones up to the first start more than 4 bases after it
+        window = sweep_windows([(p[0], p[1]) for p in blasttab], [p[6] for p in blasttab], [p[6] + 4 for p in blasttab])
         for id, p1 in enumerate(blasttab) :
             if p1[0] == '' : continue
-            for jd in xrange(id+1, nB) :
+            for jd in xrange(id+1, window[id]) :
                 p2 = blasttab[jd]
                 if p2[0] == '' : continue
-                if (p1[0], p1[1]) != (p2[0], p2[1]) or p2[6] - p1[6] > 4 :
-                    break
                 d = abs(p1[6]-p2[6]) + abs(p1[7]-p2[7]) + abs(p1[8]-p2[8]) + abs(p1[9]-p2[9])
                 if d <= 5 :
                     if p1[2] >= p2[2] :
@@ -235,32 +347,7 @@ class blastParser(object) :
                         break
         blasttab = [p for p in blasttab if p[0] != '']
         
-        nB = len(blasttab)
-        syntenies = []
-        for id, p1 in enumerate(blasttab) :
-            for jd in xrange(id+1, nB)  :
-                p2 = blasttab[jd]
-
-                if p1[0] != p2[0] or p1[1] != p2[1] or p2[6] - p1[7] > max_dist :
-                    break
-                elif p1[8] < 0 < p2[8] or p2[8] < p1[8] + 15 or p2[9] < p1[9] + 15 or p2[7]<p1[7]+15 or p2[6] < p1[6]+15 or p2[8] - p1[9] > max_dist :
-                    continue
-                m, n = p2[7] - p1[6] + 1, p2[9] - p1[8] + 1
-                if m < min_frag_len or m < min_frag_prop*p1[12] or max(m, n) - min(m, n) > max_diff or max(m,n) > diag_diff * min(m, n) :
-                    continue
-                o_len = 0 if p2[6] > p1[7] else p1[7] - p2[6] + 1
-                p1_len = p1[7] - p1[6] + 1 - o_len
-                p2_len = p2[7] - p2[6] + 1 - o_len
-                
-                iden = (p1[2]*p1_len + p2[2]*p2_len +max(p1[2], p2[2])*o_len)/(p1_len+p2_len+o_len)
-                if iden < min_iden :
-                    continue
-
-                p1s, p2s = p1[11]/(p1[7]-p1[6]+1), p2[11]/(p2[7]-p2[6]+1)
-                dist = max(p2[6]-p1[7]-1, p2[8]-p1[9]-1, 0)
-                score = p1s*p1_len +p2s*p2_len+max(p1s, p2s)*o_len - dist
-                if score > 0 :
-                    syntenies.append([id, jd, iden, score])
+        syntenies = self.synteny_pairs(blasttab, min_iden, min_frag_prop, min_frag_len, max_dist, diag_diff, max_diff)
         syn_score = {}
         for id , syn in enumerate(syntenies) :
             if syn[0] not in syn_score and syn[1] not in syn_score :
@@ -388,15 +475,15 @@ class blastParser(object) :
         regions = [reg for region in alleles.values() for reg in region]
         # sort with contig name and start points
         regions.sort(key=itemgetter(2,3))
+        # the regions that can overlap regi are the following ones on its contig that start before its end
+        window = sweep_windows([reg[2] for reg in regions], [reg[3] for reg in regions], [reg[4] for reg in regions])
 
         for id, regi in enumerate(regions) :
             if regi[0] == '' : continue
             todel, deleted = [], 0
-            for jd in xrange(id+1, len(regions)) :
+            for jd in xrange(id+1, window[id]) :
                 regj = regions[jd]
                 if regj[0] == '' or regi[0] == regj[0]: continue
-                if regi[2] != regj[2] or regj[3] > regi[4] :
-                    break
                 overlap = min(regi[4], regj[4]) - regj[3] + 1
                 if (regi[-1] != '' and float(overlap) >= parameters['overlap_prop'] * (regi[4]-regi[3]+1)) or \
                    (regj[-1] != '' and float(overlap) >= parameters['overlap_prop'] * (regj[4]-regj[3]+1)) :
@@ -420,7 +507,7 @@ class blastParser(object) :
         if direction == '+' :
             seq = fasta[(start-1):end].upper()
         else :
-            seq = ''.join([self.complement.get(x.upper(), 'N') for x in reversed(fasta[(start-1):end])])
+            seq = rev_comp(fasta[(start-1):end])
         return seq
     def get_qual(self, qual, header, start, end, direction='+', force=False) :
         if qual == None:
@@ -436,23 +523,20 @@ class blastParser(object) :
         coordinates, edges = rec['coordinates'], rec['flanking'][:]
         seq = self.get_seq(seq, *coordinates)
         #if (len(seq) - sum(edges)) % 3 == 0 :
-        startCodon, stopCodon = 0, 0
-        for s in xrange(edges[0]%3, len(seq), 3) :
-            c = seq[s:s+3]
-            if c in {'ATG', 'TTG', 'GTG'} :
-                startCodon, edges[0] = 1, 0
-                e0 = s+3
-                new_s = coordinates[1] + s if coordinates[3] == '+' else coordinates[2] - s
-                break
-        if not startCodon :
+        # the first start codon in the frame of the allele start, then the first stop codon after it
+        m = startCodonRe.match(seq, edges[0]%3)
+        if m is None :
             return 6
-        for e in xrange(e0, len(seq), 3) :
-            c = seq[e:e+3]
-            if c in {'TAG', 'TAA', 'TGA'} :
-                stopCodon, edges[1] = 1, 0
-                new_e = coordinates[1] + e+2 if coordinates[3] == '+' else coordinates[2] - e-2
-                break
-        if startCodon and stopCodon and abs(e-s) + 1 >= 0.6 * (abs(coordinates[2]-coordinates[1])+1 - sum(rec['flanking'])) :
+        s = m.end() - 3
+        edges[0] = 0
+        new_s = coordinates[1] + s if coordinates[3] == '+' else coordinates[2] - s
+        m = stopCodonRe.match(seq, s+3)
+        if m is None :
+            return 6
+        e = m.end() - 3
+        edges[1] = 0
+        new_e = coordinates[1] + e+2 if coordinates[3] == '+' else coordinates[2] - e-2
+        if abs(e-s) + 1 >= 0.6 * (abs(coordinates[2]-coordinates[1])+1 - sum(rec['flanking'])) :
             c2 = (new_s, new_e) if coordinates[3] == '+' else (new_e, new_s)
             if c2[0] != coordinates[1] or c2[1] != coordinates[2] :
                 rec['CIGAR'] = rec['CIGAR'].rsplit(':', 1)[0] + ':EXEMPT'
@@ -473,7 +557,7 @@ class blastParser(object) :
             region['seq'] = self.get_seq(qrySeq, *region['coordinates'])
             region['id'] = ''
             region['value_md5'] = get_md5(region['seq'])
-            if min(region['flanking']) >= 0 and len(re.findall(r'[^ACGT]', region['seq'])) == 0 :  ## add proportional check
+            if min(region['flanking']) >= 0 and is_acgt(region['seq']) :  ## add proportional check
                 region['accepted'] = region['accepted'] | 1
             else :
                 region['status'] += '{Fragmented}'
@@ -551,32 +635,236 @@ class blastParser(object) :
         return sorted(regions+inter_blocks, key=lambda r:r['coordinates'])
             
 
+class stageTimer(object) :
+    # Wall time of the stages of one call, each stage ending when the timer is called with its name
+    def __init__(self) :
+        self.last, self.stages = time.time(), []
+
+    def __call__(self, stage) :
+        now = time.time()
+        self.stages.append([stage, now - self.last])
+        self.last = now
+
+    def report(self, unique_key) :
+        logger('{0}: {1}, total {2:.2f}s'.format(unique_key, ', '.join('{0} {1:.2f}s'.format(*stage) for stage in self.stages), sum(t for _, t in self.stages)))
+
+
+class referenceCache(object) :
+    # Reference files written by dualBlast.write_reference, kept in a directory named after the MD5 of the
+    # reference alleles and the number of shards, so a changed reference never uses stale files. An entry is
+    # built in a temporary directory and renamed into place, so concurrent workers never see a partial one.
+    def __init__(self, root=None) :
+        self.root = root if root else os.path.join(os.path.expanduser('~'), '.cache', 'pathinder', 'references')
+
+    def prepare(self, refAllele, n_thread) :
+        path = os.path.join(self.root, '{0}_{1}'.format(hashlib.md5(as_bytes(refAllele)).hexdigest(), n_thread))
+        if os.path.isdir(path) :
+            return path
+        os.makedirs(self.root, exist_ok=True)
+        buildPath = tempfile.mkdtemp(prefix='.build_', dir=self.root)
+        try :
+            dualBlast().write_reference(buildPath, parse_sequences(refAllele)[0], n_thread)
+            os.rename(buildPath, path)
+        except OSError :
+            # another worker has renamed its entry into place first
+            if not os.path.isdir(path) :
+                raise
+        finally :
+            shutil.rmtree(buildPath, ignore_errors=True)
+        return path
+
+
+class resultCache(object) :
+    # Output of nomenclature, gzipped in a file named after the MD5 of the genome, the reference alleles and the
+    # parameters that change the output. Hits touch their entry and the least recently used entries are removed
+    # once the entries take more than max_size bytes. Raise version whenever the output format or the calling
+    # code changes, so results of an older version are no longer returned.
+    version = 1
+    ignored = ['genome', 'refAllele', 'output', 'tmp_dir', 'n_thread', 'timing', 'streaming', 'reference_cache', 'no_reference_cache', 'cache_dir', 'cache', 'cache_size']
+
+    def __init__(self, root=None, max_size=512<<20) :
+        self.root = root if root else os.path.join(os.path.expanduser('~'), '.cache', 'pathinder', 'results')
+        self.max_size = max_size
+
+    def key(self, genome, refAllele, parameters) :
+        m = hashlib.md5('resultCache.v{0}\0'.format(self.version).encode())
+        for value in (genome, refAllele) :
+            m.update(as_bytes(value))
+            m.update(b'\0')
+        params = {k: v for k, v in parameters.items() if k not in self.ignored}
+        if params.get('database', None) is not None :
+            # the allele IDs come from the lookup table, which changes under the same name
+            stat = os.stat(params['database'])
+            params['database'] = [os.path.abspath(params['database']), stat.st_size, stat.st_mtime_ns]
+        m.update(repr(sorted(params.items())).encode())
+        return m.hexdigest()
+
+    def get(self, key) :
+        path = os.path.join(self.root, key + '.gz')
+        try :
+            with gzip.open(path, 'rt') as fin :
+                alleles = fin.read()
+            os.utime(path)
+            return alleles
+        except FileNotFoundError :
+            return None
+        except (OSError, EOFError, zlib.error, UnicodeDecodeError) :
+            # a corrupt or truncated entry is a miss and is replaced by the result of this call
+            try :
+                os.unlink(path)
+            except OSError :
+                pass
+            return None
+
+    def put(self, key, alleles) :
+        os.makedirs(self.root, exist_ok=True)
+        fd, tmpPath = tempfile.mkstemp(prefix='.put_', dir=self.root)
+        with gzip.open(os.fdopen(fd, 'wb'), 'wt', compresslevel=1) as fout :
+            fout.write(alleles)
+        os.replace(tmpPath, os.path.join(self.root, key + '.gz'))
+        self.evict()
+
+    def evict(self) :
+        entries = []
+        for fname in os.listdir(self.root) :
+            if fname.endswith('.gz') and not fname.startswith('.') :
+                try :
+                    stat = os.stat(os.path.join(self.root, fname))
+                    entries.append([stat.st_mtime, stat.st_size, fname])
+                except OSError :
+                    pass
+        size = sum(e[1] for e in entries)
+        for mtime, fsize, fname in sorted(entries) :
+            if size <= self.max_size :
+                break
+            try :
+                os.unlink(os.path.join(self.root, fname))
+            except OSError :
+                pass
+            size -= fsize
+
+
+class alleleDatabase(object) :
+    # The --database lookup table (value_md5,locus,id per line) indexed in an SQLite file next to it. The index
+    # is rebuilt when the table changes and each table is opened once per process, so a genome costs one bulk
+    # query instead of reading the whole table.
+    opened = {}
+
+    @classmethod
+    def open(cls, database) :
+        path = os.path.abspath(database)
+        if path not in cls.opened :
+            cls.opened[path] = cls(path)
+        return cls.opened[path].refresh()
+
+    def __init__(self, database) :
+        self.database, self.index = database, database + '.sqlite'
+        self.conn, self.version = None, None
+
+    def refresh(self) :
+        stat = os.stat(self.database)
+        version = '{0}:{1}'.format(stat.st_size, stat.st_mtime_ns)
+        if version == self.version :
+            return self
+        if self.conn is not None :
+            self.conn.close()
+        self.conn = sqlite3.connect(self.index, check_same_thread=False) if os.path.exists(self.index) else None
+        try :
+            current = self.conn is not None and self.conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()[0] == version
+        except (sqlite3.Error, TypeError) :
+            current = False
+        if not current :
+            if self.conn is not None :
+                self.conn.close()
+            self.build(version)
+            self.conn = sqlite3.connect(self.index, check_same_thread=False)
+        self.version = version
+        return self
+
+    def build(self, version) :
+        # written to a temporary file and renamed into place, so workers never open a partial index
+        fd, tmpPath = tempfile.mkstemp(prefix='.build_', suffix='.sqlite', dir=os.path.dirname(self.index))
+        os.close(fd)
+        try :
+            conn = sqlite3.connect(tmpPath)
+            with conn :
+                conn.execute('CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)')
+                conn.execute('CREATE TABLE alleles (md5 TEXT, locus TEXT, id TEXT, PRIMARY KEY (md5, locus)) WITHOUT ROWID')
+                with open(self.database) as fin :
+                    # the first id of an allele wins, as it did with the pandas lookup
+                    conn.executemany('INSERT OR IGNORE INTO alleles VALUES (?, ?, ?)', (row[:3] for row in csv.reader(fin) if len(row) >= 3))
+                conn.execute("INSERT INTO meta VALUES ('version', ?)", (version,))
+            conn.close()
+            os.replace(tmpPath, self.index)
+        finally :
+            if os.path.exists(tmpPath) :
+                os.unlink(tmpPath)
+
+    def lookup(self, alleles) :
+        # {(value_md5, locus): id} for the known ones of a list of (value_md5, locus)
+        wanted = set(alleles)
+        md5s = sorted(set(md5 for md5, locus in wanted))
+        ids = {}
+        for i in xrange(0, len(md5s), 500) :
+            chunk = md5s[i:i+500]
+            for md5, locus, id in self.conn.execute('SELECT md5, locus, id FROM alleles WHERE md5 IN ({0})'.format(','.join('?'*len(chunk))), chunk) :
+                if (md5, locus) in wanted :
+                    ids[(md5, locus)] = id
+        return ids
+
+
+class exactMatcher(object) :
+    # Every k-mer of a reference allele that starts at one of its first <step> positions is looked up in a
+    # table of the k-mers that start at every <step>-th position of the contigs, so any full-length occurrence
+    # is seeded by exactly one of them and then verified by comparing the whole sequence.
+    def __init__(self, kmer=24, step=16) :
+        self.kmer, self.step = kmer, step
+
+    def seed_index(self, qrySeq) :
+        index = {}
+        for contig, seq in qrySeq.items() :
+            rc = rev_comp(seq)
+            for strand, s in (('+', seq), ('-', rc)) :
+                for p in xrange(0, len(s) - self.kmer + 1, self.step) :
+                    index.setdefault(s[p:p+self.kmer], []).append((contig, strand, p))
+        return index
+
+    def find(self, refSeq, qrySeq) :
+        index = self.seed_index(qrySeq)
+        strands = {contig: {'+': seq} for contig, seq in qrySeq.items()}
+        hits = {}
+        for allele_full, allele_seq in refSeq.items() :
+            if len(allele_seq) < self.kmer + self.step - 1 or not is_acgt(allele_seq) :
+                continue
+            for o in xrange(self.step) :
+                for contig, strand, p in index.get(allele_seq[o:o+self.kmer], []) :
+                    if strand not in strands[contig] :
+                        strands[contig][strand] = rev_comp(qrySeq[contig])
+                    if p >= o and strands[contig][strand][p-o:p-o+len(allele_seq)] == allele_seq :
+                        l = len(qrySeq[contig])
+                        s, e = (p-o+1, p-o+len(allele_seq)) if strand == '+' else (l-p+o-len(allele_seq)+1, l-p+o)
+                        hits.setdefault(allele_full.rsplit('_', 1)[0], []).append([allele_full, contig, s, e, strand])
+        return hits
+
+    def resolve(self, refSeq, qrySeq) :
+        # A locus is resolved if all exact occurrences of its alleles overlap the longest one, so that it has
+        # no second exact copy and is not fragmented; divergent copies are left to the alignment of its allele. The region is given as parse_blast reports a full-length hit
+        # with 100% identity and goes through the same inter-loci, intergenic and allele checks.
+        loci = {}
+        for locus, hits in self.find(refSeq, qrySeq).items() :
+            hits.sort(key=lambda h:(h[2]-h[3], h[0]))
+            allele_full, contig, s, e, strand = hits[0]
+            if all(h[1] == contig and h[2] <= e and h[3] >= s for h in hits[1:]) :
+                loci[locus] = [[locus, 1.0, contig, s, e, strand, 0, 0, '', '{0}:{1}M'.format(allele_full, e-s+1)]]
+        return loci
+
+
 class seqOperation(object) :
     def readSequence(self, fname) :
-        seq = {}
-        with open(fname) as fin :
-            header = fin.read(1)
-            fin.seek(0, 0)
-            if header == '@' :
-                for id, line in enumerate(fin) :
-                    if id % 4 == 0 :
-                        name = line[1:].strip().split()[0]
-                        seq[name]= [None, None]
-                    elif id % 4 == 1 :
-                        seq[name][0] = line.strip()
-                    elif id % 4 == 3 :
-                        seq[name][1] = [ord(q)-33 for q in line.strip()]
-            else :
-                for line in fin :
-                    if line.startswith('>') :
-                        name = line[1:].strip().split()[0]
-                        seq[name] = [[], None]
-                    else :
-                        seq[name][0].extend( line.strip().split() )
-                for n, s in seq.iteritems() :
-                    s[0] = ''.join(s[0])
-                    s[1] = [0 for ss in s[0]]
-        return seq
+        sequence, qual = read_sequences(fname)
+        if qual is None :
+            return {n: [s, [0]*len(s)] for n, s in sequence.items()}
+        return {n: [s, (np.frombuffer(qual[n].encode('latin-1'), dtype=np.uint8).astype(int) - 33).tolist()] for n, s in sequence.items()}
 
     def write_refsets(self, reference) :
         ref_aa = '{0}.refset.aa'.format(parameters['unique_key'])
@@ -600,64 +888,132 @@ class seqOperation(object) :
                 fout.write('>{0}\n{1}\n'.format(n, s))
         return qryseq, fna, faa
 
-def nomenclature(genome, refAllele, parameters) :
-    # write query
-    dirPath = tempfile.mkdtemp(prefix='NS_', dir='.')
+def call_alleles(genome, refAllele, parameters) :
+    # the alleles of every locus found in the genome, as dicts of seq, value_md5, id, accepted, coordinates, ...
+    dirPath = tempfile.mkdtemp(prefix='NS_', dir=parameters.get('tmp_dir', '.'))
+    timer = stageTimer()
     try :
-        qry = os.path.join(dirPath, 'query')
-        ref = os.path.join(dirPath, 'reference')
-        with open(qry, 'wt') as fout:
-            fout.write(genome)
-        with open(ref, 'wt') as fout:
-            fout.write(refAllele)
-        blasttab = dualBlast().run_comparison(dirPath, qry, ref, parameters['min_iden']-0.1, parameters['min_frag_len']-10)
+        # the genome and reference are parsed from memory, files are only written for the aligners that need them
+        qrySeq, qryQual = parse_sequences(genome)
+        refSeq = parse_sequences(refAllele)[0]
+        timer('parse')
+        exact = {}
+        if parameters.get('exact_prepass', False) :
+            # loci with an exact copy of a reference allele skip the alignments
+            exact = exactMatcher().resolve(refSeq, qrySeq)
+            # the allele found in a resolved locus is still aligned on its own, to find the divergent paralogs
+            # that the exact search misses and that flag the locus as duplicated
+            matched = {regions[0][9].rsplit(':', 1)[0] for regions in exact.values()}
+            refSeq = {n: s for n, s in refSeq.items() if n in matched or n.rsplit('_', 1)[0] not in exact}
+            timer('exact pre-pass ({0} loci resolved)'.format(len(exact)))
+        refPath = None
+        if len(exact) == 0 and not parameters.get('no_reference_cache', False) :
+            # the unfiltered reference is the same for every genome, the few loci left by the pre-pass are not
+            refPath = referenceCache(parameters.get('reference_cache')).prepare(refAllele, parameters.get('n_thread', 6))
+            timer('reference cache')
+        if len(refSeq) == 0 :
+            blasttab = []
+        elif parameters.get('adaptive', False) :
+            blasttab = dualBlast().adaptive_comparison(dirPath, qrySeq, refSeq, parameters['min_iden']-0.1, parameters['min_frag_len']-10, parameters.get('n_thread', 6), refPath, parameters.get('adaptive_iden', 0.95), timer)
+        elif parameters.get('streaming', False) :
+            blasttab = dualBlast().stream_comparison(dirPath, qrySeq, refSeq, parameters['min_iden']-0.1, parameters['min_frag_len']-10, parameters.get('n_thread', 6), refPath)
+        else :
+            qry = os.path.join(dirPath, 'query')
+            ref = os.path.join(dirPath, 'reference')
+            with open(qry, 'wb') as fout:
+                fout.write(as_bytes(genome))
+            with open(ref, 'wt') as fout:
+                for n, s in refSeq.items() :
+                    fout.write('>{0}\n{1}\n'.format(n, s))
+            blasttab = dualBlast().run_comparison(dirPath, qry, ref, parameters['min_iden']-0.1, parameters['min_frag_len']-10, parameters.get('n_thread', 6), refPath)
+        if not parameters.get('adaptive', False) :
+            timer('alignment')
     
         # filter
         blasttab_parser = blastParser()
         blasttab = blasttab_parser.linear_merge(blasttab, **parameters)
         loci = blasttab_parser.parse_blast(blasttab, parameters)
+        # an exact copy stands unless the alignments found another copy of its locus
+        loci.update({locus: regions for locus, regions in exact.items() if len(loci.get(locus, [])) <= 1})
         regions = blasttab_parser.inter_loci_overlap(loci, parameters)
         regions = blasttab_parser.intergenic(regions, parameters.get('intergenic',[30,600]))
+        timer('hit filter')
     
         # submission
-        qrySeq, qryQual = dualBlast().readFastq(qry)
         alleles = blasttab_parser.form_alleles(regions, qrySeq, qryQual, parameters['unique_key'], not parameters['query_only'], parameters)
         for field, allele in alleles.items() :
             allele['id'] = allele['value_md5'] if allele['accepted'] < 8 else '-'+allele['value_md5']
         if parameters.get('database', None) is not None :
-            import pandas as pd
-            database = pd.read_csv(parameters['database'], header=None, index_col=0)
+            ids = alleleDatabase.open(parameters['database']).lookup([(allele['value_md5'], field) for field, allele in alleles.items()])
             for field, allele in alleles.items() :
-                try :
-                    allele_info = database.loc[allele['value_md5']].values
-                    if len(allele_info.shape) > 1 :
-                        allele['id'] = str(allele_info[allele_info.T[0] == field][0, 1])
-                    elif len(allele_info.shape) == 1 and allele_info[0] == field :
-                        allele['id'] = str(allele_info[1])
-                except :
-                    pass
+                if (allele['value_md5'], field) in ids :
+                    allele['id'] = ids[(allele['value_md5'], field)]
+        timer('alleles')
     finally:
         shutil.rmtree(dirPath)
-    allele_seq = '\n'.join([ '>{0} value_md5={2} id={7} CIGAR={6} accepted={3} reference={4} identity={5} coordinates={8}\n{1}'.format(locus, allele['seq'], allele['value_md5'], allele['accepted'], allele['reference'], allele['identity'], allele['CIGAR'], allele['id'], '{0}:{1}..{2}:{3}'.format(*allele['coordinates']), allele['status'], allele['identity']) for locus, allele in sorted(alleles.items()) ])
-    return allele_seq
+    if parameters.get('timing', False) :
+        timer.report(parameters['unique_key'])
+    return alleles
+
+def format_alleles(alleles) :
+    return '\n'.join([ '>{0} value_md5={2} id={7} CIGAR={6} accepted={3} reference={4} identity={5} coordinates={8}\n{1}'.format(locus, allele['seq'], allele['value_md5'], allele['accepted'], allele['reference'], allele['identity'], allele['CIGAR'], allele['id'], '{0}:{1}..{2}:{3}'.format(*allele['coordinates']), allele['status'], allele['identity']) for locus, allele in sorted(alleles.items()) ])
+
+def nomenclature(genome, refAllele, parameters) :
+    return format_alleles(call_alleles(genome, refAllele, parameters))
+
+
+def allele_profile(alleles) :
+    # locus -> (MD5 of the normalised allele sequence, accepted flags), in the locus order of format_alleles, as
+    # read_profile gives for the FASTA text of the alleles
+    return {locus: (allele_hash(allele['seq']), int(allele['accepted'])) for locus, allele in sorted(alleles.items())}
 
 
 parameters = {}
+def call_cached(parameters) :
+    # (FASTA text, alleles) of a call; alleles is None if the text comes from the result cache and the text is
+    # None if the cache is not used
+    genome, refAllele = read_bytes(parameters['genome']), read_bytes(parameters['refAllele'])
+    if not parameters['cache'] :
+        return None, call_alleles(genome, refAllele, parameters)
+    cache = resultCache(parameters['cache_dir'], int(parameters['cache_size'] * (1<<20)))
+    key = cache.key(genome, refAllele, parameters)
+    text = cache.get(key)
+    if text is not None :
+        if parameters['timing'] :
+            logger('{0}: cached result {1}'.format(parameters['unique_key'], key))
+        return text, None
+    alleles = call_alleles(genome, refAllele, parameters)
+    text = format_alleles(alleles)
+    cache.put(key, text)
+    return text, alleles
+
+def write_alleles(alleles, output) :
+    if output.upper() == 'STDOUT' :
+        fout =sys.stdout
+    elif output.upper().endswith('GZ') :
+        fout = gzip.open(output, 'wt')
+    else :
+        fout = open(output, 'wt')
+
+    fout.write(alleles + '\n')
+    fout.close()
+
 def MLSType(args) :
     parameters = getParams(args)
-    alleles = nomenclature(gzip.open(parameters['genome'], 'rt').read() if parameters['genome'].upper().endswith('GZ') else open(parameters['genome']).read(), open(parameters['refAllele']).read(), parameters)
+    text, alleles = call_cached(parameters)
+    alleles = format_alleles(alleles) if text is None else text
     if parameters['output'] is not None :
-        if parameters['output'].upper() == 'STDOUT' :
-            fout =sys.stdout
-        elif parameters['output'].upper().endswith('GZ') :
-            fout = gzip.open(parameters['output'], 'wt')
-        else :
-            fout = open(parameters['output'], 'wt')
-
-        fout.write(alleles + '\n')
-        fout.close()
+        write_alleles(alleles, parameters['output'])
     return alleles
 
+def MLSProfile(args) :
+    # as MLSType, but returns the profile of the alleles (see allele_profile) for hashing in process
+    parameters = getParams(args)
+    text, alleles = call_cached(parameters)
+    if parameters['output'] is not None :
+        write_alleles(format_alleles(alleles) if text is None else text, parameters['output'])
+    return read_profile(text) if alleles is None else allele_profile(alleles)
+
 
 def getParams(args) :
     import argparse
@@ -672,6 +1028,18 @@ def getParams(args) :
     parser.add_argument('-m', '--min_iden',   help='[DEFAULT: 0.65 ] Minimum identities between refAllele and genome. ', type=float, default=0.65)
     parser.add_argument('-p', '--min_frag_prop', help='[DEFAULT: 0.6 ] Minimum covereage of a fragment. ', type=float, default=0.6)
     parser.add_argument('-l', '--min_frag_len',  help='[DEFAULT: 50 ] Minimum length of a fragment. ', type=float, default=50)
+    parser.add_argument('-t', '--n_thread',  help='[DEFAULT: 6 ] Number of blastn processes and usearch threads. ', type=int, default=6)
+    parser.add_argument('--exact_prepass', help='[DEFAULT: False] Report loci with a unique exact copy of a reference allele without aligning all of their alleles. Only the allele that was found is aligned, to flag divergent paralogs as duplicated. ', action='store_true', default=False)
+    parser.add_argument('--reference_cache',  help='[DEFAULT: ~/.cache/pathinder/references ] Directory for the preprocessed reference alleles. ', default=None)
+    parser.add_argument('--no_reference_cache', help='[DEFAULT: False] Preprocess the reference alleles for every genome. ', action='store_true', default=False)
+    parser.add_argument('--streaming', help='[DEFAULT: False] Pipe the sequences to the aligners and parse their hits while they run, instead of exchanging temporary files. ', action='store_true', default=False)
+    parser.add_argument('--adaptive', help='[DEFAULT: False] Run blastn first and the translated usearch search only for the loci that blastn has not resolved. ', action='store_true', default=False)
+    parser.add_argument('--adaptive_iden', help='[DEFAULT: 0.95 ] Minimum identity of a full-length blastn hit that resolves its locus in --adaptive mode. ', type=float, default=0.95)
+    parser.add_argument('--timing', help='[DEFAULT: False] Report the time spent in each stage on stderr. ', action='store_true', default=False)
+    parser.add_argument('--cache_dir',  help='[DEFAULT: ~/.cache/pathinder/results ] Directory for the cached results of earlier calls. ', default=None)
+    parser.add_argument('--cache_size',  help='[DEFAULT: 512 ] Size limit of the result cache in MB, the least recently used results are removed first. ', type=float, default=512)
+    parser.add_argument('--cache', help='[DEFAULT: False] Cache the result in --cache_dir, and return the cached result of an identical call without calling the alleles again. ', action='store_true', default=False)
+    parser.add_argument('--tmp_dir',  help='[DEFAULT: . ] Directory for the temporary files. ', default='.')
     
     parser.add_argument('-x', '--intergenic',  help='[DEFAULT: -1,-1 ] Call alleles in intergenic region if the distance between two closely located loci fall within the range defined by the two numbers. Suggest to use 50,500. This is diabled by default with minus numbers.', default='-1,-1')
 
@@ -0,0 +1,240 @@
+import sys
+import json
+import time
+import threading
+import click
+import numpy as np
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Optional
+
+try:
+    from store import ProfileStore, default_store_path
+    from profiles import jacquard_similarity, match, jacquard_similarity_many, match_many, stack_profiles
+    from distance import one_vs_all
+    from profile_db import ProfileDatabase
+    from codec import profile_keys
+    from query import SequenceDatabase, SequenceEntry, loculus_lapis, default_server_port, data_source, sync_store, \
+        read_store, load_index, find, find_many
+except ImportError:
+    from query.store import ProfileStore, default_store_path
+    from query.profiles import jacquard_similarity, match, jacquard_similarity_many, match_many, stack_profiles
+    from query.distance import one_vs_all
+    from query.profile_db import ProfileDatabase
+    from query.codec import profile_keys
+    from query.query import SequenceDatabase, SequenceEntry, loculus_lapis, default_server_port, data_source, \
+        sync_store, read_store, load_index, find, find_many
+
+
+class Snapshot:
+    """
+    Profiles, index and query encoder of one generation of the store or profile database, with the number of
+    loci of every profile. A snapshot is never changed, a refresh builds a new one and swaps it in, so requests
+    in flight keep a consistent view.
+    """
+    __slots__ = ('generation', 'database', 'index', 'encode', 'lengths', 'loaded_at')
+
+    def __init__(self, generation: int, database: SequenceDatabase, index, encode: Callable[[list[str]], np.ndarray],
+                 lengths: np.ndarray):
+        self.generation = generation
+        self.database = database
+        self.index = index
+        self.encode = encode
+        self.lengths = lengths
+        self.loaded_at = time.time()
+
+
+class QueryService:
+    """
+    Keeps the profiles of a local store or a profile database in memory and answers queries from them. The
+    store is synced with LAPIS and reloaded in the background every `refresh_interval` seconds when it changed.
+    """
+
+    def __init__(self, store_path: str = default_store_path, lapis_url: str = loculus_lapis,
+                 database_path: str = None, refresh_interval: float = 300, sync: bool = True):
+        self.store_path = store_path
+        self.lapis_url = lapis_url
+        self.database_path = database_path
+        self.refresh_interval = refresh_interval
+        self.sync = sync
+        self.source = data_source(store_path, lapis_url, database_path)
+        self.snapshot: Optional[Snapshot] = None
+        self._refreshing = threading.Lock()
+        self._stopped = threading.Event()
+
+    def refresh(self) -> bool:
+        """
+        Syncs the store and loads a new snapshot if the profiles changed. Returns whether a new one was loaded.
+        """
+        with self._refreshing:
+            current = self.snapshot.generation if self.snapshot is not None else None
+            if self.database_path is not None:
+                profile_database = ProfileDatabase(self.database_path)
+                if profile_database.generation() == current:
+                    return False
+                database = SequenceDatabase.from_profile_database(profile_database)
+                index = load_index(self.database_path + '.index.npz', profile_database.generation(), database.profiles)
+                self.snapshot = Snapshot(profile_database.generation(), database, index, profile_database.encode_query,
+                                         np.full(len(database), database.profiles.shape[1]))
+                return True
+            # The SQLite connection belongs to the thread that refreshes, the snapshot only keeps the encoder
+            with ProfileStore(self.store_path) as store:
+                if self.sync:
+                    sync_store(store, self.lapis_url)
+                if store.generation() == current:
+                    return False
+                database = read_store(store)
+                index = load_index(store.path + '.index.npz', store.generation(), database.profiles)
+                encoder = store.allele_encoder()
+                self.snapshot = Snapshot(store.generation(), database, index,
+                                         lambda hashes: encoder.encode(hashes, extend=False)[0], store.profile_lengths())
+            return True
+
+    def _refresh_loop(self) -> None:
+        while not self._stopped.wait(self.refresh_interval):
+            try:
+                if self.refresh():
+                    print('Loaded generation {} with {} sequences'.format(
+                        self.snapshot.generation, len(self.snapshot.database)), file=sys.stderr)
+            except Exception as error:
+                # Keep answering from the last snapshot, e.g. while LAPIS cannot be reached
+                print('Refresh failed: {}'.format(error), file=sys.stderr)
+
+    def start(self) -> None:
+        """
+        Loads the first snapshot and starts the background refreshes.
+        """
+        self.refresh()
+        if self.refresh_interval > 0:
+            threading.Thread(target=self._refresh_loop, daemon=True).start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+
+    def status(self) -> dict:
+        snapshot = self.snapshot
+        return {'source': self.source, 'generation': snapshot.generation, 'sequences': len(snapshot.database),
+                'loaded_at': snapshot.loaded_at}
+
+    def find(self, profile: str, min_proportion_matched: float = 0.95, comparison_method: str = 'default',
+             top_k: int = 0) -> dict:
+        snapshot = self.snapshot
+        comparison = jacquard_similarity if comparison_method == 'jaccard' else match
+        matched = find(snapshot.encode(profile_keys(profile)), snapshot.database, min_proportion_matched, comparison,
+                       snapshot.index, top_k)
+        return {'total': len(snapshot.database), 'matches': [_matched_entry(entry, score) for entry, score in matched]}
+
+    def batch(self, profiles: list[str], min_proportion_matched: float = 0.95, comparison_method: str = 'default',
+              top_k: int = 0) -> dict:
+        snapshot = self.snapshot
+        comparison = jacquard_similarity_many if comparison_method == 'jaccard' else match_many
+        queries = stack_profiles([snapshot.encode(profile_keys(profile)) for profile in profiles])
+        matched = find_many(queries, snapshot.database, min_proportion_matched, comparison, snapshot.index, top_k)
+        return {'total': len(snapshot.database),
+                'matches': [[_matched_entry(entry, score) for entry, score in query_matched] for query_matched in matched]}
+
+    def distances(self, profile: str, top_k: int = 10, max_distance: int = None) -> dict:
+        """
+        The sequences closest to a profile by hamming distance: the top_k closest, or all within max_distance.
+        Distances compare the loci by position, so sequences whose profile has another number of loci than the
+        query are left out and counted as `misaligned`.
+        """
+        snapshot = self.snapshot
+        query = snapshot.encode(profile_keys(profile))
+        distances = one_vs_all(query, snapshot.database.profiles)
+        aligned = np.flatnonzero(snapshot.lengths == len(query))
+        rows = aligned[np.argsort(distances[aligned], kind='stable')]
+        if max_distance is not None:
+            rows = rows[distances[rows] <= max_distance]
+        if top_k > 0:
+            rows = rows[:top_k]
+        return {'total': len(snapshot.database), 'misaligned': len(snapshot.database) - len(aligned),
+                'matches': [_matched_entry(snapshot.database[row], int(distances[row]), 'distance') for row in rows]}
+
+
+def _matched_entry(entry: SequenceEntry, score, field: str = 'proportion_matched') -> dict:
+    return {'submission_id': entry.submission_id, 'group_name': entry.group_name, 'group_id': entry.group_id,
+            'collection_date': entry.collection_date, 'location': entry.location, field: score}
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    """
+    JSON API of a QueryService: `GET /status`, and `POST /find`, `/batch` and `/distances` with the arguments
+    of the QueryService methods as a JSON object. Requests name the `source` they expect, a server answering
+    from other profiles replies 409 so that the client queries in process instead.
+    """
+    service: QueryService = None
+    protocol_version = 'HTTP/1.1'
+    # The headers and the body are separate writes, which Nagle's algorithm would hold back for a delayed ACK
+    disable_nagle_algorithm = True
+
+    def _reply(self, status: int, body: dict) -> None:
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        if self.path.rstrip('/') == '/status':
+            self._reply(200, self.service.status())
+        else:
+            self._reply(404, {'error': 'unknown path {}'.format(self.path)})
+
+    def do_POST(self):
+        methods = {'/find': self.service.find, '/batch': self.service.batch, '/distances': self.service.distances}
+        method = methods.get(self.path.rstrip('/'))
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        except ValueError as error:
+            self._reply(400, {'error': 'invalid JSON: {}'.format(error)})
+            return
+        if method is None:
+            self._reply(404, {'error': 'unknown path {}'.format(self.path)})
+            return
+        if request.pop('source', self.service.source) != self.service.source:
+            self._reply(409, {'error': 'this server answers from {}'.format(self.service.source)})
+            return
+        try:
+            self._reply(200, method(**request))
+        except (TypeError, ValueError) as error:
+            self._reply(400, {'error': str(error)})
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(service: QueryService, host: str = '127.0.0.1', port: int = default_server_port) -> ThreadingHTTPServer:
+    handler = type('Handler', (QueryHandler,), {'service': service})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+@click.command()
+@click.option('--store', 'store_path', default=default_store_path, help='Path to the local profile store')
+@click.option('--lapis-url', default=loculus_lapis, help='LAPIS endpoint of the Loculus instance')
+@click.option('--database', 'database_path', default=None,
+              help='Serve a profile database written by profile_db.py instead of the local store')
+@click.option('--refresh', 'refresh_interval', default=300., type=float,
+              help='Seconds between background syncs and reloads, 0 to never refresh')
+@click.option('--no-sync', is_flag=True, default=False, help='Reload the local store when it changes, but never sync it')
+@click.option('--host', default='127.0.0.1', help='Interface to listen on')
+@click.option('--port', default=default_server_port, type=int, help='Port to listen on')
+def main(store_path: str, lapis_url: str, database_path: str, refresh_interval: float, no_sync: bool, host: str,
+         port: int):
+    """
+    Keeps the profiles and their index in memory and answers the find and batch commands of query.py.
+    """
+    service = QueryService(store_path, lapis_url, database_path, refresh_interval, not no_sync)
+    service.start()
+    server = serve(service, host, port)
+    print('Serving {} sequences at http://{}:{}'.format(len(service.snapshot.database), host, server.server_address[1]))
+    try:
+        server.serve_forever()
+    finally:
+        service.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+import numpy as np
+
+try:
+    from codec import KEY_HEX
+except ImportError:
+    from query.codec import KEY_HEX
+
+
+sketch_size = 256
+# Value of a bin that no allele fell into
+EMPTY = np.iinfo(np.uint32).max
+
+def _mix(values: np.ndarray) -> np.ndarray:
+    # splitmix64 finalizer, spreads the allele values over all 64 bits
+    values = values.copy()
+    values ^= values >> np.uint64(30)
+    values *= np.uint64(0xBF58476D1CE4E5B9)
+    values ^= values >> np.uint64(27)
+    values *= np.uint64(0x94D049BB133111EB)
+    values ^= values >> np.uint64(31)
+    return values
+
+
+def sketch_values(values: np.ndarray, called: np.ndarray = None, size: int = sketch_size) -> np.ndarray:
+    """
+    One-permutation MinHash of a profile given as one 64-bit allele value per locus. Every allele is hashed
+    into one of `size` bins and each bin keeps its smallest hash, so the proportion of equal bins between two
+    sketches estimates the Jaccard similarity of the allele sets. As the match counts (see profiles.py) the
+    sketch does not depend on the positions of the alleles.
+    """
+    values = np.asarray(values, dtype=np.uint64)
+    with np.errstate(over='ignore'):
+        mixed = _mix(values)
+    if called is not None:
+        mixed = mixed[called]
+    bins = (mixed % np.uint64(size)).astype(np.int64)
+    sketch = np.full(size, EMPTY, dtype=np.uint32)
+    # The upper bits are independent of the bin, and EMPTY is left out of the range of real values
+    np.minimum.at(sketch, bins, np.minimum(mixed >> np.uint64(32), np.uint64(EMPTY - 1)).astype(np.uint32))
+    return sketch
+
+
+def sketch_hashes(hashes: list[str], size: int = sketch_size) -> np.ndarray:
+    """
+    Sketch of a profile given as its list of per-locus MD5 hashes or allele keys; empty hashes are missing loci.
+    """
+    values = np.array([int(allele_hash[:KEY_HEX], 16) if allele_hash else 0 for allele_hash in hashes], dtype=np.uint64)
+    return sketch_values(values, np.array([allele_hash != '' for allele_hash in hashes], dtype=bool), size)
+
+
+def estimate_jaccard(query: np.ndarray, sketches: np.ndarray) -> np.ndarray:
+    equal = np.count_nonzero((sketches == query) & (query != EMPTY), axis=1)
+    filled = np.count_nonzero((sketches != EMPTY) | (query != EMPTY), axis=1)
+    return equal / np.maximum(filled, 1)
+
+
+def screen(query: np.ndarray, sketches: np.ndarray, min_proportion_matched: float, called: float = 1.0,
+           margin: float = 3.0) -> np.ndarray:
+    """
+    Returns the rows that may reach min_proportion_matched. `called` is the share of the loci of the scheme
+    that the query calls. A profile calls at most all loci, so a match proportion p corresponds to a Jaccard
+    similarity of at least p * called / (1 + called - p * called), p / (2 - p) for a complete query; the
+    threshold is lowered by `margin` standard errors of the estimate so that few true matches are screened out.
+    """
+    shared = min_proportion_matched * called
+    jaccard = shared / (1 + called - shared)
+    standard_error = np.sqrt(max(jaccard * (1 - jaccard), 1 / query.size) / query.size)
+    return np.flatnonzero(estimate_jaccard(query, sketches) >= jaccard - margin * standard_error - 1e-9)
@@ -0,0 +1,339 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import numpy as np
+from typing import Callable, Iterable, Iterator, Optional
+
+try:
+    from profiles import AlleleEncoder, MISSING, UNKNOWN, stack_profiles
+    from sketch import sketch_hashes, sketch_size
+    from codec import profile_keys, allele_keys
+except ImportError:
+    from query.profiles import AlleleEncoder, MISSING, UNKNOWN, stack_profiles
+    from query.sketch import sketch_hashes, sketch_size
+    from query.codec import profile_keys, allele_keys
+
+
+default_store_path = os.path.join(os.path.expanduser('~'), '.cache', 'pathinder', 'profiles.sqlite')
+
+SCHEMA_VERSION = 8
+
+# Size limit of the cached match lists of a store
+default_result_cache_size = 64 << 20
+
+
+class ProfileStore:
+    """
+    Local on-disk copy of the Loculus profiles. Entries are keyed by accession and only the latest
+    version of each accession is kept, so that `sync` can apply the LAPIS changes incrementally.
+    Profiles are stored as uint32 allele codes, the hash behind each code is kept in the alleles table. The codes
+    are shared by all loci (see AlleleEncoder), so profiles whose loci are in another order still match.
+    Each entry also keeps a MinHash sketch of its profile for approximate screening, and the generation that
+    wrote it; removed accessions are kept with the generation that removed them, so that data derived from an
+    older generation (see ResultCache) can be updated with only the changes.
+    """
+
+    def __init__(self, path: str = default_store_path):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.encoder = None
+        self._create_tables()
+
+    def _create_tables(self):
+        with self.connection:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+            if self.get_meta('schema_version') != str(SCHEMA_VERSION):
+                # The store is a cache of the server, so an outdated layout is simply rebuilt on the next sync
+                self.connection.execute('DROP TABLE IF EXISTS entries')
+                self.connection.execute('DROP TABLE IF EXISTS alleles')
+                self.connection.execute('DROP TABLE IF EXISTS removed')
+                self.connection.execute('DROP TABLE IF EXISTS results')
+                self.connection.execute('DELETE FROM meta')
+                self.set_meta('schema_version', str(SCHEMA_VERSION))
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS entries ('
+                'accession TEXT PRIMARY KEY, version INTEGER, released_at INTEGER, '
+                'submission_id TEXT, group_name TEXT, group_id TEXT, collection_date TEXT, location TEXT, '
+                'profile BLOB, sketch BLOB, generation INTEGER)')
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS alleles (hash TEXT PRIMARY KEY, code INTEGER) WITHOUT ROWID')
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS removed (accession TEXT PRIMARY KEY, generation INTEGER) WITHOUT ROWID')
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, generation INTEGER, used_at REAL, '
+                'matches TEXT)')
+
+    def _load_encoder(self) -> AlleleEncoder:
+        if self.encoder is None:
+            self.encoder = AlleleEncoder(dict(self.connection.execute('SELECT hash, code FROM alleles')))
+        return self.encoder
+
+    def allele_encoder(self) -> AlleleEncoder:
+        """
+        Returns the allele codes of the store held in memory, e.g. to encode queries once the store is closed.
+        """
+        return self._load_encoder()
+
+    def get_meta(self, key: str, default: str = None) -> str:
+        row = self.connection.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row is not None else default
+
+    def set_meta(self, key: str, value: str) -> None:
+        self.connection.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, value))
+
+    def generation(self) -> int:
+        """
+        Returns a counter that changes whenever entries are written or removed, to invalidate derived data.
+        """
+        return int(self.get_meta('generation', '0'))
+
+    def _bump_generation(self) -> None:
+        self.set_meta('generation', str(self.generation() + 1))
+
+    def last_released(self) -> int:
+        """
+        Returns the release timestamp of the newest entry, or None if the store has never been synced.
+        """
+        value = self.get_meta('last_released')
+        return int(value) if value is not None else None
+
+    def has_version(self, accession: str, version: int) -> bool:
+        """
+        Returns whether the store holds `accession` in `version` or a later one.
+        """
+        row = self.connection.execute('SELECT version FROM entries WHERE accession = ?', (accession,)).fetchone()
+        return row is not None and row[0] >= version
+
+    def upsert(self, rows: Iterable[dict]) -> int:
+        """
+        Inserts new entries and replaces older versions of existing accessions. Rows of a version that is stored
+        already are skipped, so the generation only changes when an entry is written. Returns the number of rows
+        written.
+        """
+        written = 0
+        last_released = self.last_released() or 0
+        generation = self.generation() + 1
+        with self.connection:
+            for row in rows:
+                hashes = profile_keys(row['profile_hash'])
+                # the allele table is only read once a row arrives, a sync without changes never loads it
+                profile, added = self._load_encoder().encode(hashes)
+                self.connection.executemany('INSERT INTO alleles VALUES (?, ?)', added)
+                cursor = self.connection.execute(
+                    'INSERT INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) '
+                    'ON CONFLICT(accession) DO UPDATE SET version = excluded.version, '
+                    'released_at = excluded.released_at, submission_id = excluded.submission_id, '
+                    'group_name = excluded.group_name, group_id = excluded.group_id, '
+                    'collection_date = excluded.collection_date, location = excluded.location, '
+                    'profile = excluded.profile, sketch = excluded.sketch, generation = excluded.generation '
+                    'WHERE excluded.version > entries.version',
+                    (row['accession'], row['version'], row['released_at'], row['submission_id'], row['group_name'],
+                     row['group_id'], row['collection_date'], row['location'], profile.tobytes(),
+                     sketch_hashes(hashes).tobytes(), generation))
+                written += cursor.rowcount
+                last_released = max(last_released, row['released_at'])
+            self.set_meta('last_released', str(last_released))
+            if written:
+                self._bump_generation()
+        return written
+
+    def remove(self, accessions: Iterable[str]) -> int:
+        removed = 0
+        generation = self.generation() + 1
+        with self.connection:
+            for accession in accessions:
+                if self.connection.execute('DELETE FROM entries WHERE accession = ?', (accession,)).rowcount > 0:
+                    self.connection.execute('INSERT OR REPLACE INTO removed VALUES (?, ?)', (accession, generation))
+                    removed += 1
+            if removed:
+                self._bump_generation()
+        return removed
+
+    def changes_since(self, generation: int) -> tuple[list[str], list[str]]:
+        """
+        Returns the accessions written (new or updated) and removed after `generation`.
+        """
+        written = [row[0] for row in self.connection.execute(
+            'SELECT accession FROM entries WHERE generation > ? ORDER BY accession', (generation,))]
+        removed = [row[0] for row in self.connection.execute(
+            'SELECT accession FROM removed WHERE generation > ?', (generation,))]
+        return written, removed
+
+    def mark_released(self, released_at: int) -> None:
+        with self.connection:
+            self.set_meta('last_released', str(max(self.last_released() or 0, released_at)))
+
+    def entries(self) -> Iterator[tuple]:
+        """
+        Yields (submission_id, group_name, group_id, collection_date, location, profile) for every entry.
+        """
+        for *metadata, profile in self.connection.execute(
+                'SELECT submission_id, group_name, group_id, collection_date, location, profile '
+                'FROM entries ORDER BY accession'):
+            yield (*metadata, np.frombuffer(profile, dtype=np.uint32))
+
+    def load(self) -> tuple[list[tuple], np.ndarray]:
+        """
+        Returns the metadata of all entries and their profiles as one (n_entries, n_loci) uint32 matrix.
+        """
+        # The matrix is allocated up front and filled row by row, so the profiles are never held twice
+        n_entries, max_length = self.connection.execute('SELECT COUNT(*), MAX(LENGTH(profile)) FROM entries').fetchone()
+        metadata = []
+        profiles = np.zeros((n_entries, (max_length or 0) // 4), dtype=np.uint32)
+        for row, (*entry, profile) in enumerate(self.entries()):
+            metadata.append(tuple(entry))
+            profiles[row, :len(profile)] = profile
+        return metadata, profiles
+
+    def load_sketches(self) -> tuple[list[str], list[tuple], np.ndarray]:
+        """
+        Returns the accessions and metadata of all entries and their sketches as one (n_entries, size) matrix.
+        """
+        accessions, metadata, sketches = [], [], []
+        for accession, *entry, sketch in self.connection.execute(
+                'SELECT accession, submission_id, group_name, group_id, collection_date, location, sketch '
+                'FROM entries ORDER BY accession'):
+            accessions.append(accession)
+            metadata.append(tuple(entry))
+            sketches.append(np.frombuffer(sketch, dtype=np.uint32))
+        return accessions, metadata, np.stack(sketches) if sketches else np.zeros((0, sketch_size), dtype=np.uint32)
+
+    def max_loci(self) -> int:
+        """
+        Returns the number of loci of the longest profile.
+        """
+        return (self.connection.execute('SELECT MAX(LENGTH(profile)) FROM entries').fetchone()[0] or 0) // 4
+
+    def profile_lengths(self) -> np.ndarray:
+        """
+        Returns the number of loci of every entry's profile, in the order of entries() and load().
+        """
+        return np.array([row[0] // 4 for row in self.connection.execute(
+            'SELECT LENGTH(profile) FROM entries ORDER BY accession')], dtype=np.int64)
+
+    def accessions(self) -> list[str]:
+        """
+        Returns the accessions of all entries, in the order of entries() and load().
+        """
+        return [row[0] for row in self.connection.execute('SELECT accession FROM entries ORDER BY accession')]
+
+    def load_entries(self, accessions: list[str]) -> list[tuple]:
+        """
+        Returns (submission_id, group_name, group_id, collection_date, location, profile) of the given accessions,
+        in the same order.
+        """
+        entries = []
+        for accession in accessions:
+            *metadata, profile = self.connection.execute(
+                'SELECT submission_id, group_name, group_id, collection_date, location, profile '
+                'FROM entries WHERE accession = ?', (accession,)).fetchone()
+            entries.append((*metadata, np.frombuffer(profile, dtype=np.uint32)))
+        return entries
+
+    def load_profiles(self, accessions: list[str]) -> np.ndarray:
+        """
+        Returns the profiles of the given accessions, in the same order, as one uint32 matrix.
+        """
+        profiles = []
+        for accession in accessions:
+            row = self.connection.execute('SELECT profile FROM entries WHERE accession = ?', (accession,)).fetchone()
+            profiles.append(np.frombuffer(row[0], dtype=np.uint32))
+        return stack_profiles(profiles)
+
+    def encode_query(self, hashes: list[str]) -> np.ndarray:
+        """
+        Encodes a query profile with the codes of the store, alleles it does not know become UNKNOWN.
+        """
+        hashes = allele_keys(hashes)
+        if self.encoder is not None:
+            return self.encoder.encode(hashes, extend=False)[0]
+        codes = np.full(len(hashes), UNKNOWN, dtype=np.uint32)
+        for locus, allele_hash in enumerate(hashes):
+            if allele_hash == '':
+                codes[locus] = MISSING
+                continue
+            row = self.connection.execute('SELECT code FROM alleles WHERE hash = ?', (allele_hash,)).fetchone()
+            if row is not None:
+                codes[locus] = row[0]
+        return codes
+
+    def __len__(self) -> int:
+        return self.connection.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class ResultCache:
+    """
+    Match lists of query profiles, kept in the store by (query digest, comparison method, threshold) together
+    with the generation they were computed at. A list that is behind the store is brought up to date by scoring
+    only the entries written since and dropping the removed ones. The least recently used lists are evicted
+    once all lists take more than max_size bytes.
+    """
+
+    def __init__(self, store: ProfileStore, max_size: int = default_result_cache_size):
+        self.store = store
+        self.max_size = max_size
+
+    @staticmethod
+    def key(hashes: list[str], comparison_method: str, min_proportion_matched: float) -> str:
+        digest = hashlib.md5(','.join(allele_keys(hashes)).encode()).hexdigest()
+        return '{}:{}:{!r}'.format(digest, comparison_method, float(min_proportion_matched))
+
+    def get(self, key: str, hashes: list[str], comparison: Callable[[np.ndarray, np.ndarray], np.ndarray],
+            min_proportion_matched: float) -> Optional[list[tuple[str, float]]]:
+        """
+        Returns the (accession, proportion matched) of the matches of a query, best first, or None if the query
+        has no cached list. `comparison` scores the encoded query against a profile matrix; the query is only
+        encoded, and the allele codes loaded, to score the entries written since the list was cached.
+        """
+        row = self.store.connection.execute('SELECT generation, matches FROM results WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        generation, matches = row[0], [tuple(match) for match in json.loads(row[1])]
+        current = self.store.generation()
+        if generation == current:
+            with self.store.connection:
+                self.store.connection.execute('UPDATE results SET used_at = ? WHERE key = ?', (time.time(), key))
+            return matches
+        written, removed = self.store.changes_since(generation)
+        outdated = set(written) | set(removed)
+        matches = [match for match in matches if match[0] not in outdated]
+        if written:
+            scores = comparison(self.store.encode_query(hashes), self.store.load_profiles(written))
+            matches.extend((accession, float(score)) for accession, score in zip(written, scores)
+                           if score >= min_proportion_matched)
+            matches.sort(key=lambda match: (-match[1], match[0]))
+        self.put(key, current, matches)
+        return matches
+
+    def put(self, key: str, generation: int, matches: list[tuple[str, float]]) -> None:
+        """
+        Caches the matches of a query at `generation`, unless a list of a newer generation is cached already.
+        """
+        with self.store.connection:
+            self.store.connection.execute(
+                'INSERT INTO results VALUES (?, ?, ?, ?) ON CONFLICT(key) DO UPDATE SET '
+                'generation = excluded.generation, used_at = excluded.used_at, matches = excluded.matches '
+                'WHERE excluded.generation >= results.generation',
+                (key, generation, time.time(), json.dumps(matches)))
+            size = self.store.connection.execute('SELECT COALESCE(SUM(LENGTH(matches)), 0) FROM results').fetchone()[0]
+            if size <= self.max_size:
+                return
+            for cached_key, length in self.store.connection.execute(
+                    'SELECT key, LENGTH(matches) FROM results ORDER BY used_at').fetchall():
+                if size <= self.max_size:
+                    break
+                self.store.connection.execute('DELETE FROM results WHERE key = ?', (cached_key,))
+                size -= length
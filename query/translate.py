@@ -0,0 +1,73 @@
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Union
+
+
+# Base codes: A, C, G, T are 0-3 in either case, a gap is GAP and anything else INVALID
+INVALID, GAP = 4, 5
+_base_codes = np.full(256, INVALID, dtype=np.uint8)
+_base_codes[np.frombuffer(b'ACGTacgt', dtype=np.uint8)] = [0, 1, 2, 3, 0, 1, 2, 3]
+_complement = np.array([3, 2, 1, 0, INVALID, GAP], dtype=np.uint8)
+
+standard_code = 'KNKNTTTTRSRSIIMIQHQHPPPPRRRRLLLLEDEDAAAAGGGGVVVVXYXYSSSSXCWCLFLF'
+
+
+def codon_table(genetic_code: str = standard_code, invalid: str = 'X', gap: str = 'X') -> np.ndarray:
+    """
+    Amino acid byte of every codon of base codes, indexed by c0 * 36 + c1 * 6 + c2. genetic_code lists the
+    64 ACGT codons in the order AAA, AAC, ... TTT; codons with a gap become `gap`, other codons with anything
+    but a base become `invalid`.
+    """
+    codons = np.arange(216)
+    bases = np.stack([codons // 36, codons // 6 % 6, codons % 6])
+    table = np.frombuffer(genetic_code.encode(), dtype=np.uint8)[np.sum(np.minimum(bases, 3) << np.array([[4], [2], [0]]), axis=0)]
+    table = np.where(np.any(bases == INVALID, axis=0), ord(invalid), table)
+    return np.where(np.any(bases == GAP, axis=0), ord(gap), table).astype(np.uint8)
+
+
+def encode(sequence: Union[bytes, str], gaps: bool = False) -> np.ndarray:
+    """
+    Base codes of a sequence; '-' is a GAP if gaps is set and INVALID otherwise.
+    """
+    raw = np.frombuffer(sequence.encode('latin-1') if isinstance(sequence, str) else sequence, dtype=np.uint8)
+    codes = _base_codes[raw]
+    if gaps:
+        codes[raw == ord('-')] = GAP
+    return codes
+
+
+def reverse_complement(codes: np.ndarray) -> np.ndarray:
+    return _complement[codes[::-1]]
+
+
+def translate_positions(codes: np.ndarray, table: np.ndarray) -> np.ndarray:
+    """
+    Amino acid of the codon starting at every position, so that frame f (0-2) is the result[f::3]; the codons
+    running over the end are completed with INVALID. All three frames take one table lookup.
+    """
+    padded = np.concatenate([codes, [INVALID, INVALID]]).astype(np.uint16)
+    return table[padded[:-2] * 36 + padded[1:-1] * 6 + padded[2:]]
+
+
+def translate_frames(forward: np.ndarray, reverse: np.ndarray, frames: Iterable[int], table: np.ndarray) -> list[str]:
+    """
+    Translations of frames 1-3 of `forward` and 4-6 of `reverse`, both given as base codes.
+    """
+    strands = {}
+    result = []
+    for frame in frames:
+        strand = frame > 3
+        if strand not in strands:
+            strands[strand] = translate_positions(reverse if strand else forward, table)
+        result.append(strands[strand][(frame - 1) % 3::3].tobytes().decode('latin-1'))
+    return result
+
+
+def map_sequences(function, sequences: list, n_thread: int = 1) -> list:
+    """
+    function applied to every sequence, on n_thread threads; NumPy releases the GIL in the table lookups.
+    """
+    if n_thread <= 1 or len(sequences) < 2:
+        return [function(sequence) for sequence in sequences]
+    with ThreadPoolExecutor(n_thread) as executor:
+        return list(executor.map(function, sequences))
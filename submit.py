@@ -3,6 +3,7 @@ import requests
 import getpass
 import tempfile
 import csv
+from query.codec import is_dictionary_coded
 
 
 KEYCLOAK_TOKEN_URL = "https://authentication-microbioinfo-hackathon.loculus.org/realms/loculus/protocol/openid-connect/token"
@@ -22,7 +23,8 @@ def generate_placeholder_fasta(submission_ids: list[str]) -> str:
 
 def get_submission_ids_from_tsv(file_path: str) -> list[str]:
     """
-    Reads a TSV file and extracts submission IDs by parsing the "submissionId" column.
+    Reads a TSV file and extracts submission IDs by parsing the "submissionId" column. Dictionary-coded
+    profiles (see query/codec.py) are refused, as they cannot be read without the rows before them.
     """
     submission_ids = []
     with open(file_path, 'r') as tsv_file:
@@ -34,6 +36,9 @@ def get_submission_ids_from_tsv(file_path: str) -> list[str]:
 
         # Extract submission IDs from the "submissionId" column
         for row in reader:
+            if is_dictionary_coded(row.get('profileHash') or ''):
+                raise ValueError(f'Error: the profile of {row["submissionId"]} is dictionary-coded, '
+                                 'expand the file with "query/query.py convert --expand" before submitting it.')
             submission_ids.append(row['submissionId'])
 
     return submission_ids
@@ -98,9 +103,9 @@ def submit(authentication_token: str, group_id: int, tsv_path: str, fasta_path:
 @click.option('--group-id', required=True, type=int, help='The ID of the group for which you are submitting')
 @click.option('--username', required=True, help='Your username')
 def main(input: str, group_id: int, username: str):
+    submission_ids = get_submission_ids_from_tsv(input)
     password = ask_for_password()
     authentication_token = get_loculus_authentication_token(username, password)
-    submission_ids = get_submission_ids_from_tsv(input)
     placeholder_fasta_str = generate_placeholder_fasta(submission_ids)
 
     # Write the placeholder FASTA to a temporary file